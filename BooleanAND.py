@@ -41,9 +41,9 @@ def BooleanAND(index_wd, queries_file, output_file):
         term_ids = query.conv_tokens_to_ids(tokens) # lexicon used term->termid
         print("matching ids: {}".format(str(term_ids)))
         res_docids, res_counts = query.BooleanAND(term_ids) # find intersection of termid's
-        print("AND result: {}, {}".format(str(res_docids), res_counts))
-        for inx, docid in enumerate(res_docids):
-            docno = query.docid_to_metadata(docid).docno.strip()
+        print("AND result: {} docs".format(len(res_docids)))
+        for inx, docid in enumerate(res_docids.tolist()):
+            docno = query.docid_to_docno[docid].strip()
             rank = inx + 1
             score = 10000 - inx*10
             res_doc_str = "{topid} q0 {docno} {rank} {score} {run_tag}"\
@@ -29,7 +29,7 @@ import os
 import sys
 import pickle
 import gzip
-from index_helpers import MetaData
+from index_helpers import MetaData, MetaStore
 
 
 def validate_args(args):
@@ -85,6 +85,19 @@ def GetDoc(index_wd, key, value):
     else:
         print("The following key: {} is invalid.  Pass: 'docid' or 'docno'".format(key))
         return False
+    metaStore = MetaStore(index_wd)
+    if metaStore.exists():
+        docno_to_docid = {docno: docid for docid, docno in
+                          pickle.load(open(docid_to_docno_path, "rb")).items()}
+        if docno not in docno_to_docid:
+            print("The following docno: {} was not found.".format(value))
+            return False
+        metaStore.load()
+        metadata = metaStore.get(docno_to_docid[docno])
+        metadata.meta_print()
+        return True
+
+    # index built with one gzip pickle per doc:
     docno_to_data = pickle.load(open(docno_to_data_path, "rb"))
 
     if docno not in docno_to_data:
@@ -0,0 +1,45 @@
+"""Impact Index Engine.
+
+Builds an impact ordered copy of an index built by IndexEngine.py, storing
+quantized BM25 scores (for the given k1 and b) per posting, and the k2 the
+query terms are weighted with, so fixed parameter BM25 queries only add
+integers (see impact_helpers.py and Query.impact_search).
+
+Example
+-------
+literal blocks::
+    $ python ImpactIndexEngine.py <index_wd> [--k1 1.2] [--b 0.75] [--k2 7]
+        [--bits 8]
+
+    $ python ImpactIndexEngine.py /Users/nikhilarora/data/latimes/index_dir_baseline
+"""
+import os
+import sys
+import argparse
+from index_helpers import timing
+from impact_helpers import build_impact_index
+
+parser = argparse.ArgumentParser(description='Builds an impact ordered index \
+    from an existing index dir.')
+parser.add_argument('index_wd', help='Path to the index built by IndexEngine.py')
+parser.add_argument('--k1', type=float, default=1.2, help='BM25 k1')
+parser.add_argument('--b', type=float, default=0.75, help='BM25 b')
+parser.add_argument('--k2', type=float, default=7, help='BM25 k2')
+parser.add_argument('--bits', type=int, default=8,
+    help='Size of the signed quantized impacts (2 to 16)')
+
+
+@timing
+def impact_index_engine(index_wd, k1, b, bits, k2=7):
+    header = build_impact_index(index_wd, k1=k1, b=b, bits=bits, k2=k2)
+    print("Impact index built with k1={k1}, b={b}, k2={k2}, {bits} bit impacts "
+          "(scale {scale}), {n_postings} postings".format(**header))
+
+
+if __name__ == '__main__':
+    cli = parser.parse_args()
+    if not os.path.isfile(os.path.join(cli.index_wd, 'InvertedIndex')):
+        print('Current dir: {} does not hold an index.'.format(cli.index_wd))
+        print('Exiting program.')
+        sys.exit()
+    impact_index_engine(cli.index_wd, cli.k1, cli.b, cli.bits, cli.k2)
@@ -11,31 +11,115 @@ literal blocks::
     $ python IndexEngine.py /Users/nikhilarora/data/latimes/latimes.gz /Users/nikhilarora/data/latimes/index_dir_test
     $ python IndexEngine.py /Users/nikhilarora/data/latimes/latimes_sample.txt.gz /Users/nikhilarora/data/latimes/index_dir_sample
     $ python IndexEngine.py /Users/nikhilarora/data/latimes/latimes.gz /Users/nikhilarora/data/latimes/index_dir_baseline
-    $ python IndexEngine.py /Users/nikhilarora/data/latimes/latimes.gz /Users/nikhilarora/data/latimes/index_dir_stem
+
+    bounded memory (SPIMI) build, flushing sorted runs every ~512 MB:
+    $ python IndexEngine.py /Users/nikhilarora/data/latimes/latimes.gz /Users/nikhilarora/data/latimes/index_dir_spimi --mem-budget 512
+
+    parsing with 8 worker processes (same index as the serial build):
+    $ python IndexEngine.py /Users/nikhilarora/data/latimes/latimes.gz /Users/nikhilarora/data/latimes/index_dir_test --workers 8
+
+    Porter stemmed index (queries against it are stemmed too):
+    $ python IndexEngine.py /Users/nikhilarora/data/latimes/latimes.gz /Users/nikhilarora/data/latimes/index_dir_stem --stem
+
+    splitting and parsing docs without ElementTree (same index):
+    $ python IndexEngine.py /Users/nikhilarora/data/latimes/latimes.gz /Users/nikhilarora/data/latimes/index_dir_test --fast-parse
+
+    storing the positions of the terms for phrase and proximity queries:
+    $ python IndexEngine.py /Users/nikhilarora/data/latimes/latimes.gz /Users/nikhilarora/data/latimes/index_dir_test --positions
+
+    document-partitioned index of 4 shards (see shard_helpers):
+    $ python IndexEngine.py /Users/nikhilarora/data/latimes/latimes.gz /Users/nikhilarora/data/latimes/index_dir_shards --shards 4
+
+    adding a new batch of docs to an existing index as a segment (see
+    segment_helpers), segments are then merged in the background:
+    $ python IndexEngine.py /Users/nikhilarora/data/latimes/latimes_new.gz /Users/nikhilarora/data/latimes/index_dir_test --append
+
+Every index also stores the sentences of the TEXT of each doc and their
+termids, used for query-biased snippets (see snippet_helpers).
 """
 import os
 import sys
 import gzip
+import shutil
+import subprocess
 import re
 import pickle
 import itertools
+import argparse
+import functools
+from array import array
 from datetime import date
+import numpy as np
 from index_helpers import (doc_gen,
                            timing,
                            DocParser,
                            MetaData,
+                           MetaStore,
                            Lexicon,
-                           InvIndex)
+                           InvIndex,
+                           DocStats,
+                           Tokenizer)
+from spimi_helpers import SpimiIndexer
+from snippet_helpers import SnippetStore, encode_sentences
+from segment_helpers import SegmentManifest, SegmentedLexicon
+from shard_helpers import shard_name, save_shards
+from positions_helpers import PositionsWriter, PositionsReader
+from pipeline_helpers import parallel_parse
+from stem_helpers import Stemmer
+
+parser = argparse.ArgumentParser(description='Builds the inverted index, \
+    lexicon and metastore of a latimes.gz collection.')
+parser.add_argument('data_path', help='Path to latimes.gz')
+parser.add_argument('index_wd', help='Path where the new index is stored')
+parser.add_argument('--mem-budget', type=float, default=None,
+    help='Memory budget (MB) for postings, enables the SPIMI build that \
+    flushes sorted runs to disk and merges them at the end')
+parser.add_argument('--inversion', choices=['append', 'sort'],
+    default='append', help='In memory inversion strategy: append postings \
+    doc by doc or invert the whole collection with one sort')
+parser.add_argument('--quantize-norms', action='store_true',
+    help='Also store 1 byte quantized doc length norms')
+parser.add_argument('--fast-parse', action='store_true',
+    help='Split the collection from byte chunks and extract the doc fields \
+    without building an xml tree')
+parser.add_argument('--stem', action='store_true',
+    help='Porter stem the tokens, the stem table is saved with the index')
+parser.add_argument('--workers', type=int, default=None,
+    help='Parse docs in this many worker processes (reader -> parsers -> \
+    ordered writer pipeline) instead of in the main process')
+parser.add_argument('--positions', action='store_true',
+    help='Also store the positions of the terms in each doc (positional \
+    index for phrase and proximity queries), in memory builds only')
+parser.add_argument('--shards', type=int, default=None,
+    help='Split the collection round robin into this many document-partitioned \
+    shards, each a full index in index_wd/shard_NNN.  The shards are built \
+    one after the other, each reading the whole collection')
+parser.add_argument('--append', action='store_true',
+    help='Add the docs to the existing index at index_wd as a new segment, \
+    stemmed and with positions if the index is')
+parser.add_argument('--no-merge', action='store_true',
+    help='With --append, do not start merging the segments in the background')
 
 
-def validate_args(args):
-    if len(args) != 3:
-        print("Incorrect number of arguments.")
+def validate_args(cli):
+    data_path = cli.data_path
+    index_wd = cli.index_wd
+    if cli.workers is not None and cli.workers < 1:
+        print("--workers must be at least 1.")
+        cli_help_msg()
+        sys.exit()
+    if cli.shards is not None and (cli.shards < 1 or cli.append):
+        print("--shards must be at least 1 and can't be used with --append.")
+        cli_help_msg()
+        sys.exit()
+    if cli.mem_budget is not None and cli.mem_budget <= 0:
+        print("--mem-budget must be a positive number of MB.")
+        cli_help_msg()
+        sys.exit()
+    if cli.positions and cli.mem_budget is not None:
+        print("--positions can't be used with --mem-budget.")
         cli_help_msg()
         sys.exit()
-
-    data_path = args[1]
-    index_wd = args[2]
     #check the data_path exists
     if not os.path.isfile(data_path) or not data_path.endswith('.gz'):
         print('Current path: {} is an invalid path to latimes.gz.  Please provide \
@@ -43,16 +127,34 @@ def validate_args(args):
         print('Exiting program.')
         sys.exit()
 
+    if cli.append:
+        #check that index_wd holds an index segments can be added to
+        if not os.path.isfile(os.path.join(index_wd, 'lexicon_stats.npy')) or \
+                not MetaStore(index_wd).exists():
+            print('Current dir: {} does not hold an index segments can be \
+                    added to (rebuild it first).'.format(index_wd))
+            print('Exiting program.')
+            sys.exit()
+        # the segment gets positions if the index has them (see
+        # append_segment), which can't be built with --mem-budget:
+        if cli.mem_budget is not None and PositionsReader.exists(index_wd):
+            print("--mem-budget can't be used to --append to an index with "
+                  "positions.")
+            cli_help_msg()
+            sys.exit()
+        return
     #check that index_wd does not exist
     if os.path.isdir(index_wd):
         print('Current dir: {} already exists and cannot be used to store the \
                 new index.'.format(index_wd))
         print('Exiting program.')
         sys.exit()
-# NOTE: Metastore currently takes 3 minutes to populate with current data
 # full index process including dumping to disk:
 @timing
-def index_engine(data_path, index_wd):
+def index_engine(data_path, index_wd, mem_budget=None, inversion='append',
+                 quantize_norms=False, workers=None, fast_parse=False,
+                 stem=False, base_lexicon=None, first_termid=0, shard=None,
+                 positions=False):
     """Main entry to the index engine responsible for processing all the
     documents for fast and efficient retrieval at a later time.
 
@@ -62,83 +164,303 @@ def index_engine(data_path, index_wd):
         Path to the dataset being indexed.
     index_wd : str
         Unused path where index and org'd docs are to be stored.
+    mem_budget : int, optional
+        Memory budget (MB) for the postings.  When set, postings are built
+        SPIMI style: sorted runs are flushed to disk whenever the budget is
+        reached and k-way merged into the Lexicon/InvIndex at the end,
+        instead of holding every document's tokens until the end.
+    inversion : str
+        In memory build only, either 'append' (postings appended doc by doc)
+        or 'sort' (one sort over the termids of the whole collection).
+    quantize_norms : bool
+        Store 1 byte quantized doc length norms next to doc_lens.npy
+    workers : int, optional
+        Number of processes parsing docs in parallel, docids are still
+        assigned in collection order so the index is the same as the serial
+        (workers=None) build.
+    fast_parse : bool
+        Use the fast (byte chunk splitting, no xml tree) modes of doc_gen and
+        DocParser, the index is the same.
+    stem : bool
+        Porter stem the tokens and save the stem table to stem_table.p
+    base_lexicon : SegmentedLexicon, optional
+        Lexicon of the index a segment is built for, only the terms not in
+        it are stored in the Lexicon (a delta), with termids from
+        first_termid on.
+    first_termid : int
+    shard : (int, int), optional
+        (i, n) to only index every n-th doc from the i-th (0 based), the
+        i-th of n shards
+    positions : bool
+        Also write the positions of the terms in each doc (see
+        positions_helpers), in memory build only
 
     Returns
     -------
     None
     """
     print("Starting the indexing engine.")
+    if positions and mem_budget is not None:
+        raise ValueError("Positions are only stored by in memory builds.")
 
-    docno_to_data = {}
     docid_val = 0
     N = 0 # coll length
     coll_token_sum = 0
 
     docid_to_docno = {}
+    doc_lens = array('I', [0]) # docid indexed, docids start at 1
     tokens_dict = {} # dict of docid:tokens_ls
+    spimi = None
+    if mem_budget is not None:
+        spimi = SpimiIndexer(index_wd, mem_budget*1024*1024)
+    metaStore = MetaStore(index_wd)
+    metaStore.open_writer()
+    snippetStore = SnippetStore(index_wd)
+    snippetStore.open_writer()
 
-    # grab the file steam
-    fstream = gzip.open(data_path, 'rt', encoding='utf-8')
+    parse = functools.partial(parse_doc, fast=fast_parse, stem=stem)
+    stem_tables = [] # of the worker processes
+    if workers is None:
+        # grab the file steam
+        fstream = gzip.open(data_path, 'rt', encoding='utf-8')
+        docs = doc_gen(fstream, fast=fast_parse)
+        if shard is not None:
+            docs = itertools.islice(docs, shard[0], None, shard[1])
+        parsed_docs = map(parse, docs)
+    else:
+        print("Parsing with {} worker processes".format(workers))
+        parsed_docs = parallel_parse(data_path, parse, workers,
+            fast=fast_parse, finish=get_stem_table, finished=stem_tables,
+            shard=shard)
     # main index loop.
-    for doc in doc_gen(fstream):
+    for doc, docno, headline, date, doc_len, tokens, sentences in parsed_docs:
         N += 1
         print("Current {docid_val}".format(docid_val=docid_val))
         print("Current doc has length: {}".format(len(doc)))
 
         docid_val += 1
         docid = docid_val
-        doc_parser = DocParser(doc)
-        docno = cln_docno(doc_parser.cont_dict['DOCNO'])
-        if 'HEADLINE' in doc_parser.cont_dict:
-            headline = doc_parser.cont_dict['HEADLINE']
-        else:
-            headline = ''
-        date = get_date(docno)
-        doc_len = doc_parser.doc_len
         coll_token_sum += doc_len
         print('summed coll_token_sum: {}'.format(str(coll_token_sum)))
-        doc_path = get_doc_path(index_wd, docno)
-        metadata = MetaData(doc_path,
+        metadata = MetaData(None,
                             docno=docno,
                             docid=docid,
                             date=date,
                             hl=headline,
                             raw_doc=doc,
                             doc_len=doc_len)
-        metadata.save()
-        docno_to_data[docno] = doc_path
+        metaStore.add(metadata)
+        snippetStore.add(docid, sentences)
         docid_to_docno[docid] = docno
-        tokens_dict[docid] = doc_parser.tokens
+        doc_lens.append(doc_len)
+        if spimi is None:
+            tokens_dict[docid] = tokens
+        else:
+            spimi.add_doc(docid, tokens)
+
+    metaStore.close()
+    snippetStore.close()
+    stemmer = None
+    if stem:
+        print("Saving the stem table")
+        stemmer = Stemmer(index_wd)
+        stemmer.update(STEMMER.table)
+        for table in stem_tables:
+            stemmer.update(table)
+        stemmer.save()
+    print("Saving doc stats")
+    DocStats(index_wd).save(doc_lens, quantize=quantize_norms)
+
+    if spimi is not None:
+        lexicon = spimi_merge(index_wd, spimi, N, coll_token_sum, doc_lens,
+                              base_lexicon, first_termid)
+        save_sentence_termids(snippetStore, lexicon, stemmer)
+        print("Saving docid_to_docno")
+        pickle_obj(index_wd, 'docid_to_docno', docid_to_docno)
+        return
 
     print("Flattening tokens list")
     flat_tokens_ls = itertools.chain.from_iterable(tokens_dict.values())
-    print("Creating & saving Lexicon")
-    lexicon = Lexicon(index_wd, tokens=flat_tokens_ls)
+    print("Creating Lexicon")
+    lexicon = Lexicon(index_wd, tokens=flat_tokens_ls, base=base_lexicon,
+                      first_termid=first_termid)
     lexicon.create_lexicon_mappings()
-    lexicon.save()
-    print("Creating & saving docno_to_data")
-    pickle_obj(index_wd, 'docno_to_data', docno_to_data)
+    print("Saving docid_to_docno")
     pickle_obj(index_wd, 'docid_to_docno', docid_to_docno)
 
     invIndex = InvIndex(save_path=index_wd)
     invIndex.coll_len = N
     invIndex.coll_token_sum = coll_token_sum
+    invIndex.doc_lens = doc_lens # to store per term BM25 score bounds
     #using the created lexicon, we will now
+    invert_tokens(lexicon, invIndex, tokens_dict, inversion)
+
+    print("Saving Lexicon")
+    lexicon.set_dfs(invIndex)
+    lexicon.save()
+    save_sentence_termids(snippetStore, lexicon, stemmer)
+    print("Saving the inverted index")
+    invIndex.save()
+    if positions:
+        save_positions(index_wd, lexicon, tokens_dict)
+
+
+
+def invert_tokens(lexicon, invIndex, tokens_dict, inversion='append'):
+    """Fills invIndex with the postings of tokens_dict (docid: tokens_ls)."""
+    print("Building inv index ({} inversion)".format(inversion))
+    if inversion == 'append':
+        for docid, tokens_vect in tokens_dict.items():
+            # convert the doc token vectors using the lexicon
+            termids, counts = lexicon.conv_tokens_array(tokens_vect)
+            invIndex.add_doc_postings(docid, termids, counts)
+    elif inversion == 'sort':
+        termids_ls, docids_ls, counts_ls = [], [], []
+        for docid, tokens_vect in tokens_dict.items():
+            termids, counts = lexicon.conv_tokens_array(tokens_vect)
+            termids_ls.append(termids)
+            docids_ls.append(np.full(len(termids), docid, dtype=np.uint32))
+            counts_ls.append(counts)
+        if termids_ls:
+            invIndex.invert(np.concatenate(termids_ls),
+                            np.concatenate(docids_ls),
+                            np.concatenate(counts_ls))
+    else:
+        raise ValueError("Unknown inversion: {}".format(inversion))
+
+def save_positions(index_wd, lexicon, tokens_dict):
+    """Writes the positions of the terms of tokens_dict (docid: tokens_ls)"""
+    print("Saving positions")
+    positionsWriter = PositionsWriter(index_wd)
+    term_2_termid = lexicon.term_2_termid
     for docid, tokens_vect in tokens_dict.items():
-        print("Building inv index: Current {docid_val}".format(docid_val=docid))
-        # convert the doc token vectors using the lexicon
-        termid_counts = lexicon.conv_tokens_vect(tokens_vect)
-        for termid, count in termid_counts.items():
-            invIndex.add_term_posting(termid, docid, count)
+        positionsWriter.add_doc(docid, [term_2_termid[token]
+                                        for token in tokens_vect])
+    positionsWriter.close()
 
+def spimi_merge(index_wd, spimi, N, coll_token_sum, doc_lens,
+                base_lexicon=None, first_termid=0):
+    """Merges the SPIMI runs into the final Lexicon and InvIndex and saves
+    both to index_wd.
+    Returns: the Lexicon
+    """
+    lexicon = Lexicon(index_wd, base=base_lexicon, first_termid=first_termid)
+    invIndex = InvIndex(save_path=index_wd)
+    invIndex.coll_len = N
+    invIndex.coll_token_sum = coll_token_sum
+    invIndex.doc_lens = doc_lens
+    # merged postings are streamed straight to the postings file:
+    invIndex.open_writer()
+    spimi.merge_into(lexicon, invIndex)
+    print("Saving Lexicon")
+    lexicon.save()
     print("Saving the inverted index")
     invIndex.save()
+    return lexicon
+
+def shard_engine(data_path, index_wd, n_shards, **kwargs):
+    """Indexes data_path into n_shards document-partitioned shards of
+    index_wd (see shard_helpers), one after the other.  kwargs are passed to
+    index_engine.
+    Each shard is its own index_engine pass over data_path skipping the
+    other shards' docs, so the collection is read and split into docs
+    n_shards times (only the shard's own docs are parsed): a build costs
+    n_shards reads of the collection but holds a single shard in memory.
+    """
+    for shard in range(n_shards):
+        print("Indexing shard {} of {}".format(shard + 1, n_shards))
+        index_engine(data_path, os.path.join(index_wd, shard_name(shard)),
+                     shard=(shard, n_shards), **kwargs)
+    save_shards(index_wd, n_shards)
 
+def append_segment(data_path, index_wd, merge=True, **kwargs):
+    """Indexes data_path into a new segment of the index at index_wd (see
+    segment_helpers) and adds it to the manifest.  The manifest stays locked
+    meanwhile so concurrent appends don't hand out the same termids.
+    kwargs are passed to index_engine, stem, positions and quantize_norms
+    follow the index.
+    With merge merge_segments.py is then started in the background.
+    Returns: the name of the segment, None if data_path held no doc
+    """
+    segments = SegmentManifest(index_wd)
+    kwargs['stem'] = Stemmer(index_wd).exists()
+    kwargs['positions'] = PositionsReader.exists(index_wd)
+    kwargs['quantize_norms'] = DocStats(index_wd).has_norms()
+    with segments.lock():
+        base_lexicon = Lexicon(index_wd)
+        base_lexicon.load()
+        manifest = segments.load(next_termid=len(base_lexicon))
+        lexicons = [base_lexicon]
+        for entry in manifest['segments']:
+            lexicons.append(Lexicon(segments.segment_dir(entry['name'])))
+            lexicons[-1].load()
+        name, segment_wd = segments.new_segment_dir(manifest)
+        print("Adding segment {}".format(name))
+        os.makedirs(segment_wd)
+        index_engine(data_path, segment_wd,
+                     base_lexicon=SegmentedLexicon(lexicons),
+                     first_termid=manifest['next_termid'], **kwargs)
+        invIndex = InvIndex(segment_wd)
+        invIndex.load()
+        if invIndex.coll_len == 0:
+            print("No doc to add.")
+            shutil.rmtree(segment_wd)
+            return None
+        lexicon = Lexicon(segment_wd)
+        lexicon.load()
+        manifest['next_termid'] += len(lexicon)
+        manifest['segments'].append({'name': name,
+                                     'n_docs': invIndex.coll_len,
+                                     'coll_token_sum': invIndex.coll_token_sum})
+        segments.save(manifest)
+    print("Index has {} segments".format(len(manifest['segments'])))
+    if merge:
+        merger = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'merge_segments.py')
+        log_path = os.path.join(segments.segments_dir, 'merge.log')
+        # the merger keeps its own copy of the log's fd:
+        with open(log_path, 'a') as log:
+            subprocess.Popen([sys.executable, merger, index_wd], stdout=log,
+                             stderr=subprocess.STDOUT, start_new_session=True)
+        print("Merging segments in the background")
+    return name
 
+def save_sentence_termids(snippetStore, lexicon, stemmer=None):
+    """Writes the termids of the stored sentences, tokenized like the docs
+    (stemmed with stemmer if given).
+    """
+    print("Saving sentence termids")
+    tokenizer = Tokenizer(stemmer)
+    snippetStore.write_termids(lexicon.term_2_termid.__getitem__,
+        functools.partial(tokenizer.tokenize, stem=stemmer is not None))
 
 #-------------------------------------------------------------------------------
 # Helper functions:
 
+# stems the tokens of parse_doc, one per process:
+STEMMER = Stemmer()
+
+def parse_doc(doc, fast=False, stem=False):
+    """Parses a raw doc (fast: without an xml tree, stem: Porter stemming the
+    tokens).
+    Returns: (doc, docno, headline, date, doc_len, tokens, sentences), with
+    sentences the SnippetStore record of the TEXT
+    """
+    doc_parser = DocParser(doc, fast=fast, stemmer=STEMMER if stem else None)
+    docno = cln_docno(doc_parser.cont_dict['DOCNO'])
+    if 'HEADLINE' in doc_parser.cont_dict:
+        headline = doc_parser.cont_dict['HEADLINE']
+    else:
+        headline = ''
+    date = get_date(docno)
+    sentences = encode_sentences(doc_parser.cont_dict.get('TEXT') or '')
+    return (doc, docno, headline, date, doc_parser.doc_len, doc_parser.tokens,
+            sentences)
+
+def get_stem_table():
+    """Returns the stem table built by parse_doc in this process"""
+    return STEMMER.table
+
 def cln_docno(r_docno):
     """clean any unwanted chars from the item and returns a clean string
     Example
@@ -157,31 +479,6 @@ def get_date(docno):
     year = int('19' + docno[6:8])
     return date(day=day, month=month, year=year).strftime('%B %d, %Y')
 
-def get_doc_path(index_wd, docno):
-    """ combines the index_wd (module lvl var) with docno to build path in
-    the form of <index_wd>/metastore/YY/MM/DD/NNNN
-
-    Notes
-    -----
-         - metadata will be stored at <index_wd>/YY/MM/DD/NNNN_meta.gz
-         - full raw doc will be stored at <index_wd>/YY/MM/DD/NNNN_r.gz
-
-    Parameters
-    ----------
-    docno : string
-        expect format of string is "LAMMDDYY-NNNN" -->
-    Returns
-    -------
-    string : "metastore/YY/MM/DD/NNNN.gz"
-        basepath for meta and raw data to be stored and later retrieved.
-    """
-    YY = docno[6:8].strip()
-    MM = docno[2:4].strip()
-    DD = docno[4:6].strip()
-    NNNN = docno[9:].strip()
-
-    return os.path.join(index_wd, 'metastore',YY, MM, DD, NNNN)
-
 # NOTE: Can update the method below to support compression writes...
 def pickle_obj(index_wd, dict_name, dict):
     """Will persist obj to disk for retriaval and usage later."""
@@ -191,13 +488,35 @@ def pickle_obj(index_wd, dict_name, dict):
 def cli_help_msg():
     msg ='''
     usage: python IndexEngine.py <path_to_latimes.gz> <path_to_index>
+                                 [--mem-budget MB] [--inversion append|sort]
+                                 [--quantize-norms] [--workers N]
+                                 [--fast-parse] [--stem]
+                                 [--positions] [--shards N]
+                                 [--append [--no-merge]]
     '''
     print(msg)
 
 if __name__ == '__main__':
 
-    validate_args(sys.argv)
+    cli = parser.parse_args()
+    validate_args(cli)
     print("Indexing the following data file: {} \n and storing index in: {}"\
-            .format(sys.argv[1], sys.argv[2]))
-    index_engine(sys.argv[1], sys.argv[2])
-    print("Finished processing the file: {}".format(sys.argv[1]))
+            .format(cli.data_path, cli.index_wd))
+    if cli.append:
+        append_segment(cli.data_path, cli.index_wd, merge=not cli.no_merge,
+                       mem_budget=cli.mem_budget, inversion=cli.inversion,
+                       quantize_norms=cli.quantize_norms, workers=cli.workers,
+                       fast_parse=cli.fast_parse)
+    elif cli.shards is not None:
+        shard_engine(cli.data_path, cli.index_wd, cli.shards,
+                     mem_budget=cli.mem_budget, inversion=cli.inversion,
+                     quantize_norms=cli.quantize_norms, workers=cli.workers,
+                     fast_parse=cli.fast_parse, stem=cli.stem,
+                     positions=cli.positions)
+    else:
+        index_engine(cli.data_path, cli.index_wd, mem_budget=cli.mem_budget,
+                     inversion=cli.inversion,
+                     quantize_norms=cli.quantize_norms, workers=cli.workers,
+                     fast_parse=cli.fast_parse, stem=cli.stem,
+                     positions=cli.positions)
+    print("Finished processing the file: {}".format(cli.data_path))
@@ -0,0 +1,158 @@
+"""Runs every topic of a queries file against an index and writes a TREC run.
+
+Topics are spread over a pool of worker processes.  The index (a Query) is
+loaded once before the pool is forked so the workers share it read only,
+postings and doc stats being memory-mapped.  Docnos come from the in memory
+docid_to_docno mapping and the run is written with one buffered write per
+topic.
+
+Example
+-------
+literal blocks::
+    $ python batch_retrieval.py <index_wd> <queries_file> <output_file>
+        [--model bm25|and] [-k 1000] [--workers N] [--run-tag TAG]
+        [--quantized-norms]
+
+    $ python batch_retrieval.py /Users/nikhilarora/data/latimes/index_dir_baseline /Users/nikhilarora/data/latimes/queries.txt /Users/nikhilarora/data/latimes/n5arora-hw4-bm25-stem.txt --workers 8
+"""
+import os
+import sys
+import time
+import argparse
+import multiprocessing as mp
+import numpy as np
+from index_helpers import timing, read_queries, Query
+
+parser = argparse.ArgumentParser(description='Runs a queries file against an \
+    index with a pool of processes and writes the TREC run.')
+parser.add_argument('index_wd', help='Path to the index')
+parser.add_argument('queries_file', help='Path to the queries file')
+parser.add_argument('output_file', help='Path of the TREC run written')
+parser.add_argument('--model', choices=['bm25', 'and'], default='bm25',
+    help='BM25 ranking or Boolean AND retrieval')
+parser.add_argument('-k', type=int, default=1000,
+    help='Number of BM25 results per topic')
+parser.add_argument('--workers', type=int, default=1,
+    help='Number of query processes, 1 runs the topics in this process')
+parser.add_argument('--run-tag', default=None,
+    help='Run tag, defaults to n5aroraBM25STEM or n5aroraAND')
+parser.add_argument('--quantized-norms', action='store_true',
+    help='BM25 normalizes by the 1 byte doc length norms of an index built '
+         'with --quantize-norms')
+
+res_doc_str = "{topid} q0 {docno} {rank} {score} {run_tag}\n"
+run_tags = {'bm25': 'n5aroraBM25STEM', 'and': 'n5aroraAND'}
+
+# Query of the current process, set before the pool forks:
+QUERY = None
+
+
+def init_worker(index_wd, quantized_norms=False):
+    """Pool initializer, loads the index unless inherited from the parent"""
+    global QUERY
+    if QUERY is None or QUERY.index_wd != index_wd:
+        QUERY = Query(index_wd, quantized_norms=quantized_norms)
+
+def run_topic(args):
+    """Runs one topic with the process' Query.
+    Returns: (topid, TREC lines of the topic, seconds taken)
+    """
+    topid, query_str, model, k, run_tag = args
+    time1 = time.perf_counter()
+    if model == 'bm25':
+        ranked = QUERY.search(query_str, k=k, k1=1.2, b=0.75, k2=7)
+    else:
+        termids = QUERY.conv_tokens_to_ids(QUERY.tokenize(query_str))
+        docids, _ = QUERY.BooleanAND(termids)
+        ranked = [(docid, 10000 - inx*10)
+                  for inx, docid in enumerate(docids.tolist())]
+    docid_to_docno = QUERY.docid_to_docno
+    lines = ''.join(res_doc_str.format(topid=topid,
+                                       docno=docid_to_docno[docid].strip(),
+                                       rank=rank, score=score, run_tag=run_tag)
+                    for rank, (docid, score) in enumerate(ranked, start=1))
+    time2 = time.perf_counter()
+    return topid, lines, time2 - time1
+
+@timing
+def batch_retrieval(index_wd, queries_file, output_file, model='bm25',
+                    k=1000, workers=1, run_tag=None, quantized_norms=False):
+    """Runs every topic of queries_file and writes the TREC run.
+
+    Parameters
+    ----------
+    index_wd : str
+        path to the index
+    queries_file : str
+        file of alternating topic id and query lines
+    output_file : str
+        path of the run written, topics in queries file order
+    model : str
+        'bm25' or 'and'
+    k : int
+        BM25 results per topic
+    workers : int
+        number of query processes
+    run_tag : str, optional
+    quantized_norms : bool
+        BM25 with the quantized doc lengths (see Query)
+
+    Returns
+    -------
+    list of the per topic latencies (seconds)
+    """
+    global QUERY
+    if run_tag is None:
+        run_tag = run_tags[model]
+    queries = read_queries(queries_file)
+    QUERY = Query(index_wd, quantized_norms=quantized_norms)
+    tasks = [(topid, query_str, model, k, run_tag)
+             for topid, query_str in queries.items()]
+
+    pool = None
+    if workers > 1:
+        pool = mp.Pool(workers, initializer=init_worker,
+                       initargs=(index_wd, quantized_norms))
+        results = pool.imap(run_topic, tasks)
+    else:
+        results = map(run_topic, tasks)
+
+    latencies = []
+    time1 = time.perf_counter()
+    with open(output_file, 'w', buffering=1024*1024) as wfile:
+        for topid, lines, secs in results:
+            wfile.write(lines)
+            latencies.append(secs)
+    time2 = time.perf_counter()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    ms = np.array(latencies)*1000
+    print("{} topics in {:.3f} s: {:.1f} queries/s".format(len(latencies),
+          time2 - time1, len(latencies)/(time2 - time1)))
+    if len(ms):
+        print("per topic latency: mean {:.3f} ms  p50 {:.3f} ms  p95 {:.3f} "
+              "ms  max {:.3f} ms".format(ms.mean(), np.percentile(ms, 50),
+              np.percentile(ms, 95), ms.max()))
+    if pool is None and model == 'bm25':
+        print(QUERY.result_cache.summary())
+    return latencies
+
+def validate_args(cli):
+    if not os.path.isdir(cli.index_wd):
+        print("Index dir: {} does not exist.".format(cli.index_wd))
+        sys.exit()
+    if not os.path.isfile(cli.queries_file):
+        print("Queries file: {} does not exist.".format(cli.queries_file))
+        sys.exit()
+    if cli.workers < 1:
+        print("--workers must be at least 1.")
+        sys.exit()
+
+if __name__ == '__main__':
+    cli = parser.parse_args()
+    validate_args(cli)
+    batch_retrieval(cli.index_wd, cli.queries_file, cli.output_file,
+                    model=cli.model, k=cli.k, workers=cli.workers,
+                    run_tag=cli.run_tag, quantized_norms=cli.quantized_norms)
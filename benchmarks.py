@@ -0,0 +1,624 @@
+"""
+Benchmarks for the indexing and retrieval code paths.
+
+example usage:
+```
+python benchmarks.py inversion /Users/nikhilarora/data/latimes/latimes.gz
+python benchmarks.py bm25 /Users/nikhilarora/data/latimes/index_dir_baseline \
+    /Users/nikhilarora/data/latimes/queries.txt
+python benchmarks.py boolean /Users/nikhilarora/data/latimes/index_dir_baseline
+python benchmarks.py parsing /Users/nikhilarora/data/latimes/latimes.gz
+python benchmarks.py stemming /Users/nikhilarora/data/latimes/latimes.gz
+python benchmarks.py pipeline /Users/nikhilarora/data/latimes/latimes.gz \
+    --workers 1 2 4 8
+python benchmarks.py metadata /Users/nikhilarora/data/latimes/index_dir_baseline \
+    /Users/nikhilarora/data/latimes/queries.txt --entries 0 100 1000 10000
+python benchmarks.py snippets /Users/nikhilarora/data/latimes/index_dir_baseline \
+    /Users/nikhilarora/data/latimes/queries.txt
+python benchmarks.py results /Users/nikhilarora/data/latimes/index_dir_baseline \
+    /Users/nikhilarora/data/latimes/queries.txt --passes 3
+python benchmarks.py postings /Users/nikhilarora/data/latimes/index_dir_baseline \
+    /Users/nikhilarora/data/latimes/queries.txt --mb 16 256
+python benchmarks.py metrics --topics 45 -k 1000
+```
+"""
+import sys
+import gzip
+import time
+import bisect
+import argparse
+import itertools
+import numpy as np
+from bm25_helpers import bm25_idf, MAXSCORE_MIN_POSTINGS
+from cache_helpers import LRUCache, ResultCache, PostingsCache
+from pipeline_helpers import parallel_parse
+import eval_helpers
+import metrics_helpers
+from porterstem import PorterStemmer
+from stem_helpers import Stemmer
+from IndexEngine import parse_doc
+from index_helpers import (doc_gen,
+                           read_queries,
+                           metadata_nbytes,
+                           DocParser,
+                           LightDocParser,
+                           Tokenizer,
+                           Lexicon,
+                           InvIndex,
+                           Query)
+
+parser = argparse.ArgumentParser(description='Benchmarks the indexing and \
+    retrieval code paths.')
+subparsers = parser.add_subparsers(dest='benchmark')
+
+inversion_parser = subparsers.add_parser('inversion',
+    help='Time inverting the collection with each InvIndex build path')
+inversion_parser.add_argument('data_path', help='Path to latimes.gz')
+inversion_parser.add_argument('--max-docs', type=int, default=None,
+    help='Only use the first max-docs documents')
+
+bm25_parser = subparsers.add_parser('bm25',
+    help='Per query latency of the original BM25 loop vs BM25Scorer \
+    (exhaustive and MaxScore)')
+bm25_parser.add_argument('index_wd', help='Path to the index')
+bm25_parser.add_argument('queries_file', help='Path to the queries file')
+bm25_parser.add_argument('-k', type=int, default=1000,
+    help='Number of results per query')
+bm25_parser.add_argument('--metadata', action='store_true',
+    help='Original loop reads doc lengths from MetaData (as before doc_lens)')
+
+boolean_parser = subparsers.add_parser('boolean',
+    help='Boolean AND of high df term pairs, original set intersection vs \
+    binary search intersection')
+boolean_parser.add_argument('index_wd', help='Path to the index')
+boolean_parser.add_argument('--n-terms', type=int, default=20,
+    help='Number of highest df terms to pair up')
+
+metadata_parser = subparsers.add_parser('metadata',
+    help='Replays a queries file fetching the MetaData of every result, for \
+    several metadata cache sizes')
+metadata_parser.add_argument('index_wd', help='Path to the index')
+metadata_parser.add_argument('queries_file', help='Path to the queries file')
+metadata_parser.add_argument('-k', type=int, default=1000,
+    help='Number of results per query')
+metadata_parser.add_argument('--passes', type=int, default=3,
+    help='Number of times the queries are replayed')
+metadata_parser.add_argument('--entries', type=int, nargs='+',
+    default=[0, 1000, 10000], help='Cache sizes (entries) to try')
+metadata_parser.add_argument('--fields-only', action='store_true',
+    help='Cache the fields without the raw doc')
+
+parsing_parser = subparsers.add_parser('parsing',
+    help='MB/s of splitting the collection into docs and extracting the doc \
+    fields, original vs fast modes')
+parsing_parser.add_argument('data_path', help='Path to latimes.gz')
+
+stemming_parser = subparsers.add_parser('stemming',
+    help='Tokenizing the collection unstemmed, with the original char by char \
+    stemming and with the memoized Stemmer')
+stemming_parser.add_argument('data_path', help='Path to latimes.gz')
+stemming_parser.add_argument('--max-docs', type=int, default=None,
+    help='Only use the first max-docs documents')
+
+pipeline_parser = subparsers.add_parser('pipeline',
+    help='Doc parsing throughput of IndexEngine, serial vs the multi-process \
+    pipeline with each number of workers')
+pipeline_parser.add_argument('data_path', help='Path to latimes.gz')
+pipeline_parser.add_argument('--workers', type=int, nargs='+',
+    default=[1, 2, 4], help='Numbers of parser processes to try')
+pipeline_parser.add_argument('--batch-size', type=int, default=64,
+    help='Docs sent to a parser at a time')
+
+snippets_parser = subparsers.add_parser('snippets',
+    help='Per query latency of a 10 result page: ranking, then the snippets \
+    of the original TEXT prefix (xml parse) vs query-biased snippets')
+snippets_parser.add_argument('index_wd', help='Path to the index')
+snippets_parser.add_argument('queries_file', help='Path to the queries file')
+snippets_parser.add_argument('-k', type=int, default=10,
+    help='Number of results per page')
+
+results_parser = subparsers.add_parser('results',
+    help='Replays a queries file several times, BM25 search latency with and \
+    without the result cache')
+results_parser.add_argument('index_wd', help='Path to the index')
+results_parser.add_argument('queries_file', help='Path to the queries file')
+results_parser.add_argument('-k', type=int, default=1000,
+    help='Number of results per query')
+results_parser.add_argument('--passes', type=int, default=3,
+    help='Number of times the queries are replayed')
+
+postings_parser = subparsers.add_parser('postings',
+    help='Replays a queries file several times (without the result cache), \
+    BM25 search latency for several postings cache budgets, cold and warmed \
+    up with the queries')
+postings_parser.add_argument('index_wd', help='Path to the index')
+postings_parser.add_argument('queries_file', help='Path to the queries file')
+postings_parser.add_argument('-k', type=int, default=1000,
+    help='Number of results per query')
+postings_parser.add_argument('--passes', type=int, default=3,
+    help='Number of times the queries are replayed')
+postings_parser.add_argument('--mb', type=float, nargs='+', default=[16, 256],
+    help='Postings cache budgets (MB) to try')
+
+metrics_parser = subparsers.add_parser('metrics',
+    help='AP, P@10, nDCG@10, nDCG@k and TBG of a random run, eval_helpers \
+    per topic loops vs the metrics_helpers matrix kernels')
+metrics_parser.add_argument('--topics', type=int, default=45,
+    help='Number of topics of the run')
+metrics_parser.add_argument('-k', type=int, default=1000,
+    help='Number of results per topic')
+metrics_parser.add_argument('--rel-rate', type=float, default=0.05,
+    help='Fraction of the results that are relevant')
+
+
+def time_it(f, *args, **kwargs):
+    """Runs f and returns (ret, seconds taken)"""
+    time1 = time.perf_counter()
+    ret = f(*args, **kwargs)
+    time2 = time.perf_counter()
+    return ret, time2 - time1
+
+def report_latencies(name, latencies):
+    """Prints the mean and percentiles of a list of latencies (seconds)"""
+    ms = np.array(latencies) * 1000
+    print('{:<32} mean {:>9.3f} ms  p50 {:>9.3f} ms  p95 {:>9.3f} ms  max '
+          '{:>9.3f} ms'.format(name, ms.mean(), np.percentile(ms, 50),
+          np.percentile(ms, 95), ms.max()))
+
+def report(name, seconds, n=None, unit='docs'):
+    """Prints a single benchmark result line"""
+    line = '{:<32} {:>10.3f} s'.format(name, seconds)
+    if n:
+        line += '  {:>12.1f} {}/s'.format(n/seconds, unit)
+    print(line)
+
+def load_tokens(data_path, max_docs=None):
+    """Parses the collection once and returns {docid: tokens_ls}"""
+    tokens_dict = {}
+    fstream = gzip.open(data_path, 'rt', encoding='utf-8')
+    docs = itertools.islice(doc_gen(fstream), max_docs)
+    for docid, doc in enumerate(docs, start=1):
+        tokens_dict[docid] = DocParser(doc).tokens
+    fstream.close()
+    return tokens_dict
+
+#-------------------------------------------------------------------------------
+# inversion:
+
+def bisect_inversion(lexicon, tokens_dict):
+    """The original inversion: a Counter per doc and a bisect + two
+    list.insert calls per posting.
+    """
+    inv_index = {}
+    for docid, tokens_vect in tokens_dict.items():
+        for termid, count in lexicon.conv_tokens_vect(tokens_vect).items():
+            if termid in inv_index:
+                i = bisect.bisect(inv_index[termid][0], docid)
+                inv_index[termid][0].insert(i, docid)
+                inv_index[termid][1].insert(i, count)
+                assert(len(inv_index[termid][0]) == len(inv_index[termid][1]))
+            else:
+                inv_index[termid] = [[docid], [count]]
+    return inv_index
+
+def append_inversion(lexicon, tokens_dict):
+    invIndex = InvIndex('')
+    for docid, tokens_vect in tokens_dict.items():
+        termids, counts = lexicon.conv_tokens_array(tokens_vect)
+        invIndex.add_doc_postings(docid, termids, counts)
+    return invIndex.inv_index
+
+def sort_inversion(lexicon, tokens_dict):
+    invIndex = InvIndex('')
+    termids_ls, docids_ls, counts_ls = [], [], []
+    for docid, tokens_vect in tokens_dict.items():
+        termids, counts = lexicon.conv_tokens_array(tokens_vect)
+        termids_ls.append(termids)
+        docids_ls.append(np.full(len(termids), docid, dtype=np.uint32))
+        counts_ls.append(counts)
+    invIndex.invert(np.concatenate(termids_ls), np.concatenate(docids_ls),
+                    np.concatenate(counts_ls))
+    return invIndex.inv_index
+
+def bench_inversion(cli):
+    print("Parsing collection: {}".format(cli.data_path))
+    tokens_dict, secs = time_it(load_tokens, cli.data_path, cli.max_docs)
+    n_docs = len(tokens_dict)
+    n_tokens = sum(len(tokens) for tokens in tokens_dict.values())
+    report('parse ({} docs, {} tokens)'.format(n_docs, n_tokens), secs, n_docs)
+    lexicon = Lexicon('', tokens=itertools.chain.from_iterable(
+        tokens_dict.values()))
+    _, secs = time_it(lexicon.create_lexicon_mappings)
+    report('lexicon', secs)
+
+    results = {}
+    for name, f in [('bisect (original)', bisect_inversion),
+                    ('append', append_inversion),
+                    ('sort', sort_inversion)]:
+        results[name], secs = time_it(f, lexicon, tokens_dict)
+        report('inversion: {}'.format(name), secs, n_docs)
+
+    # all paths must build the same postings:
+    expected = results['bisect (original)']
+    for name, inv_index in results.items():
+        assert(len(inv_index) == len(expected))
+        for termid, (docids, counts) in inv_index.items():
+            assert(list(docids) == expected[termid][0])
+            assert(list(counts) == expected[termid][1])
+
+#-------------------------------------------------------------------------------
+# bm25:
+
+def loop_bm25(query, termid_qfs, k, metadata=False):
+    """The original per posting BM25 loop (k1=1.2, b=0.75, k2=7)."""
+    doc_scores = {}
+    postings_lists = query.general_retrieval(list(termid_qfs.keys()))
+    N = query.invIndex.coll_len
+    avg_dl = query.invIndex.coll_token_sum/N
+    for termid, (docids, counts) in postings_lists.items():
+        n_i = len(docids)
+        for docid, count in zip(np.asarray(docids).tolist(),
+                                np.asarray(counts).tolist()):
+            if metadata:
+                dl = int(query.docid_to_metadata(docid).doc_len)
+            else:
+                dl = query.get_doc_len(docid)
+            qf = termid_qfs[termid]
+            K = 1.2*((1-0.75)+(0.75*(dl/avg_dl)))
+            qf_term = ( (7+1)*qf) / (7+qf)
+            df_term = ( (1.2+1)*count) / (K+count)
+            score = qf_term * df_term * bm25_idf(n_i, N)
+            if docid in doc_scores:
+                doc_scores[docid] += score
+            else:
+                doc_scores[docid] = score
+    return sorted(doc_scores.items(), key=lambda x: (-x[1], x[0]))[:k]
+
+def bench_bm25(cli):
+    query = Query(cli.index_wd)
+    queries = read_queries(cli.queries_file)
+    scorer = query.get_scorer(1.2, 0.75, 7)
+    loop_times, scorer_times, maxscore_times = [], [], []
+    n_postings = []
+    for topid, query_str in queries.items():
+        termid_qfs = query.lexicon.conv_tokens_vect(query.tokenize(query_str))
+        n_postings.append(sum(query.invIndex.df(termid)
+                              for termid in termid_qfs
+                              if query.invIndex.does_termid_exist(termid)))
+        expected, secs = time_it(loop_bm25, query, termid_qfs, cli.k,
+                                 cli.metadata)
+        loop_times.append(secs)
+        ranked, secs = time_it(scorer.rank, termid_qfs, cli.k, pruning=False)
+        scorer_times.append(secs)
+        pruned, secs = time_it(scorer.rank, termid_qfs, cli.k, pruning=True)
+        maxscore_times.append(secs)
+        assert(pruned == ranked)
+        assert([docid for docid, _ in ranked] ==
+               [docid for docid, _ in expected])
+        assert(np.allclose([score for _, score in ranked],
+                           [score for _, score in expected]))
+    print('{} queries, k={}'.format(len(queries), cli.k))
+    report_latencies('bm25: original loop', loop_times)
+    report_latencies('bm25: BM25Scorer', scorer_times)
+    report_latencies('bm25: BM25Scorer + MaxScore', maxscore_times)
+    # topics MaxScore is used for by default (if k is small enough):
+    long_topics = np.array(n_postings) >= MAXSCORE_MIN_POSTINGS
+    print('{} long topics (at least {} postings)'.format(long_topics.sum(),
+          MAXSCORE_MIN_POSTINGS))
+    if long_topics.any():
+        report_latencies('bm25 long: BM25Scorer',
+                         np.array(scorer_times)[long_topics])
+        report_latencies('bm25 long: BM25Scorer + MaxScore',
+                         np.array(maxscore_times)[long_topics])
+
+#-------------------------------------------------------------------------------
+# boolean:
+
+def set_intersection(postings_lists):
+    """The original intersection: python sets of the docids and a linear scan
+    (comparing str's) of the first list to find the counts.
+    """
+    f_pl_docid = list(postings_lists.values())[0][0]
+    f_pl_count = list(postings_lists.values())[0][1]
+    docids = list(postings_lists.values())[0][0]
+    for item in postings_lists.values():
+        docids = list(set(docids) & set(item[0]))
+    inx = []
+    for posting in docids:
+        for i, elem in enumerate(f_pl_docid):
+            if str(elem) == str(posting):
+                inx.append(i)
+                break
+    return docids, [f_pl_count[i] for i in inx]
+
+def bench_boolean(cli):
+    query = Query(cli.index_wd)
+    termids = sorted((termid for termid, _ in query.invIndex.items()),
+                     key=query.invIndex.df, reverse=True)[:cli.n_terms]
+    set_times, search_times = [], []
+    for pair in itertools.combinations(termids, 2):
+        postings_lists = {termid: query.invIndex.get_posting_ls(termid)
+                          for termid in pair}
+        (expected, _), secs = time_it(set_intersection, postings_lists)
+        set_times.append(secs)
+        (docids, counts), secs = time_it(query.BooleanAND, list(pair))
+        search_times.append(secs)
+        assert(sorted(expected) == docids.tolist())
+        for termid, posting_ls in postings_lists.items():
+            posting_counts = dict(zip(*(np.asarray(x).tolist()
+                                        for x in posting_ls)))
+            assert([posting_counts[docid] for docid in docids.tolist()] ==
+                   counts[termid].tolist())
+    print('{} term pairs (df {} to {})'.format(len(set_times),
+        query.invIndex.df(termids[-1]), query.invIndex.df(termids[0])))
+    report_latencies('boolean: set intersection', set_times)
+    report_latencies('boolean: binary search', search_times)
+
+#-------------------------------------------------------------------------------
+# metadata:
+
+def bench_metadata(cli):
+    query = Query(cli.index_wd)
+    queries = read_queries(cli.queries_file)
+    results = [[docid for docid, _ in query.search(query_str, k=cli.k)]
+               for query_str in queries.values()]
+    print('{} queries x {} passes, k={}'.format(len(queries), cli.passes, cli.k))
+    for entries in cli.entries:
+        query.meta_cache = LRUCache(max_entries=entries,
+                                    size_of=metadata_nbytes)
+        query.cache_raw_doc = not cli.fields_only
+        latencies = []
+        for _ in range(cli.passes):
+            for docids in results:
+                _, secs = time_it(lambda: [query.docid_to_metadata(docid,
+                    raw_doc=False).docno for docid in docids])
+                latencies.append(secs)
+        report_latencies('metadata: {} entries'.format(entries), latencies)
+        print('    {}'.format(query.meta_cache.stats()))
+
+#-------------------------------------------------------------------------------
+# parsing:
+
+def split_collection(data_path, fast):
+    fstream = gzip.open(data_path, 'rt', encoding='utf-8')
+    docs = list(doc_gen(fstream, fast=fast))
+    fstream.close()
+    return docs
+
+def bench_parsing(cli):
+    with gzip.open(cli.data_path, 'rb') as f:
+        mb = len(f.read())/1024/1024
+    docs, secs = time_it(split_collection, cli.data_path, False)
+    report('split: doc_gen', secs, mb, 'MB')
+    fast_docs, secs = time_it(split_collection, cli.data_path, True)
+    report('split: doc_gen fast', secs, mb, 'MB')
+    assert(fast_docs == docs)
+
+    tags = ['DOCNO', 'TEXT', 'HEADLINE', 'GRAPHIC']
+    mb = sum(len(doc.encode('utf-8')) for doc in docs)/1024/1024
+    fields, secs = time_it(lambda: [LightDocParser(doc, tags).cont_dict
+                                    for doc in docs])
+    report('fields: ElementTree', secs, mb, 'MB')
+    fast_fields, secs = time_it(lambda: [LightDocParser(doc, tags,
+                                         fast=True).cont_dict for doc in docs])
+    report('fields: fast', secs, mb, 'MB')
+    assert(fast_fields == fields)
+
+    _, secs = time_it(lambda: [DocParser(doc).tokens for doc in docs])
+    report('DocParser (fields + tokens)', secs, mb, 'MB')
+    _, secs = time_it(lambda: [DocParser(doc, fast=True).tokens
+                               for doc in docs])
+    report('DocParser fast', secs, mb, 'MB')
+
+#-------------------------------------------------------------------------------
+# stemming:
+
+def char_stem_string(porter, input_str):
+    """The original char by char stemming, a word still being read at the end
+    of input_str isn't output (callers pass text ending with a space).
+    """
+    output = ''
+    word = ''
+    for c in input_str:
+        if c.isalpha():
+            word += c.lower()
+        else:
+            if word:
+                output += porter.stem(word, 0,len(word)-1)
+                word = ''
+            output += c.lower()
+    return output
+
+def bench_stemming(cli):
+    fstream = gzip.open(cli.data_path, 'rt', encoding='utf-8')
+    docs = list(itertools.islice(doc_gen(fstream), cli.max_docs))
+    fstream.close()
+    fields = [DocParser(doc).cont_dict for doc in docs]
+    n_docs = len(docs)
+    tokenizer = Tokenizer()
+    tags = ['TEXT', 'HEADLINE', 'GRAPHIC']
+    texts = [[cont_dict[tag] + ' ' for tag in tags if tag in cont_dict]
+             for cont_dict in fields]
+
+    def unstemmed():
+        return [[token for text in doc_texts
+                 for token in tokenizer.tokenize(text)] for doc_texts in texts]
+    def char_stemmed():
+        porter = PorterStemmer()
+        return [[token for text in doc_texts for token in char_stem_string(
+                 porter, text.lower().translate(tokenizer.translator)).split()]
+                for doc_texts in texts]
+    def memo_stemmed():
+        tokenizer.stemmer = Stemmer()
+        return [[token for text in doc_texts
+                 for token in tokenizer.tokenize(text, stem=True)]
+                for doc_texts in texts]
+
+    _, secs = time_it(unstemmed)
+    report('tokenize: unstemmed', secs, n_docs)
+    expected, secs = time_it(char_stemmed)
+    report('tokenize: char by char stemming', secs, n_docs)
+    tokens, secs = time_it(memo_stemmed)
+    report('tokenize: memoized Stemmer', secs, n_docs)
+    print('    {} stems in table'.format(len(tokenizer.stemmer.table)))
+    assert(tokens == expected)
+
+#-------------------------------------------------------------------------------
+# pipeline:
+
+def bench_pipeline(cli):
+    fstream = gzip.open(cli.data_path, 'rt', encoding='utf-8')
+    expected, secs = time_it(list, map(parse_doc, doc_gen(fstream)))
+    fstream.close()
+    n_docs = len(expected)
+    report('parse: serial', secs, n_docs)
+    for workers in cli.workers:
+        parsed, secs = time_it(list, parallel_parse(cli.data_path, parse_doc,
+                               workers, batch_size=cli.batch_size))
+        report('parse: {} workers'.format(workers), secs, n_docs)
+        assert(parsed == expected)
+
+#-------------------------------------------------------------------------------
+# snippets:
+
+def prefix_snippets(query, docids):
+    """Snippets as main.run_query made them: the first 200 chars of TEXT"""
+    return [LightDocParser(query.docid_to_metadata(docid).raw_doc)
+            .cont_dict['TEXT'].strip()[0:200] + '...' for docid in docids]
+
+def bench_snippets(cli):
+    # fetch every doc from the store, as a page would:
+    query = Query(cli.index_wd, meta_cache_entries=0)
+    queries = read_queries(cli.queries_file)
+    print('{} queries, k={}'.format(len(queries), cli.k))
+    if query.snippetStore is None:
+        print('WARNING: no SnippetStore, sentences are split at query time.')
+    latencies = {'ranking': [], 'snippets: TEXT prefix (original)': [],
+                 'snippets: query-biased': []}
+    for query_str in queries.values():
+        ranked, secs = time_it(query.search, query_str, k=cli.k)
+        latencies['ranking'].append(secs)
+        docids = [docid for docid, _ in ranked]
+        _, secs = time_it(prefix_snippets, query, docids)
+        latencies['snippets: TEXT prefix (original)'].append(secs)
+        _, secs = time_it(query.snippets, query_str, docids)
+        latencies['snippets: query-biased'].append(secs)
+    for name, secs in latencies.items():
+        report_latencies(name, secs)
+
+#-------------------------------------------------------------------------------
+# result cache:
+
+def bench_results(cli):
+    query = Query(cli.index_wd)
+    queries = read_queries(cli.queries_file)
+    print('{} queries x {} passes, k={}'.format(len(queries), cli.passes, cli.k))
+    expected = {}
+    for name, nbytes in [('no cache', 0), ('result cache', None)]:
+        query.result_cache = ResultCache(query.invIndex.generation,
+            max_entries=0 if nbytes == 0 else None, max_bytes=nbytes)
+        latencies = []
+        for _ in range(cli.passes):
+            for topid, query_str in queries.items():
+                ranked, secs = time_it(query.search, query_str, k=cli.k)
+                latencies.append(secs)
+                assert(expected.setdefault(topid, ranked) == ranked)
+        report_latencies('search: {}'.format(name), latencies)
+        print('    {}'.format(query.result_cache.summary()))
+
+#-------------------------------------------------------------------------------
+# postings cache:
+
+def bench_postings(cli):
+    query = Query(cli.index_wd, result_cache_bytes=0, postings_cache_bytes=0)
+    if query.invIndex.reader is None:
+        print('Index {} is held in memory, nothing to cache.'.format(
+              cli.index_wd))
+        return
+    queries = read_queries(cli.queries_file)
+    print('{} queries x {} passes, k={}'.format(len(queries), cli.passes, cli.k))
+    configs = [('no cache', 0, False)]
+    for mb in cli.mb:
+        configs += [('{:g} MB'.format(mb), mb, False),
+                    ('{:g} MB warmed'.format(mb), mb, True)]
+    expected = {}
+    for name, mb, warm in configs:
+        query.invIndex.postings_cache = None
+        if mb:
+            query.invIndex.postings_cache = PostingsCache(int(mb*1024*1024))
+        if warm:
+            query.warm_postings_cache(queries.values())
+        latencies = []
+        for _ in range(cli.passes):
+            for topid, query_str in queries.items():
+                ranked, secs = time_it(query.search, query_str, k=cli.k)
+                latencies.append(secs)
+                assert(expected.setdefault(topid, ranked) == ranked)
+        report_latencies('search: {}'.format(name), latencies)
+        if mb:
+            print('    {}'.format(query.invIndex.postings_cache.summary()))
+
+#-------------------------------------------------------------------------------
+# evaluation measures:
+
+def loop_metrics(rel_vects, doc_len_vects, R, k):
+    """The measures of every topic with the eval_helpers functions"""
+    return np.array([[eval_helpers.get_avg_precision_k(rel_vect, r, k),
+                      eval_helpers.get_precision_at_k(rel_vect, 10),
+                      eval_helpers.get_ndcg_k(rel_vect, 10),
+                      eval_helpers.get_ndcg_k(rel_vect, k),
+                      eval_helpers.get_tbg_k(rel_vect, doc_len_vect, k)]
+                     for rel_vect, doc_len_vect, r
+                     in zip(rel_vects, doc_len_vects, R)])
+
+def matrix_metrics(rel_vects, doc_len_vects, R, k):
+    """The measures of every topic with the metrics_helpers kernels"""
+    rels, lengths = metrics_helpers.pad_rows(rel_vects, k)
+    doc_lens, _ = metrics_helpers.pad_rows(doc_len_vects, k)
+    return np.stack([metrics_helpers.avg_precision_k(rels, R, k),
+                     metrics_helpers.precision_at_k(rels, 10),
+                     metrics_helpers.ndcg_k(rels, lengths, 10),
+                     metrics_helpers.ndcg_k(rels, lengths, k),
+                     metrics_helpers.tbg_k(rels, doc_lens, lengths, k)],
+                    axis=1)
+
+def bench_metrics(cli):
+    rng = np.random.default_rng(0)
+    # runs are cut short for some topics:
+    n_results = rng.integers(cli.k//2, cli.k + 1, cli.topics)
+    rel_vects = [(rng.random(n) < cli.rel_rate).astype(int).tolist()
+                 for n in n_results]
+    doc_len_vects = [rng.integers(50, 1000, n).tolist() for n in n_results]
+    R = [max(1, sum(rel_vect)) for rel_vect in rel_vects]
+    print('{} topics, k={}, {} results'.format(cli.topics, cli.k,
+                                              n_results.sum()))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        expected, secs = time_it(loop_metrics, rel_vects, doc_len_vects, R,
+                                 cli.k)
+        report('eval_helpers loops', secs, cli.topics, 'topics')
+        measures, secs = time_it(matrix_metrics, rel_vects, doc_len_vects, R,
+                                 cli.k)
+        report('metrics_helpers matrices', secs, cli.topics, 'topics')
+    assert(np.allclose(expected, measures, equal_nan=True))
+
+
+benchmarks = {
+    'inversion': bench_inversion,
+    'bm25': bench_bm25,
+    'boolean': bench_boolean,
+    'metadata': bench_metadata,
+    'parsing': bench_parsing,
+    'stemming': bench_stemming,
+    'pipeline': bench_pipeline,
+    'snippets': bench_snippets,
+    'results': bench_results,
+    'postings': bench_postings,
+    'metrics': bench_metrics,
+}
+
+if __name__ == '__main__':
+    cli = parser.parse_args()
+    if cli.benchmark is None:
+        parser.print_help()
+        sys.exit()
+    benchmarks[cli.benchmark](cli)
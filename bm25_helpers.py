@@ -0,0 +1,392 @@
+"""
+Okapi BM25 scoring shared by bm25_retrieval.py and main.py.
+
+Scores are computed one postings list at a time with numpy (docids, counts
+and doc lengths as arrays) into a dense docid indexed accumulator, using the
+same formula (and order of float operations) as the original per posting
+loops:
+
+    K = k1*((1-b) + b*(dl/avg_dl))
+    score = ((k2+1)*qf/(k2+qf)) * ((k1+1)*tf/(K+tf)) * idf
+
+with the relevance free Robertson/Sparck Jones idf used by the original code.
+
+N, avg_dl and the df (n_i) of the terms default to those of the scored
+index.  A shard of a document-partitioned index (see shard_helpers) is scored
+with the stats of the whole collection instead, passed as coll_stats and
+dfs, so its scores are those of a single index holding every doc.
+
+rank(pruning=True) gives the same ranking with document-at-a-time MaxScore,
+skipping the docs that can't make the top k with the score bounds of the
+postings blocks (see postings_helpers) and decoding the blocks of the low
+scoring terms only where a doc may still need them.  It pays off for a few
+results of long topics, the postings of their frequent terms being mostly
+skipped, so that's where rank uses it by default.
+
+Contains:
+
+Methods:
+- bm25_idf(n_i, N)
+- top_k(docids, scores, k)
+
+Classes:
+- BM25Scorer
+"""
+import numpy as np
+
+# docids scored by the first window of BM25Scorer.rank_maxscore:
+MAXSCORE_WINDOW = 1 << 16
+# BM25Scorer.rank uses MaxScore by default for at most MAXSCORE_MAX_K results
+# of topics with at least MAXSCORE_MIN_POSTINGS postings, where it was measured
+# faster (see benchmarks.py bm25):
+MAXSCORE_MAX_K = 100
+MAXSCORE_MIN_POSTINGS = 50000
+
+
+def bm25_idf(n_i, N, r_i=0, R=0):
+    """idf component of a term found in n_i of the N docs, r_i and R are the
+    (unknown, so 0) relevance counts.
+    """
+    return np.log( ((r_i + 0.5)/(R - r_i + 0.5)) \
+        / ((n_i - r_i + 0.5)/(N - n_i - R - r_i - 0.5)) )
+
+def top_k(docids, scores, k):
+    """Selects the k best scoring docs without sorting every scored doc.
+
+    Parameters
+    ----------
+    docids : np.ndarray
+        docids sorted in increasing order
+    scores : np.ndarray
+        score of each docid
+    k : int
+
+    Returns
+    -------
+    (docids, scores) of the k best docs, by decreasing score with ties broken
+    by increasing docid so runs are reproducible.
+    """
+    if k <= 0:
+        return docids[:0], scores[:0]
+    if k < len(scores):
+        # value of the k-th best score, found in linear time:
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        better = np.flatnonzero(scores > kth)
+        # docids are sorted so the first ties have the lowest docids:
+        ties = np.flatnonzero(scores == kth)[:k - len(better)]
+        inx = np.concatenate((better, ties))
+        docids, scores = docids[inx], scores[inx]
+    order = np.lexsort((docids, -scores))
+    return docids[order], scores[order]
+
+
+class BM25Scorer(object):
+    """Scores queries against an InvIndex with BM25.
+
+    Parameters
+    ----------
+    invIndex : InvIndex
+        loaded inverted index (supplies postings, coll_len and coll_token_sum)
+    doc_lens : array like
+        docid indexed doc lengths (DocStats.doc_lens)
+    k1, b, k2 : float
+        BM25 parameters
+    coll_stats : (int, int), optional
+        (coll_len, coll_token_sum) of the collection, defaults to the
+        index's
+    quantized : bool
+        doc_lens are decoded from quantized norms (DocStats.quantized_doc_lens)
+        so the score bounds of the index, computed with the exact lengths,
+        don't hold
+    """
+    def __init__(self, invIndex, doc_lens, k1=1.2, b=0.75, k2=7,
+                 coll_stats=None, quantized=False):
+        self.invIndex = invIndex
+        self.k1 = k1
+        self.b = b
+        self.k2 = k2
+        self.global_stats = coll_stats is not None
+        self.quantized = quantized
+        if coll_stats is None:
+            coll_stats = (invIndex.coll_len, invIndex.coll_token_sum)
+        self.N = coll_stats[0]
+        self.avg_dl = coll_stats[1]/self.N
+        doc_lens = np.asarray(doc_lens, dtype=np.float64)
+        # per doc length normalization, computed once instead of per posting:
+        self.K = k1*((1-b)+(b*(doc_lens/self.avg_dl)))
+        self.acc = np.zeros(len(doc_lens), dtype=np.float64)
+        self.touched = np.zeros(len(doc_lens), dtype=bool)
+
+    def term_scores(self, termid, qf=1, n_i=None):
+        """Scores the whole postings list of termid, found in n_i docs
+        (defaults to the length of the list).
+        Returns: (docids, scores) arrays
+        """
+        docids, counts = self.invIndex.get_posting_ls(termid)
+        docids = np.asarray(docids, dtype=np.int64)
+        if n_i is None:
+            n_i = len(docids)
+        return docids, self.postings_scores(docids, counts, n_i, qf)
+
+    def postings_scores(self, docids, counts, n_i, qf=1):
+        """Scores postings (docids, counts) of a term found in n_i docs"""
+        tf = np.asarray(counts, dtype=np.float64)
+        idf_term = bm25_idf(n_i, self.N)
+        qf_term = ( (self.k2+1)*qf) / (self.k2+qf)
+        df_term = ( (self.k1+1)*tf) / (self.K[docids]+tf)
+        return qf_term * df_term * idf_term
+
+    def score(self, termid_qfs, dfs=None):
+        """Scores the docs matching any of the query terms.
+
+        Parameters
+        ----------
+        termid_qfs : dict
+            termid: frequency of the term in the query
+        dfs : dict, optional
+            termid: df in the collection, defaults to the index's
+
+        Returns
+        -------
+        (docids, scores) arrays of every matching doc, sorted by docid
+        """
+        for termid, qf in termid_qfs.items():
+            if not self.invIndex.does_termid_exist(termid):
+                continue
+            docids, scores = self.term_scores(termid, qf,
+                None if dfs is None else dfs[termid])
+            # docids are unique within a postings list:
+            self.acc[docids] += scores
+            self.touched[docids] = True
+        docids = np.flatnonzero(self.touched)
+        scores = self.acc[docids]
+        # reset the accumulator for the next query:
+        self.acc[docids] = 0
+        self.touched[docids] = False
+        return docids, scores
+
+    def rank(self, termid_qfs, k=10, pruning=None, dfs=None):
+        """Returns the k best (docid, score) pairs, by decreasing score with
+        ties broken by increasing docid.  With pruning, MaxScore is used when
+        the index has block tables (see rank_maxscore), by default (None) if
+        k is at most MAXSCORE_MAX_K and the topic has at least
+        MAXSCORE_MIN_POSTINGS postings.
+        """
+        if pruning is None:
+            n_postings = sum(self.invIndex.df(termid) for termid in termid_qfs
+                             if self.invIndex.does_termid_exist(termid))
+            pruning = (k <= MAXSCORE_MAX_K and
+                       n_postings >= MAXSCORE_MIN_POSTINGS)
+        if pruning:
+            ranked = self.rank_maxscore(termid_qfs, k, dfs)
+            if ranked is not None:
+                return ranked
+        docids, scores = top_k(*self.score(termid_qfs, dfs), k)
+        return list(zip(docids.tolist(), scores.tolist()))
+
+    @staticmethod
+    def find_postings(docids, cand):
+        """Binary searches the sorted postings docids for the sorted docids
+        cand.
+        Returns: (bool mask of the cand found, their postings positions)
+        """
+        inx = np.searchsorted(docids, cand)
+        found = inx < len(docids)
+        found[found] = docids[inx[found]] == cand[found]
+        return found, inx[found]
+
+    def term_weight(self, qf, n_i):
+        """Returns the qf and idf components of a term found in n_i docs"""
+        return ( (self.k2+1)*qf) / (self.k2+qf) * bm25_idf(n_i, self.N)
+
+    def block_bounds(self, termid, qf, n_i, blocks):
+        """Returns the upper bound of the score contribution of termid, found
+        in n_i docs, to the docs of each block of its PostingsBlocks.  The tf
+        component is largest for the block's largest tf and smallest doc
+        length, capped by the term's stored bound when the index has one for
+        this scorer.  Negative contributions are bounded by 0.
+        """
+        weight = self.term_weight(qf, n_i)
+        K = self.k1*((1-self.b)+(self.b*(blocks.min_dls/self.avg_dl)))
+        bounds = weight * ( (self.k1+1)*blocks.max_tfs) / (K+blocks.max_tfs)
+        if not self.global_stats:
+            # stored bounds were computed with the avg_dl of the index
+            tf_bounds = self.invIndex.tf_score_bounds(termid, self.k1, self.b)
+            if tf_bounds is not None:
+                bounds = np.minimum(bounds, weight*tf_bounds[1])
+        return np.maximum(bounds, 0)
+
+    def rank_maxscore(self, termid_qfs, k=10, dfs=None):
+        """Document-at-a-time MaxScore giving the same ranking as
+        rank(pruning=False).
+
+        Docids are scanned in windows, the first of MAXSCORE_WINDOW docids
+        and each next one twice as large.  In a window the terms are sorted
+        by their bound there, the largest block bound of their postings in
+        it, and the postings of the best ones are scored until the bounds of
+        the terms left add up to less than theta, the k-th best lower bound
+        of the scores seen (the partial scores plus what the negative idfs
+        left may take off): the terms left are non-essential, a doc holding
+        only those can't make the top k.  Each non-essential term, best
+        first, is then only probed for the docs left, decoding just the
+        blocks holding them, after dropping the docs whose partial score plus
+        the block bounds of the terms left falls below theta.  The scores of
+        the docs kept are summed in query term order, so they're bit for bit
+        the exhaustive ones.
+
+        Returns None if the index has no block table (see postings_helpers),
+        the scorer uses quantized doc lengths or a term has a nan idf.
+        """
+        if self.quantized:
+            # the block doc lengths are exact ones
+            return None
+        # in query order: (qf, n_i, lowest contribution, PostingsBlocks, block
+        # bounds)
+        terms = []
+        for termid, qf in termid_qfs.items():
+            if not self.invIndex.does_termid_exist(termid):
+                continue
+            blocks = self.invIndex.get_blocks(termid)
+            if blocks is None:
+                return None
+            n_i = blocks.df if dfs is None else dfs[termid]
+            bounds = self.block_bounds(termid, qf, n_i, blocks)
+            if np.isnan(bounds).any():
+                # the idf of a term found in (nearly) every doc is nan
+                return None
+            # the tf component is below k1+1:
+            low = min(0, self.term_weight(qf, n_i)*(self.k1+1))
+            terms.append((qf, n_i, low, blocks, bounds))
+        if k <= 0 or not terms:
+            return []
+
+        best_docids = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float64)
+        theta = -np.inf
+        start, size = 0, MAXSCORE_WINDOW
+        while start < len(self.K):
+            end = min(start + size, len(self.K))
+            docids, scores = self._window_maxscore(terms, start, end, theta,
+                                                   best_scores, k)
+            if len(docids):
+                docids = np.concatenate((best_docids, docids))
+                scores = np.concatenate((best_scores, scores))
+                order = np.argsort(docids)
+                best_docids, best_scores = top_k(docids[order],
+                                                 scores[order], k)
+                if len(best_scores) == k:
+                    theta = best_scores[-1]
+            start, size = end, 2*size
+        return list(zip(best_docids.tolist(), best_scores.tolist()))
+
+    @staticmethod
+    def raise_theta(theta, best_scores, lower_bounds, k):
+        """Returns theta raised to the k-th best of best_scores and of
+        lower_bounds, lower bounds of the scores of other docs.
+        """
+        pool = np.concatenate((best_scores, lower_bounds))
+        if len(pool) < k:
+            return theta
+        return max(theta, np.partition(pool, len(pool) - k)[len(pool) - k])
+
+    def _window_maxscore(self, terms, start, end, theta, best_scores, k):
+        """MaxScore over the docids start to end of rank_maxscore, best_scores
+        being the k best scores of the docs before.
+        Returns: (docids, exact scores) of the docs that may beat theta
+        """
+        spans, window_bounds = [], []
+        for _, _, _, blocks, bounds in terms:
+            # blocks that may hold docids of the window:
+            first = int(np.searchsorted(blocks.last_docids, start))
+            last = min(int(np.searchsorted(blocks.last_docids, end - 1)) + 1,
+                       len(blocks))
+            spans.append((first, last))
+            window_bounds.append(bounds[first:last].max()
+                                 if first < last else 0)
+        present = [i for i, (first, last) in enumerate(spans) if first < last]
+        ordered = sorted(present, key=lambda i: -window_bounds[i])
+        # float sums are done in another order than the final scores, so
+        # only prune on a clear margin:
+        slack = 1e-9*(1 + sum(abs(terms[i][2]) + window_bounds[i]
+                              for i in present))
+        # bounds of the summed contributions of the terms from the j-th of
+        # ordered on, the lower one being what negative idfs may take off:
+        rem_bounds = np.cumsum([window_bounds[i] for i in ordered][::-1])
+        rem_bounds = np.append(rem_bounds[::-1], 0)
+        rem_lows = np.cumsum([terms[i][2] for i in ordered][::-1])
+        rem_lows = np.append(rem_lows[::-1], 0)
+
+        # essential terms, best first, theta rising with the partial scores:
+        term_postings = {} # term index: (docids, scores) of the window
+        n_essential = 0
+        while (n_essential < len(ordered) and
+               rem_bounds[n_essential] >= theta - slack):
+            i = ordered[n_essential]
+            qf, n_i, _, blocks, _ = terms[i]
+            docids, counts = blocks.decode(np.arange(*spans[i]))
+            if docids[0] < start or docids[-1] >= end:
+                inside = (docids >= start) & (docids < end)
+                docids, counts = docids[inside], counts[inside]
+            scores = self.postings_scores(docids, counts, n_i, qf)
+            self.acc[docids] += scores
+            self.touched[docids] = True
+            term_postings[i] = (docids, scores)
+            n_essential += 1
+            # the partial scores are at most the bounds of the terms scored,
+            # theta is only worth raising if that may beat the terms left:
+            if (n_essential == len(ordered) or
+                    rem_bounds[0] - rem_bounds[n_essential] +
+                    rem_lows[n_essential] >= rem_bounds[n_essential] - slack):
+                theta = self.raise_theta(theta, best_scores,
+                    self.acc[docids] + rem_lows[n_essential], k)
+        if not n_essential:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        window_cand = start + np.flatnonzero(self.touched[start:end])
+        self.touched[window_cand] = False
+        # a doc below theta even with the bounds of all the terms left is out:
+        cand = window_cand[self.acc[window_cand] + rem_bounds[n_essential] >=
+                           theta - slack]
+
+        # non-essential terms, best first, only probed for the docs left,
+        # those whose partial score plus the bounds of the blocks holding
+        # them in the lists left may still reach theta:
+        non_essential = ordered[n_essential:]
+        block_inx, cand_bounds = [], []
+        for i in non_essential:
+            blocks, bounds = terms[i][3], terms[i][4]
+            inx = np.searchsorted(blocks.last_docids, cand)
+            block_inx.append(inx)
+            cand_bounds.append(np.where(inx < len(blocks),
+                bounds[np.minimum(inx, len(blocks) - 1)], 0))
+        rem_bound = sum(cand_bounds, np.zeros(len(cand)))
+        alive = np.ones(len(cand), dtype=bool)
+        for j, i in enumerate(non_essential):
+            qf, n_i, _, blocks, _ = terms[i]
+            inx = block_inx[j]
+            alive &= self.acc[cand] + rem_bound >= theta - slack
+            rem_bound -= cand_bounds[j]
+            probe = np.flatnonzero(alive & (inx < len(blocks)))
+            needed = inx[probe]
+            # cand are sorted, so are their blocks:
+            needed = needed[np.append(True, needed[1:] != needed[:-1])]
+            if len(needed) and 2*len(needed) > needed[-1] - needed[0] + 1:
+                # cheaper to decode the whole run of blocks in one go:
+                needed = np.arange(needed[0], needed[-1] + 1)
+            docids, counts = blocks.decode(needed)
+            found, at = self.find_postings(docids, cand[probe])
+            docids = docids[at]
+            scores = self.postings_scores(docids, counts[at], n_i, qf)
+            self.acc[docids] += scores
+            term_postings[i] = (docids, scores)
+            theta = self.raise_theta(theta, best_scores,
+                self.acc[cand[alive]] + rem_lows[n_essential + j + 1], k)
+        alive &= self.acc[cand] >= theta - slack
+        self.acc[window_cand] = 0
+        cand = cand[alive]
+        # exact scores, summed in query term order as score() does:
+        scores = np.zeros(len(cand), dtype=np.float64)
+        for i in sorted(term_postings):
+            docids, term_scores = term_postings[i]
+            found, at = self.find_postings(docids, cand)
+            scores[found] += term_scores[at]
+        return cand, scores
@@ -29,11 +29,8 @@ Counter({223387: 1})
 import os
 import sys
 import pickle
-import numpy as np
 import gzip
 from index_helpers import MetaData, timing, Query
-import operator
-from collections import Counter
 
 # setup code:
 index_wd = '/Users/nikhilarora/data/latimes/index_dir_baseline'
@@ -56,51 +53,19 @@ def run_query(index_wd, queries_file, output_file):
 
     run_tag = 'n5aroraBM25STEM'
     main_result= []
-    doc_scores = {}
     # loop through queries:
     for topid, query_str in queries.items():
         print(str(topid), query_str)
         tokens = query.tokenize(query_str) # tokenize
 
         print("Tokens: {}".format(str(tokens)))
-        term_ids = query.conv_tokens_to_ids(tokens) # lexicon used term->termid
-        print("matching ids: {}".format(str(term_ids)))
-        tkn_cts = Counter(term_ids)
+        tkn_cts = query.lexicon.conv_tokens_vect(tokens) # termid: qf
         print(tkn_cts)
-        postings_lists = query.general_retrieval(term_ids)
-
-
-        for termid, posting_ls in postings_lists.items():
-            r_i = 0 # no rel info known
-            R = 0 # no rel info known
-            N = query.invIndex.coll_len
-            coll_token_sum = query.invIndex.coll_token_sum
-            n_i = len(posting_ls)# num of docs containing current term
-            for docid, count in posting_ls:
-                # compute score...
-                k_1 = 1.2
-                k_2 = 7
-                b = 0.75
-                dl = int(query.docid_to_metadata(docid).doc_len)
-                avg_dl = coll_token_sum/N
-                qf = tkn_cts[termid] # gets to freq of term in query
-                df = count # gets freq of term in doc
-                K = k_1*((1-b)+(b*(dl/avg_dl)))
-                qf_term = ( (k_2+1)*qf) / (k_2+qf)
-                df_term = ( (k_1+1)*df) / (K+df)
-                idf_term = np.log( ((r_i + 0.5)/(R - r_i + 0.5)) \
-                    / ((n_i - r_i + 0.5)/(N - n_i - R - r_i - 0.5)) )
-                score = qf_term * df_term * idf_term
-                if docid in doc_scores:
-                    doc_scores[docid] += score
-                else:
-                    doc_scores[docid] = score
-        sorted_doc_scores = sorted(doc_scores.items(), \
-            key=operator.itemgetter(1), reverse=True)
-        sorted_doc_scores = sorted_doc_scores[0:1000]
+        sorted_doc_scores = query.search(query_str, k=1000, k1=1.2, b=0.75,
+                                         k2=7)
         rank = 0
         for docid, score in sorted_doc_scores:
-            docno = query.docid_to_metadata(docid).docno.strip()
+            docno = query.docid_to_docno[docid].strip()
             rank += 1
             res_doc_str = "{topid} q0 {docno} {rank} {score} {run_tag}"\
                             .format(
@@ -116,6 +81,7 @@ def run_query(index_wd, queries_file, output_file):
     with open(output_file, 'w') as wfile:
         for line in main_result:
             wfile.write("{}\n".format(line))
+    print(query.result_cache.summary())
     print("Query complete.")
 
 # kick of ranking:
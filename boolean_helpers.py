@@ -0,0 +1,56 @@
+"""
+Conjunctive (Boolean AND) query evaluation over docid sorted postings.
+
+Terms are intersected in increasing df order: the candidate docids start as
+the shortest postings list and each following list is binary searched (with
+np.searchsorted) for the remaining candidates only, so the work per list is
+O(candidates * log(df)) and the candidate set can only shrink.  Postings
+lists are fetched lazily, once the candidates run out the remaining lists are
+never decoded.
+
+Contains:
+
+Methods:
+- conjunctive_match(termids, get_df, get_posting_ls)
+"""
+import numpy as np
+from bm25_helpers import BM25Scorer
+
+
+def conjunctive_match(termids, get_df, get_posting_ls):
+    """Boolean AND of the postings lists of termids.
+
+    Parameters
+    ----------
+    termids : list
+        termids that all exist in the index
+    get_df : callable
+        termid -> df, used to order the terms
+    get_posting_ls : callable
+        termid -> (docids, counts)
+
+    Returns
+    -------
+    (docids, counts) where docids is the sorted array of docs containing all
+    terms and counts a dict of termid: array of the term's count in each doc
+    """
+    termids = sorted(set(termids), key=get_df)
+    if not termids:
+        return np.zeros(0, dtype=np.int64), {}
+    docids, counts = get_posting_ls(termids[0])
+    cand = np.asarray(docids, dtype=np.int64)
+    cand_counts = {termids[0]: np.asarray(counts)}
+    for termid in termids[1:]:
+        if len(cand) == 0:
+            break
+        docids, counts = get_posting_ls(termid)
+        found, inx = BM25Scorer.find_postings(
+            np.asarray(docids, dtype=np.int64), cand)
+        cand = cand[found]
+        for prev in cand_counts:
+            cand_counts[prev] = cand_counts[prev][found]
+        cand_counts[termid] = np.asarray(counts)[inx]
+    if len(cand) == 0:
+        return cand, {termid: np.zeros(0, dtype=np.uint32)
+                      for termid in termids}
+    return cand, cand_counts
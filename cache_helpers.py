@@ -0,0 +1,303 @@
+"""
+Size bounded in-memory caches.
+
+Contains:
+
+Methods:
+- results_nbytes(value)
+
+Classes:
+- LRUCache
+- ResultCache
+- FrequencySketch
+- PostingsCache
+"""
+import sys
+from collections import OrderedDict
+import numpy as np
+
+SKETCH_WIDTH = 2**16
+# odd multipliers hashing a key to one counter per sketch row:
+SKETCH_SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9,
+                0xD6E8FEB86659FD93)
+
+
+class LRUCache(object):
+    """Least recently used cache bounded by a number of entries and/or a
+    number of bytes.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        most entries kept, None for no limit
+    max_bytes : int, optional
+        most bytes kept, as measured by size_of, None for no limit
+    size_of : callable, optional
+        value -> size in bytes, required with max_bytes
+
+    Notes
+    -----
+    hits, misses and evictions are counted so the budget can be sized by
+    replaying real queries, see stats().  A cache with max_entries=0 never
+    stores anything (every get is a miss).
+    """
+    def __init__(self, max_entries=None, max_bytes=None, size_of=None):
+        if max_bytes is not None and size_of is None:
+            raise ValueError("size_of is required to bound the cache in bytes.")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.entries = OrderedDict() # key: (value, nbytes), oldest first
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        """Membership test, doesn't count as a hit or miss"""
+        return key in self.entries
+
+    def get(self, key, default=None):
+        """Returns the value of key, marking it most recently used"""
+        if key not in self.entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, value):
+        """Adds or replaces key then evicts the least recently used entries
+        until the cache is within budget.
+        """
+        if self.max_entries == 0:
+            return
+        nbytes = self.size_of(value) if self.size_of is not None else 0
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+        self.entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.entries and self._over_budget():
+            _, (_, old_nbytes) = self.entries.popitem(last=False)
+            self.nbytes -= old_nbytes
+            self.evictions += 1
+
+    def _over_budget(self):
+        if self.max_entries is not None and len(self.entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.nbytes > self.max_bytes
+
+    def clear(self):
+        """Drops every entry, the counters are kept"""
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """Returns the counters and current size as a dict"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'nbytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits/lookups if lookups else 0.0,
+        }
+
+
+def results_nbytes(value):
+    """Approximate memory used by a ResultCache value ((docid, score) pairs,
+    seconds)
+    """
+    results, secs = value
+    nbytes = sys.getsizeof(value) + sys.getsizeof(results) + sys.getsizeof(secs)
+    if results:
+        docid, score = results[0]
+        nbytes += len(results)*(sys.getsizeof(results[0]) +
+                                sys.getsizeof(docid) + sys.getsizeof(score))
+    return nbytes
+
+
+class ResultCache(LRUCache):
+    """LRUCache of ranked results, bounded by max_bytes, for one index
+    generation: check_generation drops every entry when the index changed.
+
+    Each entry also keeps how long computing its results took, the sum over
+    the hits is reported as the latency saved (see stats()).
+    """
+    def __init__(self, generation=None, max_entries=None, max_bytes=None):
+        super(ResultCache, self).__init__(max_entries=max_entries,
+            max_bytes=max_bytes, size_of=results_nbytes)
+        self.generation = generation
+        self.invalidations = 0
+        self.saved_secs = 0.0
+
+    def check_generation(self, generation):
+        """Clears the cache if generation isn't the one it was filled for"""
+        if generation != self.generation:
+            if self.entries:
+                self.invalidations += 1
+            self.clear()
+            self.generation = generation
+
+    def get_results(self, key):
+        """Returns a copy of the cached results of key or None"""
+        value = self.get(key)
+        if value is None:
+            return None
+        results, secs = value
+        self.saved_secs += secs
+        return list(results)
+
+    def put_results(self, key, results, secs):
+        """Caches results, computed in secs, under key"""
+        self.put(key, (tuple(results), secs))
+
+    def stats(self):
+        """Returns the LRUCache stats, invalidations and the seconds saved"""
+        stats = super(ResultCache, self).stats()
+        stats['invalidations'] = self.invalidations
+        stats['saved_secs'] = self.saved_secs
+        return stats
+
+    def summary(self):
+        """One line of the stats for timing output"""
+        stats = self.stats()
+        return ("Result cache: hit rate {:.1%} ({} hits, {} misses), "
+                "{:.3f} ms saved, {} entries, {:.1f} KB".format(
+                stats['hit_rate'], stats['hits'], stats['misses'],
+                stats['saved_secs']*1000, stats['entries'],
+                stats['nbytes']/1024))
+
+
+class FrequencySketch(object):
+    """Count-min sketch of the access frequency of int keys (e.g. termids)
+    with aging, as used by TinyLFU: once sample_size accesses were counted
+    every counter is halved, so past popularity fades.
+    """
+    def __init__(self, width=SKETCH_WIDTH, sample_size=None):
+        self.width = width
+        self.table = np.zeros((len(SKETCH_SEEDS), width), dtype=np.uint16)
+        self.sample_size = sample_size or 10*width
+        self.additions = 0
+
+    def _indexes(self, key):
+        """Counter of key in each row"""
+        return [((key*seed & 0xFFFFFFFFFFFFFFFF) >> 32) % self.width
+                for seed in SKETCH_SEEDS]
+
+    def increment(self, key, count=1):
+        """Counts count accesses of key"""
+        for row, inx in enumerate(self._indexes(key)):
+            self.table[row, inx] = min(int(self.table[row, inx]) + count,
+                                       np.iinfo(np.uint16).max)
+        self.additions += count
+        if self.additions >= self.sample_size:
+            self.table >>= 1
+            self.additions //= 2
+
+    def estimate(self, key):
+        """Estimated (never under counted) recent accesses of key"""
+        return min(int(self.table[row, inx])
+                   for row, inx in enumerate(self._indexes(key)))
+
+
+class PostingsCache(object):
+    """Decoded postings lists ((docids, counts) arrays, made read only) of
+    the hot terms, bounded by max_bytes of array data.
+
+    Every lookup is counted in a FrequencySketch.  While the cache has room
+    any postings list is admitted, once full a new one is only admitted if
+    it was looked up more often than each of the least recently used
+    entries it would evict (TinyLFU admission), so a burst of rare terms
+    doesn't flush the common ones.
+    """
+    def __init__(self, max_bytes, sketch_width=SKETCH_WIDTH):
+        self.max_bytes = max_bytes
+        self.sketch = FrequencySketch(sketch_width)
+        self.entries = OrderedDict() # termid: (postings, nbytes), LRU first
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.admissions = 0
+        self.rejections = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, termid):
+        """Membership test, isn't counted as an access"""
+        return termid in self.entries
+
+    def get(self, termid):
+        """Returns the cached postings of termid or None, counting the
+        access.
+        """
+        self.sketch.increment(termid)
+        entry = self.entries.get(termid)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(termid)
+        return entry[0]
+
+    def put(self, termid, postings):
+        """Offers the decoded postings of termid to the cache.
+        Returns: True if admitted
+        """
+        nbytes = sum(array.nbytes for array in postings)
+        if termid in self.entries or nbytes > self.max_bytes:
+            return False
+        freq = self.sketch.estimate(termid)
+        victims = []
+        freed = 0
+        for victim, (_, victim_nbytes) in self.entries.items():
+            if self.nbytes - freed + nbytes <= self.max_bytes:
+                break
+            if self.sketch.estimate(victim) >= freq:
+                self.rejections += 1
+                return False
+            victims.append(victim)
+            freed += victim_nbytes
+        for victim in victims:
+            self.nbytes -= self.entries.pop(victim)[1]
+            self.evictions += 1
+        for array in postings:
+            array.setflags(write=False)
+        self.entries[termid] = (postings, nbytes)
+        self.nbytes += nbytes
+        self.admissions += 1
+        return True
+
+    def clear(self):
+        """Drops every entry, the counters and sketch are kept"""
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """Returns the counters and current size as a dict"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'nbytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'admissions': self.admissions,
+            'rejections': self.rejections,
+            'evictions': self.evictions,
+            'hit_rate': self.hits/lookups if lookups else 0.0,
+        }
+
+    def summary(self):
+        """One line of the stats for timing output"""
+        stats = self.stats()
+        return ("Postings cache: hit rate {:.1%} ({} hits, {} misses), "
+                "{} entries, {:.1f} MB, {} rejected, {} evicted".format(
+                stats['hit_rate'], stats['hits'], stats['misses'],
+                stats['entries'], stats['nbytes']/1024/1024,
+                stats['rejections'], stats['evictions']))
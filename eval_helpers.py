@@ -1,13 +1,24 @@
-"""helper functions for system evals"""
+"""helper functions for system evals
 
+The per topic measures below are also computed for all the topics of a run
+at once by metrics_helpers; compile_qrels, DocLens and read_run feed it for
+eval_runs.py.
+"""
+import os
+import pickle
 import numpy as np
 import pandas as pd
-from index_helpers import (Query)
+import metrics_helpers
+from index_helpers import (Query, DocStats)
+from segment_helpers import SegmentManifest
 
 index_wd= '/Users/nikhilarora/data/latimes/index_dir_baseline'
-query = Query(index_wd)
-docno = 'LA030690-0168'
-print(query.docno_to_metadata(docno).doc_len)
+query = None # loaded by get_doc_len_vect
+
+QRELS_HEADINGS = ['topic_id', '_', 'docno', 'relevance']
+RES_HEADINGS = ['topic_id', '_', 'docno', 'rank', 'score', 'run_id']
+RUN_CHUNK_ROWS = 100000
+MEASURES = ['ap', 'p@10', 'ndcg@10', 'ndcg@1000', 'tbg']
 
 def get_rank(ind):
     return ind + 1
@@ -20,6 +31,9 @@ def get_rel_vect(ind, topic_df):
 
 def get_doc_len_vect(docno_vect):
     # searchup each document no and return workcount
+    global query
+    if query is None:
+        query = Query(index_wd)
     doc_len_vect = []
     for docno in docno_vect:
         doc_len_vect.append(query.docno_to_metadata(docno).doc_len)
@@ -79,6 +93,102 @@ def get_tbg_k(rel_vect, doc_len_vect, k):
         TBG += g_k*d_t
     return TBG
 
+def compile_qrels(qrels_f):
+    """Reads the qrels once into the lookup used to judge runs.
+    Returns: (qrels, rel_counts), qrels being {topic_id: {docno:
+    relevance}} and rel_counts {topic_id: number of relevant docs}
+    """
+    qrels_df = pd.read_csv(qrels_f, delimiter=' ', names=QRELS_HEADINGS)
+    qrels, rel_counts = {}, {}
+    for topic_id, topic_df in qrels_df.groupby('topic_id'):
+        qrels[topic_id] = dict(zip(topic_df['docno'],
+                                   topic_df['relevance'].tolist()))
+        rel_counts[topic_id] = int((topic_df['relevance'] == 1).sum())
+    return qrels, rel_counts
+
+
+class DocLens(object):
+    """Doc lengths by docno from the doc_lens.npy of an index (and its
+    segments), without loading the index.
+    """
+    def __init__(self, index_wd):
+        docid_to_docno = pickle.load(open(os.path.join(index_wd,
+            'docid_to_docno.p'), 'rb'))
+        docStats = DocStats(index_wd)
+        docStats.load()
+        doc_lens_ls = [np.asarray(docStats.doc_lens)]
+        base = len(doc_lens_ls[0]) - 1
+        segments = SegmentManifest(index_wd)
+        for entry in segments.load()['segments']:
+            segment_wd = segments.segment_dir(entry['name'])
+            with open(os.path.join(segment_wd, 'docid_to_docno.p'), 'rb') as f:
+                docid_to_docno.update((base + docid, docno) for docid, docno
+                                      in pickle.load(f).items())
+            docStats = DocStats(segment_wd)
+            docStats.load()
+            doc_lens_ls.append(docStats.doc_lens[1:])
+            base += len(docStats.doc_lens) - 1
+        self.doc_lens = np.concatenate(doc_lens_ls)
+        self.docno_to_docid = {docno.strip(): docid for docid, docno in
+                               docid_to_docno.items()}
+
+    def get(self, docnos):
+        """Returns the array of the lengths of docnos, KeyError for a docno
+        not in the index.
+        """
+        return self.doc_lens[[self.docno_to_docid[docno] for docno in docnos]]
+
+
+def read_run(res_f, chunk_rows=RUN_CHUNK_ROWS):
+    """Streams a TREC run file chunk_rows lines at a time.
+    Returns: (run_id, {topic_id: docnos by decreasing score}), ties keeping
+    the file order
+    """
+    run_id = None
+    docnos, scores = {}, {}
+    for chunk in pd.read_csv(res_f, delimiter=' ', names=RES_HEADINGS,
+                             chunksize=chunk_rows):
+        if run_id is None and len(chunk):
+            run_id = chunk['run_id'].iloc[0]
+        for topic_id, topic_df in chunk.groupby('topic_id', sort=False):
+            docnos.setdefault(topic_id, []).append(
+                topic_df['docno'].to_numpy())
+            scores.setdefault(topic_id, []).append(
+                topic_df['score'].to_numpy(dtype=np.float64))
+    run = {}
+    for topic_id in docnos:
+        order = np.argsort(-np.concatenate(scores[topic_id]), kind='stable')
+        run[topic_id] = np.concatenate(docnos[topic_id])[order].tolist()
+    return run_id, run
+
+def run_measures(run, qrels, rel_counts, doc_lens, k=1000):
+    """The measures of every topic of run (see read_run) as the per topic
+    loop of system_eval.py computes them, with metrics_helpers.
+    Returns: DataFrame of topic_id and MEASURES, by topic_id
+    """
+    topic_ids = sorted(run)
+    rel_vects = [[qrels.get(topic_id, {}).get(docno, 0)
+                  for docno in run[topic_id]] for topic_id in topic_ids]
+    R = [rel_counts[topic_id] for topic_id in topic_ids]
+    if not all(R):
+        raise ValueError("A topic of the run has no relevant doc.")
+    rels, lengths = metrics_helpers.pad_rows(rel_vects, k)
+    doc_len_mat, _ = metrics_helpers.pad_rows(
+        [doc_lens.get(run[topic_id][:k]) for topic_id in topic_ids], k)
+    measures_df = pd.DataFrame({
+        'topic_id': topic_ids,
+        'ap': metrics_helpers.avg_precision_k(rels, R, k),
+        'p@10': metrics_helpers.precision_at_k(rels, 10),
+        'ndcg@10': metrics_helpers.ndcg_k(rels, lengths, 10),
+        'ndcg@1000': metrics_helpers.ndcg_k(rels, lengths, k),
+        'tbg': metrics_helpers.tbg_k(rels, doc_len_mat, lengths, k)})
+    return measures_df.fillna(0)
+
+def mean_measures(measures_df):
+    """The means of the MEASURES columns, rounded as mean_eff_measures.py"""
+    return {'mean_' + measure: round(measures_df[measure].sum()/
+            len(measures_df[measure]), 3) for measure in MEASURES}
+
 
 #print(get_tbg_k( [1,1,0,1,0,0,0], [50, 75, 45, 50, 30], 5 ))
 assert(get_ndcg_k([1,1,0,1,0,0,0], 5) < 1)
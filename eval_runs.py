@@ -0,0 +1,119 @@
+"""
+Evaluation of many runs at once.
+
+The qrels are compiled once into a lookup and the doc lengths (for TBG)
+read from the doc_lens.npy of the index, then the runs are evaluated by a
+pool of processes forked after both are loaded (passed to the workers
+where processes are spawned instead, macOS): each run file is streamed in
+chunks and its topics scored together by metrics_helpers.  Writes, like
+system_eval.py, <run_id>_metrics.csv with the measures of each topic of a
+run, and mean_metrics.csv with the means of each run as computed by
+mean_eff_measures.py ("bad format" for a run that couldn't be evaluated).
+
+example usage:
+```
+python eval_runs.py --qrel "/Users/nikhilarora/data/latimes/a3/upload-to-learn\\
+/qrels/LA-only.trec8-401.450.minus416-423-437-444-447.txt" \\
+--results /Users/nikhilarora/data/latimes/a3/upload-to-learn/results-files/*.results \\
+--index /Users/nikhilarora/data/latimes/index_dir_baseline \\
+--output-dir /Users/nikhilarora/data/latimes/a3/outputs/ --workers 4
+```
+"""
+import os
+import sys
+import argparse
+import functools
+import multiprocessing as mp
+import pandas as pd
+from eval_helpers import (compile_qrels, DocLens, read_run, run_measures,
+                          mean_measures, MEASURES)
+
+parser = argparse.ArgumentParser(description='Evaluates run files in \
+    parallel, writing the per topic and mean measures of each.')
+parser.add_argument('--qrel', required=True, help='Path to qrel')
+parser.add_argument('--results', required=True, nargs='+',
+    help='Paths to the run files')
+parser.add_argument('--index', required=True,
+    help='Path to the index holding the docs (doc lengths for TBG)')
+parser.add_argument('--output-dir', required=True,
+    help='Dir the metrics CSVs are written to')
+parser.add_argument('--max-results', type=int, default=1000,
+    help='Results of a topic counted by AP, nDCG@1000 and TBG')
+parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+    help='Number of evaluating processes')
+
+# (qrels, rel_counts, doc_lens) of the current process, set before the pool
+# forks (else by init_worker):
+JUDGEMENTS = None
+
+
+def init_worker(judgements):
+    """Pool initializer, sets JUDGEMENTS unless inherited from the parent"""
+    global JUDGEMENTS
+    if JUDGEMENTS is None:
+        JUDGEMENTS = judgements
+
+def evaluate_run(res_f, k=1000):
+    """Evaluates the run at res_f against JUDGEMENTS.
+    Returns: (res_f, run_id, measures DataFrame, error), measures being None
+    and error the parse or format error if the run is incorrectly formatted
+    """
+    qrels, rel_counts, doc_lens = JUDGEMENTS
+    try:
+        run_id, run = read_run(res_f)
+        return res_f, run_id, run_measures(run, qrels, rel_counts, doc_lens,
+                                           k), None
+    except (pd.errors.ParserError, KeyError, ValueError) as e:
+        return res_f, None, None, repr(e)
+
+def eval_runs(qrels_f, results, index_wd, output_dir, k=1000, workers=1):
+    """Evaluates the run files results, writes their metrics CSVs to
+    output_dir.
+    Returns: the DataFrame of the mean measures of each run
+    """
+    global JUDGEMENTS
+    JUDGEMENTS = compile_qrels(qrels_f) + (DocLens(index_wd),)
+    mean_dict = {'run_name': []}
+    mean_dict.update(('mean_' + measure, []) for measure in MEASURES)
+    with mp.Pool(min(workers, len(results)), initializer=init_worker,
+                 initargs=(JUDGEMENTS,)) as pool:
+        for res_f, run_id, measures_df, error in pool.imap(
+                functools.partial(evaluate_run, k=k), results):
+            run_name = os.path.splitext(os.path.basename(res_f))[0]
+            mean_dict['run_name'].append(run_name)
+            if error is not None:
+                print("{} file is incorrectly formatted! ({})".format(res_f,
+                      error))
+                for measure in MEASURES:
+                    mean_dict['mean_' + measure].append("bad format")
+                continue
+            print("Evaluated {} topics of {}".format(len(measures_df), run_id))
+            measures_df.to_csv(os.path.join(output_dir,
+                '{}_metrics.csv'.format(run_id)))
+            for name, value in mean_measures(measures_df).items():
+                mean_dict[name].append(value)
+    metrics_df = pd.DataFrame(mean_dict)
+    metrics_df.to_csv(os.path.join(output_dir, 'mean_metrics.csv'),
+                      index=False)
+    return metrics_df
+
+def validate_args(cli):
+    for path in [cli.qrel] + cli.results:
+        if not os.path.isfile(path):
+            print("File: {} does not exist.".format(path))
+            sys.exit()
+    if not os.path.isfile(os.path.join(cli.index, 'doc_lens.npy')):
+        print("Index dir: {} has no doc_lens.npy.".format(cli.index))
+        sys.exit()
+    if not os.path.isdir(cli.output_dir):
+        print("Output dir: {} does not exist.".format(cli.output_dir))
+        sys.exit()
+    if cli.workers < 1:
+        print("--workers must be at least 1.")
+        sys.exit()
+
+if __name__ == '__main__':
+    cli = parser.parse_args()
+    validate_args(cli)
+    print(eval_runs(cli.qrel, cli.results, cli.index, cli.output_dir,
+                    k=cli.max_results, workers=cli.workers))
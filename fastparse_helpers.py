@@ -0,0 +1,126 @@
+"""
+Byte level document splitting and ElementTree free field extraction, the
+fast=True modes of doc_gen, DocParser and LightDocParser.
+
+split_docs reads the decompressed collection in large byte chunks and finds
+the <DOC>/</DOC> boundaries with one regex search per doc instead of
+lowercasing every line.  Each doc is normalized the same way doc_gen does it
+(every line stripped and followed by a space), so both modes yield the same
+docs.
+
+extract_fields scans a doc once with a tag regex and returns, for the wanted
+children of the root element, the concatenated text of their leaf elements,
+which is what DocParser.grab_tag_cont computes from the xml tree.
+
+Contains:
+
+Methods:
+- split_docs(fstream, start_tag, end_tag, chunk_size)
+- extract_fields(doc, tags)
+"""
+import re
+
+CHUNK_SIZE = 16*1024*1024
+
+# start or end tag: (closing slash, name, self closing slash)
+TAG_RE = re.compile(r'<(/?)([^\s>/!?]+)[^>]*?(/?)>')
+ENTITY_RE = re.compile(r'&(#[0-9]+|#x[0-9a-fA-F]+|amp|lt|gt|quot|apos);')
+ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+
+
+def split_docs(fstream, start_tag='<DOC>', end_tag='</DOC>',
+               chunk_size=CHUNK_SIZE):
+    """Yields the docs of fstream (binary, or a text stream over one, e.g.
+    gzip.open(path, 'rt')) like doc_gen, tags are matched ignoring case.
+    """
+    raw = getattr(fstream, 'buffer', fstream)
+    start_re = re.compile(re.escape(start_tag.encode('utf-8')), re.IGNORECASE)
+    end_re = re.compile(re.escape(end_tag.encode('utf-8')), re.IGNORECASE)
+    buf = b''
+    pos = 0 # end of the last doc yielded
+    eof = False
+    while True:
+        start = start_re.search(buf, pos)
+        doc_end = -1
+        if start is not None:
+            # docs span whole lines and, as in doc_gen, the end tag is only
+            # looked for from the line after the start tag's:
+            line_end = buf.find(b'\n', start.end())
+            end = end_re.search(buf, line_end) if line_end != -1 else None
+            if end is not None:
+                doc_end = buf.find(b'\n', end.end())
+                if doc_end == -1 and eof:
+                    doc_end = len(buf)
+        if doc_end != -1:
+            doc_start = buf.rfind(b'\n', 0, start.start()) + 1
+            yield normalize_doc(buf[doc_start:doc_end].decode('utf-8'))
+            pos = doc_end
+            continue
+        if eof:
+            break
+        # drop the consumed bytes, keeping the line of a doc being read or
+        # that of a start tag cut by the chunk boundary:
+        if start is not None:
+            keep = buf.rfind(b'\n', 0, start.start()) + 1
+        else:
+            keep = buf.rfind(b'\n', 0, max(pos, len(buf) - len(start_tag))) + 1
+        buf = buf[keep:]
+        pos = max(pos - keep, 0)
+        chunk = raw.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf += chunk
+
+def normalize_doc(text):
+    """Strips every line of text and ends each with a space, as doc_gen does"""
+    if '\r' in text:
+        # universal newlines, as when reading the stream in text mode:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return ' '.join(map(str.strip, text.split('\n'))) + ' '
+
+def _unescape(text):
+    """Replaces the xml predefined entities and character references"""
+    if '&' not in text:
+        return text
+    def replace(match):
+        ref = match.group(1)
+        if ref.startswith('#x'):
+            return chr(int(ref[2:], 16))
+        if ref.startswith('#'):
+            return chr(int(ref[1:]))
+        return ENTITIES[ref]
+    return ENTITY_RE.sub(replace, text)
+
+def extract_fields(doc, tags):
+    """Returns {tag: text} for the children of the doc's root element named
+    (ignoring case) in tags, text being the concatenation of the text of
+    their leaf elements (an element without children contributes its own
+    text).
+    """
+    wanted = {tag.lower(): tag for tag in tags}
+    cont_dict = {}
+    depth = 0
+    field = None # tag of the wanted root child being read
+    parts = []
+    text_start = None # end of the last start tag, if no tag followed it
+    for match in TAG_RE.finditer(doc):
+        closing, name, self_closing = match.groups()
+        if closing:
+            if text_start is not None and field is not None:
+                parts.append(doc[text_start:match.start()])
+            text_start = None
+            depth -= 1
+            if depth == 1 and field is not None:
+                cont_dict[field] = _unescape(''.join(parts))
+                field = None
+        elif self_closing:
+            text_start = None
+            if depth == 1 and name.lower() in wanted:
+                cont_dict[wanted[name.lower()]] = ''
+        else:
+            depth += 1
+            if depth == 2 and name.lower() in wanted:
+                field = wanted[name.lower()]
+                parts = []
+            text_start = match.end()
+    return cont_dict
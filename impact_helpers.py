@@ -0,0 +1,225 @@
+"""
+Impact-ordered index for fixed parameter BM25 with score-at-a-time querying.
+
+Built from an existing index dir, it stores for every posting its BM25 score
+(for qf=1) quantized to a small signed integer, the impact.  Each term's
+postings are grouped into segments of equal impact, stored by decreasing
+impact, with the docids of a segment gap/vbyte encoded.
+
+Files written to <index_wd>/impact:
+- impact_header.p : BM25 parameters (k1, b and the k2 of the query term
+                    weights), quantization scale and collection size
+- impact_postings.bin : vbyte encoded docid gaps of every segment
+- impact_segments.npy : one record per segment (see SEGMENTS_DTYPE), grouped
+                        by termid and ordered by decreasing impact
+- impact_terms.npy : termid sorted table of each term's first segment
+
+At query time the impacts of each query term are weighted by BM25's query
+term factor (k2+1)*qf/(k2+qf) (1 for qf=1) and rounded, the segments of all
+query terms are processed by decreasing weighted impact, adding integers
+into an accumulator, and processing can stop after a given number of
+postings.
+
+Contains:
+
+Methods:
+- build_impact_index(index_wd, k1, b, bits, k2)
+
+Classes:
+- ImpactIndex
+"""
+import os
+import mmap
+import pickle
+import numpy as np
+from postings_helpers import vbyte_encode, vbyte_decode
+from bm25_helpers import BM25Scorer, top_k
+
+IMPACT_DIR = 'impact'
+HEADER_FILE = 'impact_header.p'
+POSTINGS_FILE = 'impact_postings.bin'
+SEGMENTS_FILE = 'impact_segments.npy'
+TERMS_FILE = 'impact_terms.npy'
+
+SEGMENTS_DTYPE = np.dtype([
+    ('impact', np.int32),
+    ('offset', np.uint64), # start of the segment's docids in the postings
+    ('nbytes', np.uint32),
+    ('n_postings', np.uint32),
+])
+
+TERMS_DTYPE = np.dtype([
+    ('termid', np.int64),
+    ('first_segment', np.uint64),
+    ('n_segments', np.uint32),
+])
+
+
+def build_impact_index(index_wd, k1=1.2, b=0.75, bits=8, k2=7):
+    """Builds <index_wd>/impact from the index in index_wd.
+
+    Parameters
+    ----------
+    index_wd : str
+        path to an index built by IndexEngine.py
+    k1, b : float
+        BM25 parameters the impacts are computed with
+    bits : int
+        size of the signed quantized impacts (max 16)
+    k2 : float
+        BM25 k2 the query term frequencies are weighted with
+    """
+    # imported here as index_helpers imports this module:
+    from index_helpers import InvIndex, DocStats
+    if not 2 <= bits <= 16:
+        raise ValueError("bits must be between 2 and 16.")
+    invIndex = InvIndex(index_wd)
+    invIndex.load()
+    docStats = DocStats(index_wd)
+    docStats.load()
+    scorer = BM25Scorer(invIndex, docStats.doc_lens, k1=k1, b=b)
+
+    print("Finding the largest BM25 term score")
+    max_score = 0.0
+    for termid, (docids, counts) in invIndex.items():
+        docids = np.asarray(docids, dtype=np.int64)
+        scores = scorer.postings_scores(docids, counts, len(docids))
+        if len(scores):
+            max_score = max(max_score, float(np.nanmax(np.abs(scores))))
+    max_impact = 2**(bits-1) - 1
+    scale = max_score/max_impact if max_score > 0 else 1.0
+
+    print("Writing impact ordered postings")
+    impact_wd = os.path.join(index_wd, IMPACT_DIR)
+    if not os.path.exists(impact_wd):
+        os.makedirs(impact_wd)
+    segments = []
+    terms = []
+    offset = 0
+    with open(os.path.join(impact_wd, POSTINGS_FILE), 'wb') as f:
+        for termid, (docids, counts) in invIndex.items():
+            docids = np.asarray(docids, dtype=np.int64)
+            scores = scorer.postings_scores(docids, counts, len(docids))
+            impacts = np.rint(np.nan_to_num(scores)/scale).astype(np.int32)
+            # stable sort keeps docids increasing within a segment:
+            order = np.argsort(-impacts, kind='stable')
+            impacts, docids = impacts[order], docids[order]
+            bounds = np.flatnonzero(np.diff(impacts)) + 1
+            starts = np.concatenate(([0], bounds))
+            ends = np.concatenate((bounds, [len(impacts)]))
+            terms.append((termid, len(segments), len(starts)))
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                seg_docids = docids[start:end]
+                enc = vbyte_encode(np.diff(seg_docids, prepend=0))
+                f.write(enc)
+                segments.append((impacts[start], offset, len(enc), end - start))
+                offset += len(enc)
+
+    terms = np.array(terms, dtype=TERMS_DTYPE)
+    terms.sort(order='termid')
+    np.save(os.path.join(impact_wd, SEGMENTS_FILE),
+            np.array(segments, dtype=SEGMENTS_DTYPE))
+    np.save(os.path.join(impact_wd, TERMS_FILE), terms)
+    header = {
+        'k1': k1,
+        'b': b,
+        'k2': k2,
+        'bits': bits,
+        'scale': scale,
+        'coll_size': len(docStats.doc_lens), # max docid + 1
+        'n_postings': sum(segment[3] for segment in segments),
+    }
+    with open(os.path.join(impact_wd, HEADER_FILE), 'wb') as f:
+        pickle.dump(header, f)
+    return header
+
+
+class ImpactIndex(object):
+    """Score-at-a-time access to an impact ordered index."""
+    def __init__(self, index_wd):
+        self.impact_wd = os.path.join(index_wd, IMPACT_DIR)
+        self.header = None
+
+    def exists(self):
+        """True if an impact index was built for the index dir"""
+        return os.path.isfile(os.path.join(self.impact_wd, HEADER_FILE))
+
+    def load(self):
+        """Loads the header and memory-maps the tables and postings"""
+        with open(os.path.join(self.impact_wd, HEADER_FILE), 'rb') as f:
+            self.header = pickle.load(f)
+        self.k1 = self.header['k1']
+        self.b = self.header['b']
+        # k2 of the BM25 queries, for indexes built before it was recorded:
+        self.k2 = self.header.get('k2', 7)
+        self.scale = self.header['scale']
+        self.segments = np.load(os.path.join(self.impact_wd, SEGMENTS_FILE),
+                                mmap_mode='r')
+        self.terms = np.load(os.path.join(self.impact_wd, TERMS_FILE),
+                             mmap_mode='r')
+        self.termids = self.terms['termid']
+        self.buffer = b''
+        postings_path = os.path.join(self.impact_wd, POSTINGS_FILE)
+        if os.path.getsize(postings_path) > 0:
+            with open(postings_path, 'rb') as f:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.acc = np.zeros(self.header['coll_size'], dtype=np.int64)
+        self.touched = np.zeros(self.header['coll_size'], dtype=bool)
+
+    def term_segments(self, termid):
+        """Returns the segment records of termid (empty if not found)"""
+        i = int(np.searchsorted(self.termids, termid))
+        if i == len(self.termids) or self.termids[i] != termid:
+            return self.segments[:0]
+        first = int(self.terms['first_segment'][i])
+        return self.segments[first:first + int(self.terms['n_segments'][i])]
+
+    def segment_docids(self, segment):
+        """Decodes the docids of a segment record"""
+        start = int(segment['offset'])
+        buf = memoryview(self.buffer)[start:start + int(segment['nbytes'])]
+        return np.cumsum(vbyte_decode(buf)).astype(np.int64)
+
+    def qf_weight(self, qf):
+        """BM25 query term factor of a term found qf times in the query"""
+        return (self.k2 + 1)*qf/(self.k2 + qf)
+
+    def rank(self, termid_qfs, k=10, max_postings=None):
+        """Score-at-a-time ranking.
+
+        Parameters
+        ----------
+        termid_qfs : dict
+            termid: frequency of the term in the query, the impacts of the
+            term are weighted by qf_weight(qf)
+        k : int
+        max_postings : int, optional
+            stop after processing this many postings, the highest impact
+            segments are processed first.
+
+        Returns
+        -------
+        list of the k best (docid, score) pairs, score being the summed
+        integer impacts times the quantization scale.
+        """
+        queue = [] # (weighted impact, segment)
+        for termid, qf in termid_qfs.items():
+            weight = self.qf_weight(qf)
+            for segment in self.term_segments(termid):
+                queue.append((int(round(weight*int(segment['impact']))),
+                              segment))
+        queue.sort(key=lambda item: -item[0])
+        processed = 0
+        for impact, segment in queue:
+            if max_postings is not None and processed >= max_postings:
+                break
+            docids = self.segment_docids(segment)
+            self.acc[docids] += impact
+            self.touched[docids] = True
+            processed += len(docids)
+        docids = np.flatnonzero(self.touched)
+        scores = self.acc[docids]
+        self.acc[docids] = 0
+        self.touched[docids] = False
+        docids, scores = top_k(docids, scores, k)
+        return list(zip(docids.tolist(), (scores*self.scale).tolist()))
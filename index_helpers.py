@@ -4,17 +4,24 @@ Contains:
 Methods:
 - timing(func)
 - doc_gen(f_stream)
+- read_queries(queries_file)
+- read_query_log(log_file)
+- metadata_nbytes(metadata)
+- query_signature(termid_qfs)
 
 Classes:
 - DocParser
 - MetaData
+- MetaStore
 - Lexicon
 - InvIndex
+- DocStats
 - Tokenizer
 - Query
 """
 import time
 import os
+import sys
 from collections import Counter
 import xml.etree.ElementTree as ET
 import string
@@ -23,22 +30,44 @@ import pickle
 import gzip
 
 import bisect
-from porterstem import PorterStemmer
+import struct
+import uuid
+from array import array
+import numpy as np
+from stem_helpers import Stemmer
+from postings_helpers import PostingsWriter, PostingsReader
+from bm25_helpers import BM25Scorer, bm25_idf
+from impact_helpers import ImpactIndex
+from boolean_helpers import conjunctive_match
+from record_helpers import RecordWriter, RecordReader
+from cache_helpers import LRUCache, ResultCache, PostingsCache
+from fastparse_helpers import split_docs, extract_fields
+from snippet_helpers import SnippetStore, split_sentences, make_snippet, MARKS
+from segment_helpers import (SegmentManifest, SegmentedLexicon,
+                             SegmentedPostingsReader, SegmentedStore,
+                             SegmentedMetaStore)
+from positions_helpers import (PositionsReader, SegmentedPositionsReader,
+                               candidate_keys, phrase_match, window_match,
+                               proximity_scores)
 
 def timing(f):
-    def wrap(*args):
+    def wrap(*args, **kwargs):
         time1 = time.time()
-        ret = f(*args)
+        ret = f(*args, **kwargs)
         time2 = time.time()
         lapsed_time = round(time2-time1, 3)
         print ('Time taken: {} seconds'.format(str(lapsed_time)))
         return ret
     return wrap
 
-def doc_gen(fstream, start_tag = '<DOC>', end_tag = '</DOC>'):
+def doc_gen(fstream, start_tag = '<DOC>', end_tag = '</DOC>', fast = False):
     """ Takes a fstream of our scrapped data, latimes.gz,
-    and yields one doc at a time.
+    and yields one doc at a time.  With fast, the docs are split from large
+    byte chunks (see fastparse_helpers.split_docs), yielding the same docs.
     """
+    if fast:
+        yield from split_docs(fstream, start_tag, end_tag)
+        return
     doc = ''
     indoc = False # bool holds state of whether within a doc
     for line in fstream:
@@ -57,18 +86,44 @@ def doc_gen(fstream, start_tag = '<DOC>', end_tag = '</DOC>'):
         if indoc:
             doc_ls.append(line.strip() + ' ')
 
+def read_queries(queries_file):
+    """Parses a queries file of alternating topic id and query lines.
+    Returns: dict of topid: query_str
+    """
+    with open(queries_file) as f:
+        lines = f.read().splitlines()
+    queries = {}
+    for i, elem in enumerate(lines):
+        if i % 2 == 0:
+            num = elem
+        else:
+            queries[num] = elem
+    return queries
+
+def read_query_log(log_file):
+    """Returns the queries of a query log, one query per line"""
+    with open(log_file) as f:
+        return [line.strip() for line in f if line.strip()]
+
 class LightDocParser(object):
-    """Used to simply break appart the dom tree for retrieval."""
+    """Used to simply break appart the dom tree for retrieval.  With fast,
+    the tag content is extracted without building the tree.
+    """
     def __init__(self, doc, tags = [
                                 'DOCNO',
                                 'TEXT',
                                 'HEADLINE',
-                                'GRAPHIC']):
+                                'GRAPHIC'],
+                            fast = False):
         self.tags = tags
         self.doc = doc
-        self.tree = ET.fromstring(self.doc)
-        self.cont_dict = {}
-        self._fill_cont_dict()
+        self.tree = None
+        if fast:
+            self.cont_dict = extract_fields(self.doc, self.tags)
+        else:
+            self.tree = ET.fromstring(self.doc)
+            self.cont_dict = {}
+            self._fill_cont_dict()
 
     def _fill_cont_dict(self):
         """Parses doc for self.text_tags and stores content in self.cont_dict"""
@@ -91,7 +146,10 @@ class LightDocParser(object):
         return cont
 
 class DocParser(object):
-    """Uses the xml lib to grab desired elements of the xml dom efficiently"""
+    """Uses the xml lib to grab desired elements of the xml dom efficiently,
+    with fast the tag content is extracted in a single scan instead (see
+    fastparse_helpers.extract_fields), giving the same cont_dict.
+    """
     def __init__(self, doc, tags = [
                                 'DOCNO',
                                 'TEXT',
@@ -101,17 +159,23 @@ class DocParser(object):
                                 'TEXT',
                                 'HEADLINE',
                                 'GRAPHIC'
-                            ]):
+                            ],
+                            fast = False,
+                            stemmer = None):
         self.tags = tags
         self.tokenize_tags = tokenize_tags
         self.doc = doc
-        self.tree = ET.fromstring(self.doc)
-        self.stemmer = PorterStemmer()
-        self.cont_dict = {} #stores flattened tag content
-        self._fill_cont_dict()
+        self.tree = None
+        self.stemmer = stemmer # Stemmer, tokens are stemmed when given
+        if fast:
+            self.cont_dict = extract_fields(self.doc, self.tags)
+        else:
+            self.tree = ET.fromstring(self.doc)
+            self.cont_dict = {} #stores flattened tag content
+            self._fill_cont_dict()
         self.pre_tokens = []
         self.tokens = []
-        self._tokenize()
+        self._tokenize(stem=stemmer is not None)
         self.doc_len = len(self.tokens)
 
     def _fill_cont_dict(self):
@@ -148,26 +212,11 @@ class DocParser(object):
         else:
             for tag in self.tokenize_tags:
                 if tag in self.cont_dict:
-                    self.tokens += self._stem_string(self.cont_dict[tag]\
+                    self.tokens += self.stemmer.stem_tokens(
+                                            self.cont_dict[tag]\
                                             .lower()\
-                                            .translate(translator))\
-                                            .split()
-
-
-    def _stem_string(self, input_str):
-        """ Takes a string and stems it returning a stemmed string"""
-        output = ''
-        word = ''
-        line = input_str
-        for c in line:
-            if c.isalpha():
-                word += c.lower()
-            else:
-                if word:
-                    output += self.stemmer.stem(word, 0,len(word)-1)
-                    word = ''
-                output += c.lower()
-        return output
+                                            .translate(translator)\
+                                            .split())
 
 
 class MetaData(object):
@@ -257,54 +306,297 @@ raw document:
 {}
 """
 
+# doc_len and the utf-8 sizes of the docno, date and headline fields:
+META_HEADER = struct.Struct('<IIII')
+
+class MetaStore(object):
+    """Docid keyed metadata of the whole collection in a single record store
+    (metastore.bin and metastore_offsets.npy).  Each record starts with the
+    compact fields (META_HEADER then the utf-8 docno, date and headline) and
+    ends with the raw doc, so the fields are read without touching the text.
+    """
+    def __init__(self, save_path):
+        self.save_path = save_path
+        self.name = 'metastore'
+        self.writer = None
+        self.reader = None
+
+    def exists(self):
+        """True if the store was written to save_path"""
+        return RecordReader.exists(self.save_path, self.name)
+
+    def open_writer(self):
+        """Starts a new store, MetaData are then added in docid order"""
+        self.writer = RecordWriter(self.save_path, self.name)
+
+    def add(self, metadata):
+        """Appends a MetaData object as the record of its docid"""
+        fields = [str(field).encode('utf-8') for field in
+                  (metadata.docno, metadata.date, metadata.hl)]
+        header = META_HEADER.pack(int(metadata.doc_len),
+                                  *(len(field) for field in fields))
+        self.writer.add(metadata.docid, b''.join([header] + fields +
+                        [metadata.raw_doc.encode('utf-8')]))
+
+    def close(self):
+        """Writes the offsets of the added records"""
+        self.writer.close()
+        self.writer = None
+
+    def load(self):
+        """Memory-maps the store"""
+        self.reader = RecordReader(self.save_path, self.name)
+
+    def __contains__(self, docid):
+        return docid in self.reader
+
+    def get(self, docid, raw_doc=True):
+        """Returns the MetaData of docid, without its raw doc unless raw_doc"""
+        header = self.reader.get(docid, stop=META_HEADER.size)
+        doc_len, docno_len, date_len, hl_len = META_HEADER.unpack(header)
+        fields_end = META_HEADER.size + docno_len + date_len + hl_len
+        stop = None if raw_doc else fields_end
+        record = bytes(self.reader.get(docid, META_HEADER.size, stop))
+        docno = record[:docno_len].decode('utf-8')
+        date = record[docno_len:docno_len + date_len].decode('utf-8')
+        hl = record[docno_len + date_len:fields_end - META_HEADER.size]\
+            .decode('utf-8')
+        raw = None
+        if raw_doc:
+            raw = record[fields_end - META_HEADER.size:].decode('utf-8')
+        return MetaData(None, docno=docno, docid=docid, date=date, hl=hl,
+                        raw_doc=raw, doc_len=doc_len)
+
+
+def metadata_nbytes(metadata):
+    """Approximate memory used by a MetaData object (for cache budgets)"""
+    nbytes = sys.getsizeof(metadata) + sys.getsizeof(metadata.__dict__)
+    for value in metadata.__dict__.values():
+        nbytes += sys.getsizeof(value)
+    return nbytes
+
+
+# per termid stats of the lexicon, see Lexicon:
+TERM_STATS_DTYPE = np.dtype([
+    ('pos', np.uint32), # position of the term in the sorted terms
+    ('df', np.uint32),
+    ('cf', np.uint64),
+])
+
 class Lexicon(object):
-    """The Lexicon contains two mapping dicts:
-        - term to term_id
-        - term_id to term_id
+    """Maps terms to dense termids (0 to len-1) assigned by decreasing
+    collection frequency, ties broken by term, so the frequent terms get the
+    small ids and termid indexed arrays can be used.
+
+    Files written to the index dir:
+        - lexicon_terms.bin/_offsets.npy : the utf-8 terms in sorted order,
+          a RecordWriter store keyed by sorted position
+        - lexicon_termids.npy : termid of each sorted position
+        - lexicon_stats.npy : per termid df, cf and sorted position (see
+          TERM_STATS_DTYPE)
+    A loaded lexicon memory-maps them and looks terms up with a binary search
+    over the sorted terms.  Indexes saved as a gzipped pickled Lexicon (the
+    term_2_termid and termid_2_term dicts) are still loaded whole, their df
+    and cf then come from the inverted index (see set_legacy_stats).
+
+    The lexicon of a segment added to an existing index (see
+    segment_helpers) is a delta: built with base (a lexicon of the existing
+    index, anything with get_termid), terms already in base keep their
+    termid and only the new terms are stored, with termids from
+    first_termid on.
     """
-    def __init__(self, save_path, tokens=None):
+    def __init__(self, save_path, tokens=None, base=None, first_termid=0):
         # required:
+        self.index_wd = save_path
         self.save_path = os.path.join(save_path, 'lexicon')
+        self.termids_path = os.path.join(save_path, 'lexicon_termids.npy')
+        self.stats_path = os.path.join(save_path, 'lexicon_stats.npy')
         self.tokens = tokens
+        self.base = base
+        self.first_termid = first_termid # termid of the first stored term
+        # built (or legacy) lexicon:
         self.term_2_termid = None
         self.termid_2_term = None
+        self.cfs = None
+        self.dfs = None
+        # loaded lexicon:
+        self.terms = None # RecordReader of the sorted terms
+        self.term_offsets = None
+        self.sorted_termids = None
+        self.stats = None
 
     def create_lexicon_mappings(self):
         """Takes a normalized token vector and updates dict mappings"""
-        self.term_2_termid = {token: idx if not token.isdigit() else int(token)
-             for idx, token in enumerate(set(self.tokens))}
-        self.termid_2_term = inv_map = {v: k
-             for k, v in self.term_2_termid.items()}
+        self.assign_termids(Counter(self.tokens))
+        return None
+
+    def assign_termids(self, term_cfs):
+        """Assigns the termids of the terms of term_cfs (term: cf), those
+        of base for the terms it has.
+        """
+        self.term_2_termid = {}
+        if self.base is not None:
+            for term in term_cfs:
+                termid = self.base.get_termid(term)
+                if termid is not None:
+                    self.term_2_termid[term] = termid
+        self.termid_2_term = sorted(
+            (term for term in term_cfs if term not in self.term_2_termid),
+            key=lambda term: (-term_cfs[term], term))
+        self.term_2_termid.update((term, termid) for termid, term in
+            enumerate(self.termid_2_term, start=self.first_termid))
+        self.cfs = np.array([term_cfs[term] for term in self.termid_2_term],
+                            dtype=np.uint64)
+        self.dfs = np.zeros(len(self.termid_2_term), dtype=np.uint32)
+
+    def set_dfs(self, invIndex):
+        """Fills the dfs of the built lexicon from its inverted index"""
+        self.dfs = np.array([invIndex.df(termid) for termid in self.termids()],
+                            dtype=np.uint32)
+
+    def set_legacy_stats(self, invIndex):
+        """Fills the dfs and cfs of a legacy pickled lexicon from its inverted
+        index, as termid keyed dicts since its termids aren't dense.
+        """
+        self.dfs = {}
+        self.cfs = {}
+        for termid, (docids, counts) in invIndex.items():
+            self.dfs[termid] = len(docids)
+            self.cfs[termid] = sum(counts)
+
+    def set_df(self, termid, df):
+        """Sets the df of termid if it's one of the stored terms"""
+        if 0 <= termid - self.first_termid < len(self.dfs):
+            self.dfs[termid - self.first_termid] = df
+
+    def termids(self):
+        """Returns the range of the termids of the stored terms"""
+        return range(self.first_termid, self.first_termid + len(self))
+
+    def _check_loaded(self):
+        if self.term_2_termid is None and self.stats is None:
+            self.load()
+
+    def __len__(self):
+        self._check_loaded()
+        if self.stats is not None:
+            return len(self.stats)
+        return len(self.termid_2_term)
+
+    def __contains__(self, term):
+        return self.get_termid(term) is not None
+
+    def _sorted_term(self, pos):
+        """utf-8 bytes of the term at sorted position pos"""
+        offsets = self.term_offsets
+        return self.terms.buffer[offsets[pos]:offsets[pos + 1]]
+
+    def get_termid(self, term):
+        """Returns the termid of term or None if not in the lexicon"""
+        self._check_loaded()
+        if self.stats is None:
+            return self.term_2_termid.get(term)
+        key = term.encode('utf-8')
+        lo, hi = 0, len(self.sorted_termids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._sorted_term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.sorted_termids) and self._sorted_term(lo) == key:
+            return int(self.sorted_termids[lo])
         return None
 
+    def term(self, termid):
+        """Returns the term of termid"""
+        self._check_loaded()
+        if self.stats is None:
+            return self.termid_2_term[termid - self.first_termid]
+        i = termid - self.first_termid
+        if not 0 <= i < len(self.stats):
+            raise KeyError("Termid {} not found.".format(str(termid)))
+        return self._sorted_term(int(self.stats['pos'][i])).decode('utf-8')
+
+    def df(self, termid):
+        """Returns the number of docs containing termid"""
+        self._check_loaded()
+        if self.stats is None:
+            self._check_legacy_stats()
+            return int(self.dfs[termid - self.first_termid])
+        return int(self.stats['df'][termid - self.first_termid])
+
+    def cf(self, termid):
+        """Returns the number of occurrences of termid in the collection"""
+        self._check_loaded()
+        if self.stats is None:
+            self._check_legacy_stats()
+            return int(self.cfs[termid - self.first_termid])
+        return int(self.stats['cf'][termid - self.first_termid])
+
+    def _check_legacy_stats(self):
+        if self.dfs is None:
+            raise ValueError("Legacy pickled lexicon without term stats, fill "
+                             "them with set_legacy_stats(invIndex) first.")
+
     def conv_tokens_vect(self, doc_tokens):
         """Converts a vector of terms to their termid's
         Returns: dict with termid:count
         """
         if type(doc_tokens) != list:
             raise TypeError("doc_tokens parameter needs to be a list")
-        if self.term_2_termid == None:
-            self.load()
         termid_vect = []
         for term in doc_tokens:
-            if term in self.term_2_termid:
-                termid_vect.append(self.term_2_termid[term])
+            termid = self.get_termid(term)
+            if termid is not None:
+                termid_vect.append(termid)
         return Counter(termid_vect)
 
-    def save(self):
-        """Saves lexicon dicts to index dir"""
+    def conv_tokens_array(self, doc_tokens):
+        """Bulk version of conv_tokens_vect for indexing, every token must be
+        in the (built) lexicon.
+        Returns: (termids, counts) numpy arrays, one entry per distinct termid
+        """
+        term_counts = Counter(doc_tokens)
+        termid_vect = list(map(self.term_2_termid.__getitem__, term_counts))
+        return (np.array(termid_vect, dtype=np.int64),
+                np.array(list(term_counts.values()), dtype=np.uint32))
 
-        file = gzip.GzipFile(self.save_path, 'wb')
-        file.write(pickle.dumps(self, protocol=0))
-        file.close()
+    def save(self):
+        """Writes the sorted terms, their termids and the per termid stats to
+        the index dir.
+        """
+        order = sorted(range(len(self.termid_2_term)),
+                       key=self.termid_2_term.__getitem__)
+        writer = RecordWriter(self.index_wd, 'lexicon_terms')
+        for pos, termid in enumerate(order):
+            writer.add(pos, self.termid_2_term[termid].encode('utf-8'))
+        writer.close()
+        order = np.array(order, dtype=np.int64)
+        sorted_termids = (order + self.first_termid).astype(np.uint32)
+        stats = np.zeros(len(order), dtype=TERM_STATS_DTYPE)
+        stats['pos'][order] = np.arange(len(order), dtype=np.uint32)
+        stats['df'] = self.dfs
+        stats['cf'] = self.cfs
+        np.save(self.termids_path, sorted_termids)
+        np.save(self.stats_path, stats)
 
     #@timing
     def load(self):
-        """Loads or reloads pickled object from meta store.
+        """Memory-maps the saved lexicon, or loads a legacy pickled one.
         sets self so no value returned
         """
         if self.save_path == None:
             raise TypeError("Missing doc_path to load object.")
+        if os.path.isfile(self.stats_path):
+            self.terms = RecordReader(self.index_wd, 'lexicon_terms')
+            # plain int indexing, much cheaper than numpy scalars per probe:
+            self.term_offsets = memoryview(np.asarray(self.terms.offsets))
+            self.sorted_termids = np.load(self.termids_path, mmap_mode='r')
+            self.stats = np.load(self.stats_path, mmap_mode='r')
+            if len(self.sorted_termids):
+                self.first_termid = int(self.sorted_termids.min())
+            return
         file = gzip.GzipFile(self.save_path, 'rb')
         buffer = bytes()
         count = 0
@@ -325,11 +617,40 @@ class Lexicon(object):
 
 class InvIndex(object):
     """Obj used to hold, alter and update the inverted index."""
+    # BM25 parameters the stored per term score bounds are computed with:
+    bounds_k1 = 1.2
+    bounds_b = 0.75
+
     def __init__(self, save_path):
+        self.index_wd = save_path
         self.save_path = os.path.join(save_path, 'InvertedIndex')
         self.inv_index = {} # dict that hold the inverted index
         self.coll_len = 0
         self.coll_token_sum = 0
+        self.writer = None # PostingsWriter when streaming postings to disk
+        self.reader = None # PostingsReader once loaded from disk
+        # docid indexed doc lengths, when set before writing the postings
+        # the BM25 score bounds of each term are stored with them:
+        self.doc_lens = None
+        self.has_bounds = False
+        # id of the saved index, a new one is drawn every time it's saved:
+        self.generation = None
+        # PostingsCache of the lists decoded by get_posting_ls, if set:
+        self.postings_cache = None
+
+    def open_writer(self):
+        """Streams postings passed to add_postings_list straight to disk
+        instead of keeping them in inv_index.
+        """
+        K = None
+        if self.doc_lens is not None and self.coll_len > 0:
+            avg_dl = self.coll_token_sum/self.coll_len
+            doc_lens = np.asarray(self.doc_lens, dtype=np.float64)
+            K = self.bounds_k1*((1-self.bounds_b)+
+                                (self.bounds_b*(doc_lens/avg_dl)))
+            self.has_bounds = True
+        self.writer = PostingsWriter(self.index_wd, K=K, k1=self.bounds_k1,
+                                     doc_lens=self.doc_lens)
 
     def add_term_posting(self, termid, docid, count):
         """Takes a posting and then adds it the existing inverted index"""
@@ -341,22 +662,69 @@ class InvIndex(object):
             # new term:
             self.create_postings_list(termid, posting)
 
+    def add_doc_postings(self, docid, termids, counts):
+        """Adds the postings of one document given its termids and counts
+        (eg. from Lexicon.conv_tokens_array).
+        """
+        for termid, count in zip(termids.tolist(), counts.tolist()):
+            if termid in self.inv_index:
+                self.update_postings_list(termid, (docid, count))
+            else:
+                self.create_postings_list(termid, (docid, count))
+
+    def invert(self, termids, docids, counts):
+        """Sort based inversion: builds every postings list at once from flat
+        arrays holding one (termid, docid, count) entry per term of each doc.
+        Entries must be ordered by docid.
+        """
+        if len(termids) == 0:
+            return
+        order = np.argsort(termids, kind='stable')
+        termids = termids[order]
+        docids = np.asarray(docids, dtype=np.uint32)[order]
+        counts = np.asarray(counts, dtype=np.uint32)[order]
+        bounds = np.flatnonzero(termids[1:] != termids[:-1]) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(termids)]))
+        for termid, start, end in zip(termids[starts].tolist(),
+                                      starts.tolist(), ends.tolist()):
+            self.inv_index[termid] = [
+                array('I', docids[start:end].tobytes()),
+                array('I', counts[start:end].tobytes())
+            ]
+
+    def add_postings_list(self, termid, docids, counts):
+        """Adds the complete (docid sorted) postings list of a new termid"""
+        if self.writer is not None:
+            self.writer.add(termid, docids, counts)
+        else:
+            self.inv_index[termid] = [array('I', docids), array('I', counts)]
+
     def create_postings_list(self, termid, posting):
-        """Given a termid"""
+        """Given a termid, starts its postings list with posting."""
         self.inv_index[termid] = [
-            [posting[0]],
-            [posting[1]]
+            array('I', [posting[0]]),
+            array('I', [posting[1]])
         ]
 
     def update_postings_list(self, termid, posting):
-        """Given a termid, updates a correct posting list."""
-        i = bisect.bisect(self.inv_index[termid][0], posting[0])
-        self.inv_index[termid][0].insert(i, posting[0]) # docid insert
-        self.inv_index[termid][1].insert(i, posting[1]) # count insert
-        assert(len(self.inv_index[termid][0]) == len(self.inv_index[termid][1]))
+        """Given a termid, updates a correct posting list.
+        Docids are handed out in increasing order so postings are appended,
+        out of order docids fall back to a bisect insert.
+        """
+        docids, counts = self.inv_index[termid]
+        if docids[-1] < posting[0]:
+            docids.append(posting[0])
+            counts.append(posting[1])
+        else:
+            i = bisect.bisect(docids, posting[0])
+            docids.insert(i, posting[0]) # docid insert
+            counts.insert(i, posting[1]) # count insert
 
     def does_termid_exist(self, termid):
         """Grabs a postings_list using the inverted index"""
+        if self.reader is not None:
+            return int(termid) in self.reader
         if int(termid) in self.inv_index:
             return True
         else:
@@ -364,34 +732,104 @@ class InvIndex(object):
 
     def get_posting_ls(self, termid):
         """Grabs a postings_list using the inverted index"""
+        if self.reader is not None:
+            if self.postings_cache is None:
+                return self.reader.get(int(termid))
+            postings = self.postings_cache.get(int(termid))
+            if postings is None:
+                postings = self.reader.get(int(termid))
+                self.postings_cache.put(int(termid), postings)
+            return postings
         return self.inv_index[int(termid)]
 
-    def save(self):
-        """Saves lexicon dicts to index dir"""
+    def get_blocks(self, termid):
+        """Returns the PostingsBlocks of termid (see postings_helpers), set to
+        slice the postings cache's list when it holds it, or None if the
+        index isn't on disk or has no block table.
+        """
+        if self.reader is None:
+            return None
+        blocks = self.reader.get_blocks(int(termid))
+        if (blocks is not None and self.postings_cache is not None and
+                int(termid) in self.postings_cache):
+            blocks.postings = self.postings_cache.get(int(termid))
+        return blocks
+
+    def items(self):
+        """Yields (termid, (docids, counts)) for every term of the index"""
+        if self.reader is not None:
+            for item in self.reader.items():
+                yield item
+        else:
+            for termid in sorted(self.inv_index):
+                yield termid, self.inv_index[termid]
 
+    def df(self, termid):
+        """Returns the number of docs containing termid"""
+        if self.reader is not None:
+            return self.reader.df(int(termid))
+        if int(termid) in self.inv_index:
+            return len(self.inv_index[int(termid)][0])
+        return 0
+
+    def tf_score_bounds(self, termid, k1, b):
+        """Returns the stored (min, max) BM25 tf component of termid's postings
+        or None if they weren't stored for these k1 and b.
+        """
+        if (self.reader is None or not self.has_bounds or
+                (k1, b) != (self.bounds_k1, self.bounds_b)):
+            return None
+        return self.reader.tf_score_bounds(int(termid))
+
+    def save(self):
+        """Writes the postings (see postings_helpers) and a small header
+        holding the collection stats to the index dir.
+        """
+        if self.writer is None:
+            self.open_writer()
+            for termid in sorted(self.inv_index):
+                self.writer.add(termid, *self.inv_index[termid])
+        self.writer.close()
+        self.writer = None
+        self.generation = uuid.uuid4().hex
+        header = {
+            'generation': self.generation,
+            'coll_len': self.coll_len,
+            'coll_token_sum': self.coll_token_sum,
+            'has_bounds': self.has_bounds,
+            'bounds_k1': self.bounds_k1,
+            'bounds_b': self.bounds_b,
+        }
         file = gzip.GzipFile(self.save_path, 'wb')
-        file.write(pickle.dumps(self, protocol=0))
+        file.write(pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL))
         file.close()
 
     #@timing
     def load(self):
-        """Loads or reloads pickled object from meta store.
+        """Loads the header and memory-maps the postings, postings lists are
+        only decoded when requested.  Indexes saved as a single pickled
+        InvIndex are still loaded whole.
         sets self so no value returned
         """
         print("Loading inverted index")
         if self.save_path == None:
             raise TypeError("Missing doc_path to load object.")
         file = gzip.GzipFile(self.save_path, 'rb')
-        buffer = bytes()
-        count = 0
-        while True:
-                data = file.read()
-                if data == b'':
-                        break
-                buffer += data
-        object = pickle.loads(buffer)
+        object = pickle.loads(file.read())
         file.close()
-        self._update_self(object)
+        # indexes saved without a generation are told apart by their file:
+        stat = os.stat(self.save_path)
+        self.generation = '{}-{}'.format(stat.st_mtime_ns, stat.st_size)
+        if isinstance(object, dict):
+            self.generation = object.get('generation', self.generation)
+            self.coll_len = object['coll_len']
+            self.coll_token_sum = object['coll_token_sum']
+            self.has_bounds = object.get('has_bounds', False)
+            self.bounds_k1 = object.get('bounds_k1', self.bounds_k1)
+            self.bounds_b = object.get('bounds_b', self.bounds_b)
+            self.reader = PostingsReader(self.index_wd)
+        else:
+            self._update_self(object)
 
     def _update_self(self, obj):
         """Takes new obj and reassigns the fields of current object."""
@@ -401,140 +839,624 @@ class InvIndex(object):
         self.coll_token_sum = obj.coll_token_sum
 
 
+class DocStats(object):
+    """Dense, docid indexed document statistics stored as .npy files so they
+    can be memory-mapped at query time:
+        - doc_lens.npy : doc length (token count) of each docid
+        - doc_norms.npy : optional 1 byte, log scale quantized doc lengths
+        - doc_norms_table.npy : doc length represented by each of the 256 codes
+    Docids start at 1, entry 0 is unused.
+    """
+    def __init__(self, save_path):
+        self.doc_lens_path = os.path.join(save_path, 'doc_lens.npy')
+        self.doc_norms_path = os.path.join(save_path, 'doc_norms.npy')
+        self.norms_table_path = os.path.join(save_path, 'doc_norms_table.npy')
+        self.doc_lens = None
+        self.doc_norms = None
+        self.norms_table = None
+
+    def exists(self):
+        """True if the stats were saved to save_path"""
+        return os.path.isfile(self.doc_lens_path)
+
+    def has_norms(self):
+        """True if quantized norms were saved to save_path"""
+        return os.path.isfile(self.doc_norms_path)
+
+    def save(self, doc_lens, quantize=False):
+        """Takes docid indexed doc lengths and writes them (and optionally
+        their quantized norms) to the index dir.
+        """
+        basepath = os.path.dirname(self.doc_lens_path)
+        if not os.path.exists(basepath):
+            os.makedirs(basepath)
+        self.doc_lens = np.asarray(doc_lens, dtype=np.uint32)
+        np.save(self.doc_lens_path, self.doc_lens)
+        if quantize:
+            self.doc_norms, self.norms_table = quantize_doc_lens(self.doc_lens)
+            np.save(self.doc_norms_path, self.doc_norms)
+            np.save(self.norms_table_path, self.norms_table)
+
+    def load(self):
+        """Memory-maps the saved stats"""
+        self.doc_lens = np.load(self.doc_lens_path, mmap_mode='r')
+        if os.path.isfile(self.doc_norms_path):
+            self.doc_norms = np.load(self.doc_norms_path, mmap_mode='r')
+            self.norms_table = np.load(self.norms_table_path)
+
+    def quantized_doc_lens(self):
+        """Returns the doc lengths as decoded from the 1 byte norms"""
+        if self.doc_norms is None:
+            raise ValueError("Index was built without quantized norms.")
+        return self.norms_table[self.doc_norms]
+
+def quantize_doc_lens(doc_lens):
+    """Log scale quantization of doc lengths to 1 byte codes.
+    Returns: (codes uint8 array, table float64 array mapping code to length)
+    """
+    doc_lens = np.asarray(doc_lens, dtype=np.float64)
+    scale = np.log1p(doc_lens.max()) / 255 if len(doc_lens) else 0
+    if scale == 0:
+        return np.zeros(len(doc_lens), dtype=np.uint8), np.zeros(256)
+    codes = np.rint(np.log1p(doc_lens) / scale).astype(np.uint8)
+    table = np.expm1(np.arange(256) * scale)
+    return codes, table
+
+
 class Tokenizer(object):
-    """Class used to tokenize strings"""
-    def __init__(self):
+    """Class used to tokenize strings, stemming with stemmer (a Stemmer,
+    one with an empty table is created if needed).
+    """
+    def __init__(self, stemmer=None):
         self.punc = '!"#$%&\'()*+,./:;<=>?@[\\]^_`{|}~'
         self.translator = str.maketrans('', '', self.punc)
-        self.stemmer = PorterStemmer()
+        self.stemmer = stemmer
 
     def tokenize(self, token_str, stem = False):
         """Taking cont_dict and tokenize_tags, update the self.tokens vector"""
         if not stem:
             return token_str.lower().translate(self.translator).split()
         else:
-            return self._stem_string(token_str.lower()\
-                            .translate(self.translator))\
-                            .split()
-
-    def _stem_string(self, input_str):
-        """ Takes a string and stems it returning a stemmed string"""
-        output = ''
-        word = ''
-        line = input_str
-        for c in line:
-            if c.isalpha():
-                word += c.lower()
-            else:
-                if word:
-                    output += self.stemmer.stem(word, 0,len(word)-1)
-                    word = ''
-                output += c.lower()
-        return output
+            if self.stemmer is None:
+                self.stemmer = Stemmer()
+            return self.stemmer.stem_tokens(token_str.lower()\
+                            .translate(self.translator)\
+                            .split())
 
 
 
+RESULT_CACHE_BYTES = 64*1024*1024
+POSTINGS_CACHE_BYTES = 256*1024*1024
+PROXIMITY_DEPTH = 100 # BM25 results reranked by search(proximity=True)
+
+def query_signature(termid_qfs):
+    """Normalized form of a query (termid: qf), the sorted (termid, qf)
+    pairs, so queries with the same terms share their cached results.
+    """
+    return tuple(sorted(termid_qfs.items()))
+
 class Query(object):
-    """Resposible for running all queries against a defined index working dir"""
-    def __init__(self, index_wd):
+    """Resposible for running all queries against a defined index working dir
+
+    MetaData fetched by docid_to_metadata/docno_to_metadata are kept in an
+    LRU cache (self.meta_cache) bounded by meta_cache_entries and/or
+    meta_cache_bytes, 0 entries disables it.  With cache_raw_doc=False only
+    the fields are cached and raw doc requests always read the metastore.
+    Cached MetaData objects are shared between callers, don't modify them.
+
+    Ranked results of search/impact_search are kept in a ResultCache
+    (self.result_cache) of at most result_cache_bytes (None for no limit, 0
+    disables it), keyed by the sorted (termid, qf) pairs of the query, the
+    ranking parameters and k.  It's cleared whenever the generation of the
+    loaded InvIndex changes.
+
+    Postings lists decoded from disk are kept in a PostingsCache of
+    postings_cache_bytes (0 disables it), optionally warmed up with the
+    terms of a query log (warm_query_log, one query per line).  Cached
+    arrays are read only.
+
+    Segments added with IndexEngine.py --append (see segment_helpers) are
+    searched with the base index: lexicon, invIndex, doc_lens, stores and
+    docid_to_docno then cover all of them, with global docids.  Segments
+    added or merged later are picked up by refresh_segments, called by the
+    search and fetch methods (a stat of the manifest when nothing changed).
+
+    Indexes built with IndexEngine.py --positions (see positions_helpers)
+    also answer phrase and near queries and search(proximity=True), their
+    positions being read on first use only.
+
+    With quantized_norms BM25 normalizes by the doc lengths decoded from the
+    1 byte norms of IndexEngine.py --quantize-norms (ValueError if the index
+    or one of its segments has none) instead of the exact ones, the MaxScore
+    bounds of the index then aren't used.  get_doc_len stays exact.
+    """
+    def __init__(self, index_wd, meta_cache_entries=4096, meta_cache_bytes=None,
+                 cache_raw_doc=True, result_cache_bytes=RESULT_CACHE_BYTES,
+                 postings_cache_bytes=POSTINGS_CACHE_BYTES, warm_query_log=None,
+                 quantized_norms=False):
         self.index_wd = index_wd
         self.lexicon = Lexicon(self.index_wd)
         self.lexicon.load()
-        self.tokenizer = Tokenizer()
+        self.stemmer = Stemmer(self.index_wd)
+        self.stem = self.stemmer.exists() # index built with --stem
+        if self.stem:
+            self.stemmer.load()
+        self.tokenizer = Tokenizer(self.stemmer)
         self.invIndex = InvIndex(self.index_wd)
         self.invIndex.load()
+        if self.lexicon.stats is None:
+            # legacy pickled lexicon, its dfs and cfs weren't saved:
+            self.lexicon.set_legacy_stats(self.invIndex)
         self.docid_to_docno_path = os.path.join(self.index_wd, 'docid_to_docno.p')
         self.docid_to_docno = pickle.load(open(self.docid_to_docno_path, "rb"))
-        self.docno_to_data_path = os.path.join(self.index_wd, 'docno_to_data.p')
-        self.docno_to_data = pickle.load(open(self.docno_to_data_path, "rb"))
+        self.docno_to_docid = {docno: docid for docid, docno in
+                               self.docid_to_docno.items()}
+        self.metaStore = MetaStore(self.index_wd)
+        if self.metaStore.exists():
+            self.metaStore.load()
+        else:
+            # index built with one gzip pickle per doc:
+            self.metaStore = None
+            self.docno_to_data_path = os.path.join(self.index_wd,
+                                                   'docno_to_data.p')
+            self.docno_to_data = pickle.load(open(self.docno_to_data_path,
+                                                  "rb"))
+        self.snippetStore = SnippetStore(self.index_wd)
+        if self.snippetStore.exists():
+            self.snippetStore.load()
+        else:
+            # sentences are split from the raw docs when needed:
+            self.snippetStore = None
+        self.docStats = DocStats(self.index_wd)
+        if self.docStats.exists():
+            self.docStats.load()
+        else:
+            print("WARNING: doc_lens.npy not found, loading doc lengths from "
+                  "the metastore.")
+            self.docStats.doc_lens = self._metastore_doc_lens()
+        self.doc_lens = self.docStats.doc_lens # docid indexed doc lengths
+        self.quantized_norms = quantized_norms
+        # doc lengths BM25 normalizes by:
+        self.norm_lens = self.doc_lens
+        if quantized_norms:
+            self.norm_lens = self.docStats.quantized_doc_lens()
+        # the base index, self.lexicon etc. also cover the segments if any:
+        self.base_index = (self.lexicon, self.invIndex, self.docid_to_docno,
+                           self.metaStore, self.snippetStore, self.doc_lens,
+                           self.norm_lens)
+        self.segments = SegmentManifest(self.index_wd)
+        self.segments_version = 0
+        self.segments_stamp = self.segments.stamp()
+        # PositionsReaders of the segments, None if one has no positions:
+        self.segment_positions = []
+        self.positions = None # loaded by get_positions
+        if self.segments.exists():
+            self._open_segments()
+        self.scorers = {} # (k1, b, k2): BM25Scorer
+        self.impactIndex = None # loaded on first impact_search
+        self.cache_raw_doc = cache_raw_doc
+        self.meta_cache = LRUCache(max_entries=meta_cache_entries,
+            max_bytes=meta_cache_bytes, size_of=metadata_nbytes)
+        self.result_cache = ResultCache(self.invIndex.generation,
+            max_entries=0 if result_cache_bytes == 0 else None,
+            max_bytes=result_cache_bytes)
+        self.postings_cache_bytes = postings_cache_bytes
+        if self.invIndex.reader is not None and postings_cache_bytes:
+            self.invIndex.postings_cache = PostingsCache(postings_cache_bytes)
+            if warm_query_log is not None:
+                loaded = self.warm_postings_cache(
+                    read_query_log(warm_query_log))
+                print("Warmed the postings cache with {} postings lists"
+                      .format(loaded))
+
+    def _open_segments(self):
+        """Opens the segments listed in the manifest, reading it again if a
+        merge removed some of them meanwhile.
+        """
+        while True:
+            manifest = self.segments.load()
+            try:
+                self._load_segments(manifest)
+                return
+            except FileNotFoundError:
+                if self.segments.version() == manifest['version']:
+                    raise
+
+    def _load_segments(self, manifest):
+        """Opens the segments of manifest and sets the lexicon, invIndex,
+        doc_lens, norm_lens, stores and docid_to_docno covering them and the
+        base index.  Every file of a segment is opened (mapped) here, so the
+        segments keep working once a merger removes them.
+        """
+        (lexicon, invIndex, docid_to_docno, metaStore, snippetStore,
+         doc_lens, norm_lens) = self.base_index
+        lexicons, readers, bases = [lexicon], [invIndex.reader], [0]
+        segment_positions = []
+        metaStores, snippetStores = [metaStore], [snippetStore]
+        generations = [invIndex.generation]
+        doc_lens_ls = [np.asarray(doc_lens)]
+        norm_lens_ls = [np.asarray(norm_lens)]
+        docid_to_docno = dict(docid_to_docno)
+        coll_len = invIndex.coll_len
+        coll_token_sum = invIndex.coll_token_sum
+        for entry in manifest['segments']:
+            segment_wd = self.segments.segment_dir(entry['name'])
+            base = coll_len
+            segment_lexicon = Lexicon(segment_wd)
+            segment_lexicon.load()
+            segment_index = InvIndex(segment_wd)
+            segment_index.load()
+            segment_meta = MetaStore(segment_wd)
+            segment_meta.load()
+            segment_snippets = SnippetStore(segment_wd)
+            segment_snippets.load()
+            segment_stats = DocStats(segment_wd)
+            segment_stats.load()
+            with open(os.path.join(segment_wd, 'docid_to_docno.p'), 'rb') as f:
+                docid_to_docno.update((base + docid, docno) for docid, docno
+                                      in pickle.load(f).items())
+            if (segment_positions is not None and
+                    PositionsReader.exists(segment_wd)):
+                segment_positions.append(PositionsReader(segment_wd))
+            else:
+                segment_positions = None
+            lexicons.append(segment_lexicon)
+            readers.append(segment_index.reader)
+            bases.append(base)
+            metaStores.append(segment_meta)
+            snippetStores.append(segment_snippets)
+            generations.append(segment_index.generation)
+            doc_lens_ls.append(segment_stats.doc_lens[1:])
+            if self.quantized_norms:
+                norm_lens_ls.append(segment_stats.quantized_doc_lens()[1:])
+            coll_len += segment_index.coll_len
+            coll_token_sum += segment_index.coll_token_sum
+
+        self.lexicon = SegmentedLexicon(lexicons)
+        self.invIndex = InvIndex(self.index_wd)
+        self.invIndex.reader = SegmentedPostingsReader(readers, bases)
+        self.invIndex.coll_len = coll_len
+        self.invIndex.coll_token_sum = coll_token_sum
+        self.invIndex.generation = '+'.join(generations)
+        self.doc_lens = np.concatenate(doc_lens_ls)
+        self.norm_lens = self.doc_lens
+        if self.quantized_norms:
+            self.norm_lens = np.concatenate(norm_lens_ls)
+        self.docid_to_docno = docid_to_docno
+        self.docno_to_docid = {docno: docid for docid, docno in
+                               docid_to_docno.items()}
+        self.metaStore = SegmentedMetaStore(metaStores, bases)
+        self.snippetStore = None
+        if snippetStore is not None:
+            self.snippetStore = SegmentedStore(snippetStores, bases)
+        self.segment_positions = segment_positions
+        self.positions = None
+        self.segments_version = manifest['version']
+
+    def refresh_segments(self):
+        """Picks up the segments added or merged since the index was
+        opened.
+        Returns: True if they changed
+        """
+        stamp = self.segments.stamp()
+        if stamp == self.segments_stamp:
+            return False
+        self.segments_stamp = stamp
+        if self.segments.version() == self.segments_version:
+            return False
+        self._open_segments()
+        self.scorers = {}
+        if self.invIndex.reader is not None and self.postings_cache_bytes:
+            self.invIndex.postings_cache = PostingsCache(
+                self.postings_cache_bytes)
+        return True
+
+    def _metastore_doc_lens(self):
+        """Builds the docid indexed doc lengths of an index built before
+        doc_lens.npy was written.
+        """
+        doc_lens = np.zeros(max(self.docid_to_docno, default=0) + 1,
+                            dtype=np.uint32)
+        for docid in self.docid_to_docno:
+            doc_lens[docid] = self._load_metadata(docid, raw_doc=False).doc_len
+        return doc_lens
+
+    def get_doc_len(self, docid):
+        """Returns the length of docid without loading its MetaData"""
+        return int(self.doc_lens[docid])
 
     def tokenize(self, query_str):
-        """ Takes query string and returns term tokens"""
-        return self.tokenizer.tokenize(query_str)
+        """ Takes query string and returns term tokens (stemmed if the index
+        is)"""
+        return self.tokenizer.tokenize(query_str, stem=self.stem)
 
     def conv_tokens_to_ids(self, tokens_vect):
         """Takes token vector and returns termid vector"""
         return list(self.lexicon.conv_tokens_vect(tokens_vect).keys())
 
+    def get_scorer(self, k1=1.2, b=0.75, k2=7):
+        """Returns the (cached) BM25Scorer for the given parameters"""
+        if (k1, b, k2) not in self.scorers:
+            self.scorers[(k1, b, k2)] = BM25Scorer(self.invIndex,
+                self.norm_lens, k1=k1, b=b, k2=k2,
+                quantized=self.quantized_norms)
+        return self.scorers[(k1, b, k2)]
+
+    def search(self, query_str, k=10, k1=1.2, b=0.75, k2=7, pruning=None,
+               proximity=False):
+        """Runs a BM25 ranked query, with pruning MaxScore is used to skip
+        docs that can't make the top k (same results), by default for long
+        topics and small k (see BM25Scorer.rank).  With proximity the
+        PROXIMITY_DEPTH best are reranked with the BM25TP proximity score
+        added (see positions_helpers), the index needs positions.
+        Returns: list of the k best (docid, score) pairs
+        """
+        self.refresh_segments()
+        termid_qfs = self.lexicon.conv_tokens_vect(self.tokenize(query_str))
+        if proximity:
+            key = ('bm25tp', query_signature(termid_qfs), k1, b, k2, k)
+            return self._cached_rank(key, self._proximity_rank, termid_qfs,
+                                     k, self.get_scorer(k1, b, k2), pruning)
+        key = ('bm25', query_signature(termid_qfs), k1, b, k2, k)
+        return self._cached_rank(key, self.get_scorer(k1, b, k2).rank,
+                                 termid_qfs, k, pruning)
+
+    def _proximity_rank(self, termid_qfs, k, scorer, pruning=None):
+        """Reranks the max(k, PROXIMITY_DEPTH) best BM25 docs of scorer by
+        their BM25 plus BM25TP proximity score, terms being weighted by
+        their idf capped to [0, 1].
+        Returns: list of the k best (docid, score) pairs
+        """
+        positions = self.get_positions()
+        ranked = scorer.rank(termid_qfs, max(k, PROXIMITY_DEPTH), pruning)
+        termids = [termid for termid in termid_qfs
+                   if self.invIndex.does_termid_exist(termid)]
+        if len(termids) < 2 or not ranked:
+            return ranked[:k]
+        ranked.sort()
+        docids = np.array([docid for docid, _ in ranked], dtype=np.int64)
+        scores = np.array([score for _, score in ranked], dtype=np.float64)
+        keys_ls = [self._term_keys(positions, termid, docids)
+                   for termid in termids]
+        dfs = np.array([self.invIndex.df(termid) for termid in termids],
+                       dtype=np.float64)
+        weights = np.clip(bm25_idf(dfs, scorer.N), 0, 1)
+        scores += proximity_scores(keys_ls, weights, scorer.K[docids],
+                                   scorer.k1)
+        order = np.lexsort((docids, -scores))[:k]
+        return list(zip(docids[order].tolist(), scores[order].tolist()))
+
+    def get_positions(self):
+        """Returns the PositionsReader of the index (and its segments),
+        opened on first use.
+        """
+        if self.positions is None:
+            if (self.segment_positions is None or
+                    not PositionsReader.exists(self.index_wd)):
+                raise ValueError("{} was built without positions, rebuild it "
+                                 "with IndexEngine.py --positions"
+                                 .format(self.index_wd))
+            readers = [PositionsReader(self.index_wd)] + self.segment_positions
+            self.positions = readers[0]
+            if len(readers) > 1:
+                self.positions = SegmentedPositionsReader(readers)
+        return self.positions
+
+    def _term_keys(self, positions, termid, cand):
+        """Returns the keys (see positions_helpers) of the positions of
+        termid in the sorted docids cand.
+        """
+        docids, counts = self.invIndex.get_posting_ls(termid)
+        found, inx = BM25Scorer.find_postings(
+            np.asarray(docids, dtype=np.int64), cand)
+        cand_inx = np.full(len(cand), -1, dtype=np.int64)
+        cand_inx[found] = inx
+        return candidate_keys(*positions.get(termid, counts), cand_inx)
+
+    def _positional_cand(self, query_str):
+        """Returns the termids of the query tokens, in query order, and the
+        docs holding all of them (none if a token isn't in the index).
+        """
+        termids = [self.lexicon.get_termid(token)
+                   for token in self.tokenize(query_str)]
+        if not termids or not all(termid is not None and
+                                  self.invIndex.does_termid_exist(termid)
+                                  for termid in termids):
+            return termids, np.zeros(0, dtype=np.int64)
+        cand, _ = conjunctive_match(termids, self.invIndex.df,
+                                    self.invIndex.get_posting_ls)
+        return termids, cand
+
+    def phrase(self, query_str):
+        """Finds the docs holding the query tokens as a phrase, consecutive
+        and in order.
+        Returns: (sorted docids, number of occurrences of the phrase in each)
+        """
+        self.refresh_segments()
+        positions = self.get_positions()
+        termids, cand = self._positional_cand(query_str)
+        if len(cand) == 0:
+            return cand, np.zeros(0, dtype=np.int64)
+        term_keys = {termid: self._term_keys(positions, termid, cand)
+                     for termid in set(termids)}
+        counts = phrase_match([term_keys[termid] for termid in termids],
+                              len(cand))
+        found = counts > 0
+        return cand[found], counts[found]
+
+    def near(self, query_str, window=10):
+        """Finds the docs holding every query token within window positions
+        of each other, in any order.
+        Returns: (sorted docids, number of matching windows in each)
+        """
+        self.refresh_segments()
+        positions = self.get_positions()
+        termids, cand = self._positional_cand(query_str)
+        if len(cand) == 0:
+            return cand, np.zeros(0, dtype=np.int64)
+        keys_ls = [self._term_keys(positions, termid, cand)
+                   for termid in sorted(set(termids))]
+        counts = window_match(keys_ls, window, len(cand))
+        found = counts > 0
+        return cand[found], counts[found]
+
+    def _cached_rank(self, key, rank, *args):
+        """Returns the cached results of key or computes them with
+        rank(*args) and caches them.
+        """
+        self.result_cache.check_generation(self.invIndex.generation)
+        results = self.result_cache.get_results(key)
+        if results is None:
+            time1 = time.perf_counter()
+            results = rank(*args)
+            time2 = time.perf_counter()
+            self.result_cache.put_results(key, results, time2 - time1)
+        return results
+
+    def impact_search(self, query_str, k=10, max_postings=None):
+        """Runs a query against the impact ordered index (see
+        ImpactIndexEngine.py), optionally stopping after max_postings.
+        Returns: list of the k best (docid, score) pairs
+        """
+        self.refresh_segments()
+        if self.segments_version:
+            raise ValueError("The impact index of {} doesn't cover its "
+                             "segments.".format(self.index_wd))
+        if self.impactIndex is None:
+            self.impactIndex = ImpactIndex(self.index_wd)
+            if not self.impactIndex.exists():
+                self.impactIndex = None
+                raise ValueError("No impact index found in {}, build it with "
+                                 "ImpactIndexEngine.py".format(self.index_wd))
+            self.impactIndex.load()
+        termid_qfs = self.lexicon.conv_tokens_vect(self.tokenize(query_str))
+        key = ('impact', query_signature(termid_qfs), k, max_postings)
+        return self._cached_rank(key, self.impactIndex.rank, termid_qfs, k,
+                                 max_postings)
+
+    def doc_sentences(self, docid):
+        """Returns the sentences of the TEXT of docid and the termids of
+        each, from the SnippetStore or else split from the raw doc.
+        """
+        if self.snippetStore is not None:
+            return self.snippetStore.get(docid)
+        text = LightDocParser(self.docid_to_metadata(docid).raw_doc)\
+            .cont_dict.get('TEXT') or ''
+        ends = split_sentences(text)
+        sentences = [text[start:end] for start, end in
+                     zip([0] + ends[:-1], ends)]
+        sentence_termids = [[termid for termid in
+                             map(self.lexicon.get_termid, self.tokenize(s))
+                             if termid is not None] for s in sentences]
+        return sentences, sentence_termids
+
+    def snippets(self, query_str, docids, max_sentences=2, max_chars=200,
+                 marks=MARKS):
+        """Returns the query-biased snippet (see snippet_helpers) of each
+        docid, query terms are weighted by log(1 + N/df).
+        """
+        self.refresh_segments()
+        tokens = self.tokenize(query_str)
+        N = self.invIndex.coll_len
+        weights = {}
+        for termid in self.lexicon.conv_tokens_vect(tokens):
+            df = self.invIndex.df(termid)
+            if df > 0:
+                weights[termid] = float(np.log1p(N/df))
+        terms = set(tokens)
+        return [make_snippet(*self.doc_sentences(docid), weights, terms,
+                             self.tokenize, max_sentences, max_chars, marks)
+                for docid in docids]
+
+    def warm_postings_cache(self, queries):
+        """Counts the terms of queries (query strings, e.g. a query log) in
+        the postings cache's frequency sketch and loads the postings of the
+        most frequent ones while there's room.
+        Returns: the number of postings lists loaded
+        """
+        cache = self.invIndex.postings_cache
+        if cache is None:
+            return 0
+        term_counts = Counter()
+        for query_str in queries:
+            term_counts.update(
+                self.lexicon.conv_tokens_vect(self.tokenize(query_str)).keys())
+        for termid, count in term_counts.items():
+            cache.sketch.increment(termid, count)
+        loaded = 0
+        for termid, _ in term_counts.most_common():
+            if cache.nbytes >= cache.max_bytes:
+                break
+            if (termid not in cache and self.invIndex.does_termid_exist(termid)
+                    and cache.put(termid, self.invIndex.reader.get(termid))):
+                loaded += 1
+        return loaded
+
     def BooleanAND(self, termid_vect):
-        """Takes termid vector and returns list of intersecting docid's based
-        on a BooleanAND retrieval.
+        """Takes termid vector and returns the sorted docid's containing every
+        (found) term and, per termid, the count of the term in each of them.
         """
-        postings_lists = {}
+        self.refresh_segments()
+        termids = []
         for termid in termid_vect:
             if self.invIndex.does_termid_exist(termid):
-                postings_lists[termid] = self.invIndex.get_posting_ls(termid)
+                termids.append(termid)
             else:
                 print("WARNING: {} not found.".format(str(termid)))
-        docids, counts = self.find_set_intersection(postings_lists)
+        docids, counts = conjunctive_match(termids, self.invIndex.df,
+                                           self.invIndex.get_posting_ls)
         return docids, counts
 
     def general_retrieval(self, termid_vect):
-        """Takes the termid_vect and grabs all documents and re
+        """Takes the termid_vect and grabs the postings of every (found)
+        term, as (docids, counts) arrays (those of the postings cache, read
+        only).
         Params:
         ------
         - termid_vect : list(int)
             input token id vect
         """
+        self.refresh_segments()
         postings_dict = {}
-        postings_dict_tuples = {} # holds tuple pairs
         for termid in termid_vect:
             if self.invIndex.does_termid_exist(termid):
                 postings_dict[termid] = self.invIndex.get_posting_ls(termid)
             else:
                 print("WARNING: {} not found.".format(str(termid)))
-
-        keys = list(postings_dict.keys())
-        for inx, lists in enumerate(postings_dict.values()):
-
-            postings_dict_tuples[keys[inx]] = []
-            for j, post in enumerate(lists[0]):
-                postings_dict_tuples[keys[inx]].append(
-                    tuple([post, lists[1][j]])
-                )
-        return postings_dict_tuples
-
-    def find_set_intersection(self, postings_lists):
-        """Given multiple lists, finds the intersecting elements are return
-        them
-        """
-        f_pl_docid = list(postings_lists.values())[0][0]
-        f_pl_count = list(postings_lists.values())[0][1]
-        docids = list(postings_lists.values())[0][0]
-        for item in postings_lists.values():
-            docids = list(set(docids) & set(item[0]))
-        inx = []
-        for posting in docids:
-            for i, elem in enumerate(f_pl_docid):
-                if str(elem) == str(posting):
-                    inx.append(i)
-                    break # stop once element is found
-        #use ind to grab counts:
-        T = [f_pl_count[i] for i in inx]
-
-        return(docids, T)
-        intersection = postings_lists.values()[0][0]
-        for l in postings_lists.values():
-            intersection = list(set(intersection) & set(l))
-        return intersection
+        return postings_dict
 
     def docno_from_docid(self, docid):
         """Takes docid and returns the docno"""
         return self.docid_to_docno[docid]
-    def docid_to_metadata(self, docid):
-        """Given a valid docid, returns the corresponding metadata object"""
+    def docid_to_metadata(self, docid, raw_doc=True):
+        """Given a valid docid, returns the corresponding metadata object,
+        without the raw doc (when stored in a MetaStore) unless raw_doc.
+        """
+        self.refresh_segments()
         if docid not in self.docid_to_docno:
             raise KeyError("Docid {} not found in current index.".format(str(docid)))
+        if raw_doc and not self.cache_raw_doc:
+            return self._load_metadata(docid, raw_doc=True)
+        metadata = self.meta_cache.get(docid)
+        if metadata is None:
+            metadata = self._load_metadata(docid, raw_doc=self.cache_raw_doc)
+            self.meta_cache.put(docid, metadata)
+        return metadata
+
+    def _load_metadata(self, docid, raw_doc=True):
+        """Reads the MetaData of docid from the metastore"""
+        if self.metaStore is not None:
+            return self.metaStore.get(docid, raw_doc)
         metadata_path = self.docno_to_data[self.docid_to_docno[docid]]
         metadata = MetaData(metadata_path)
         metadata.load()
+        if not raw_doc:
+            metadata.raw_doc = None
         return metadata
 
-    def docno_to_metadata(self, docno):
+    def docno_to_metadata(self, docno, raw_doc=True):
         """Given valid docno, returns related MetaData obj"""
-        if docno not in self.docno_to_data:
+        self.refresh_segments()
+        if docno not in self.docno_to_docid:
             raise KeyError("Docno {} not found in current index.".format(str(docno)))
-        metadata_path = self.docno_to_data[docno]
-        metadata = MetaData(metadata_path)
-        metadata.load()
-        return metadata
+        return self.docid_to_metadata(self.docno_to_docid[docno], raw_doc)
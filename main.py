@@ -13,65 +13,36 @@ showing results.  Also include how the program can handle a N and Q at the end.
 """
 import os
 import sys
+import time
 import pickle
-import numpy as np
 import gzip
-from index_helpers import MetaData, timing, Query, LightDocParser
-import operator
-from collections import Counter
+from index_helpers import MetaData, timing, Query
 
 @timing
 def run_query(query_str, query):
     """Runs a query against previously built index.
     """
-    doc_scores = {}
     print("Processing your Query: {}".format(str(query_str)))
     tokens = query.tokenize(query_str) # tokenize
     print("Tokens: {}".format(str(tokens)))
-    term_ids = query.conv_tokens_to_ids(tokens) # lexicon used term->termid
-    print("matching ids: {}".format(str(term_ids)))
-    tkn_cts = Counter(term_ids)
+    tkn_cts = query.lexicon.conv_tokens_vect(tokens) # termid: qf
     print(tkn_cts)
-    postings_lists = query.general_retrieval(term_ids)
-
-    for termid, posting_ls in postings_lists.items():
-        r_i = 0 # no rel info known
-        R = 0 # no rel info known
-        N = query.invIndex.coll_len
-        coll_token_sum = query.invIndex.coll_token_sum
-        n_i = len(posting_ls)# num of docs containing current term
-        for docid, count in posting_ls:
-            # compute score...
-            k_1 = 1.2
-            k_2 = 7
-            b = 0.75
-            dl = int(query.docid_to_metadata(docid).doc_len)
-            avg_dl = coll_token_sum/N
-            qf = tkn_cts[termid] # gets to freq of term in query
-            df = count # gets freq of term in doc
-            K = k_1*((1-b)+(b*(dl/avg_dl)))
-            qf_term = ( (k_2+1)*qf) / (k_2+qf)
-            df_term = ( (k_1+1)*df) / (K+df)
-            idf_term = np.log( ((r_i + 0.5)/(R - r_i + 0.5)) \
-                / ((n_i - r_i + 0.5)/(N - n_i - R - r_i - 0.5)) )
-            score = qf_term * df_term * idf_term
-            if docid in doc_scores:
-                doc_scores[docid] += score
-            else:
-                doc_scores[docid] = score
-    sorted_doc_scores = sorted(doc_scores.items(), \
-        key=operator.itemgetter(1), reverse=True)
-    sorted_doc_scores = sorted_doc_scores[0:10]
+    time1 = time.perf_counter()
+    sorted_doc_scores = query.search(query_str, k=10, k1=1.2, b=0.75, k2=7)
+    time2 = time.perf_counter()
+    # query-biased summaries, from the sentences stored at index time:
+    snippets = query.snippets(query_str,
+                              [docid for docid, _ in sorted_doc_scores])
+    time3 = time.perf_counter()
     rank = 0
-    for docid, score in sorted_doc_scores:
-        doc_meta = query.docid_to_metadata(docid)
-        dom_parser = LightDocParser(doc_meta.raw_doc)
+    for (docid, score), query_snippet in zip(sorted_doc_scores, snippets):
+        doc_meta = query.docid_to_metadata(docid, raw_doc=False)
         rank += 1
-        query_snippet = dom_parser.cont_dict['TEXT'].strip()[0:200]
-        query_snippet = query_snippet + '...'
         headline = doc_meta.hl
         if headline == "" or headline == None:
-            headline = query_snippet[0:50]
+            # start of the TEXT, not the highlighted snippet:
+            sentences, _ = query.doc_sentences(docid)
+            headline = ''.join(sentences).strip()[0:50]
         date = doc_meta.date
         docno = doc_meta.docno.strip()
         print(query_res_str.format(
@@ -81,6 +52,11 @@ def run_query(query_str, query):
                 query_snippet=query_snippet,
                 docno=docno
             ))
+    print("Ranking: {:.3f} ms  Snippets: {:.3f} ms".format(
+          (time2 - time1)*1000, (time3 - time2)*1000))
+    print(query.result_cache.summary())
+    if query.invIndex.postings_cache is not None:
+        print(query.invIndex.postings_cache.summary())
 
 query_res_str=\
 '''
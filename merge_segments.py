@@ -0,0 +1,208 @@
+"""Segment merger.
+
+Compacts the segments added to an index by IndexEngine.py --append with the
+tiered merge policy of segment_helpers: merge_factor adjacent segments of the
+same size tier are merged into one, until no tier has that many.  A merged
+segment is written next to its inputs and swapped in under the manifest lock,
+the inputs are then removed (a Query that opened them keeps its mapped files
+until refresh_segments).  Only one merger runs per index at a time.
+
+IndexEngine.py --append starts it in the background once the segment is
+added, its output going to <index_wd>/segments/merge.log.
+
+Example
+-------
+literal blocks::
+    $ python merge_segments.py <index_wd> [--merge-factor 4] [--min-docs 1000]
+        [--interval SECS]
+
+    $ python merge_segments.py /Users/nikhilarora/data/latimes/index_dir_baseline
+    checking for merges every minute:
+    $ python merge_segments.py /Users/nikhilarora/data/latimes/index_dir_baseline --interval 60
+"""
+import os
+import sys
+import time
+import shutil
+import pickle
+import argparse
+import numpy as np
+from index_helpers import timing, Lexicon, InvIndex, DocStats
+from record_helpers import RecordWriter, RecordReader
+from positions_helpers import PositionsReader, POSITIONS_STORE
+from segment_helpers import (SegmentManifest, find_merge, MERGE_FACTOR,
+                             MIN_SEGMENT_DOCS, MERGE_LOCK_FILE)
+
+parser = argparse.ArgumentParser(description='Merges the segments of an \
+    index with a tiered merge policy.')
+parser.add_argument('index_wd', help='Path to the index')
+parser.add_argument('--merge-factor', type=int, default=MERGE_FACTOR,
+    help='Number of adjacent segments of a size tier merged together')
+parser.add_argument('--min-docs', type=int, default=MIN_SEGMENT_DOCS,
+    help='Segments smaller than this are all in the first tier')
+parser.add_argument('--interval', type=float, default=None,
+    help='Keep running, checking for merges every this many seconds')
+
+# docid keyed record stores of a segment:
+STORES = ['metastore', 'sentences', 'sentence_termids']
+
+
+def merged_name(names):
+    """Name of the segment merged from names, seg_<first>-<last> with the
+    numbers of the first and last segments added.
+    """
+    return '{}-{}'.format(names[0].split('-')[0],
+                          names[-1].split('-')[-1].replace('seg_', ''))
+
+@timing
+def merge_segments(segment_wds, merged_wd):
+    """Merges the adjacent segments at segment_wds (in docid order) into a
+    new segment at merged_wd, docids are renumbered from 1 and termids kept.
+    Positions and quantized norms are merged too if every segment has them.
+    Returns: the manifest entry of the merged segment (without its name)
+    """
+    print("Merging {} segments into {}".format(len(segment_wds), merged_wd))
+    if os.path.isdir(merged_wd):
+        # left by an interrupted merge:
+        shutil.rmtree(merged_wd)
+    os.makedirs(merged_wd)
+    invIndexes, lexicons, bases = [], [], []
+    doc_lens_ls = [np.zeros(1, dtype=np.uint32)]
+    quantize_norms = True
+    docid_to_docno = {}
+    coll_len = 0
+    coll_token_sum = 0
+    for segment_wd in segment_wds:
+        invIndex = InvIndex(segment_wd)
+        invIndex.load()
+        lexicon = Lexicon(segment_wd)
+        lexicon.load()
+        docStats = DocStats(segment_wd)
+        docStats.load()
+        with open(os.path.join(segment_wd, 'docid_to_docno.p'), 'rb') as f:
+            docid_to_docno.update((coll_len + docid, docno) for docid, docno
+                                  in pickle.load(f).items())
+        invIndexes.append(invIndex)
+        lexicons.append(lexicon)
+        bases.append(coll_len)
+        doc_lens_ls.append(docStats.doc_lens[1:])
+        quantize_norms = quantize_norms and docStats.has_norms()
+        coll_len += invIndex.coll_len
+        coll_token_sum += invIndex.coll_token_sum
+
+    for name in STORES:
+        writer = RecordWriter(merged_wd, name)
+        for segment_wd, base in zip(segment_wds, bases):
+            reader = RecordReader(segment_wd, name)
+            for docid in range(len(reader)):
+                if docid in reader:
+                    writer.add(base + docid, reader.get(docid))
+        writer.close()
+    doc_lens = np.concatenate(doc_lens_ls)
+    DocStats(merged_wd).save(doc_lens, quantize=quantize_norms)
+    with open(os.path.join(merged_wd, 'docid_to_docno.p'), 'wb') as f:
+        pickle.dump(docid_to_docno, f)
+
+    # the lexicon deltas of adjacent segments hold consecutive termids:
+    lexicon = Lexicon(merged_wd)
+    lexicon.termid_2_term = [segment_lexicon.term(termid)
+                             for segment_lexicon in lexicons
+                             for termid in segment_lexicon.termids()]
+    deltas = [segment_lexicon for segment_lexicon in lexicons
+              if len(segment_lexicon)]
+    if deltas:
+        lexicon.first_termid = deltas[0].first_termid
+    lexicon.dfs = np.zeros(len(lexicon.termid_2_term), dtype=np.uint32)
+    lexicon.cfs = np.zeros(len(lexicon.termid_2_term), dtype=np.uint64)
+
+    invIndex = InvIndex(merged_wd)
+    invIndex.coll_len = coll_len
+    invIndex.coll_token_sum = coll_token_sum
+    invIndex.doc_lens = doc_lens
+    invIndex.open_writer()
+    positions = None
+    if all(PositionsReader.exists(segment_wd) for segment_wd in segment_wds):
+        # docs keep their order so the records of a term are concatenated:
+        readers = [PositionsReader(segment_wd) for segment_wd in segment_wds]
+        positions = RecordWriter(merged_wd, POSITIONS_STORE)
+    termids = np.unique(np.concatenate([segment_index.reader.termids
+                                        for segment_index in invIndexes]))
+    for termid in termids.tolist():
+        docids_ls, counts_ls = [], []
+        for segment_index, base in zip(invIndexes, bases):
+            if segment_index.does_termid_exist(termid):
+                docids, counts = segment_index.get_posting_ls(termid)
+                docids_ls.append(docids + np.uint32(base))
+                counts_ls.append(counts)
+        docids = np.concatenate(docids_ls)
+        counts = np.concatenate(counts_ls)
+        invIndex.add_postings_list(termid, docids, counts)
+        if positions is not None:
+            positions.add(termid, b''.join(bytes(reader.record(termid))
+                for reader in readers if termid in reader.store))
+        i = termid - lexicon.first_termid
+        if 0 <= i < len(lexicon.termid_2_term):
+            lexicon.dfs[i] = len(docids)
+            lexicon.cfs[i] = counts.sum()
+    lexicon.save()
+    invIndex.save()
+    if positions is not None:
+        positions.close()
+    return {'n_docs': coll_len, 'coll_token_sum': coll_token_sum}
+
+def run_merges(index_wd, merge_factor=MERGE_FACTOR, min_docs=MIN_SEGMENT_DOCS):
+    """Applies the tiered merge policy to the segments of index_wd until no
+    merge is due, unless another merger is running.
+    Returns: the number of merges done
+    """
+    segments = SegmentManifest(index_wd)
+    merges = 0
+    with segments.lock(MERGE_LOCK_FILE, blocking=False) as acquired:
+        if not acquired:
+            print("Another merger is running on {}".format(index_wd))
+            return merges
+        while True:
+            entries = segments.load()['segments']
+            merge = find_merge([entry['n_docs'] for entry in entries],
+                               merge_factor, min_docs)
+            if merge is None:
+                return merges
+            names = [entry['name'] for entry in entries[merge[0]:merge[1]]]
+            name = merged_name(names)
+            entry = merge_segments([segments.segment_dir(segment_name)
+                                    for segment_name in names],
+                                   segments.segment_dir(name))
+            entry['name'] = name
+            # segments are only added meanwhile, swap the merged ones:
+            with segments.lock():
+                manifest = segments.load()
+                start = [old['name'] for old in
+                         manifest['segments']].index(names[0])
+                manifest['segments'][start:start + len(names)] = [entry]
+                segments.save(manifest)
+            for segment_name in names:
+                shutil.rmtree(segments.segment_dir(segment_name))
+            merges += 1
+            print("Merged {} into {}".format(', '.join(names), name))
+
+def validate_args(cli):
+    if not SegmentManifest(cli.index_wd).exists():
+        print('Current dir: {} holds no segments.'.format(cli.index_wd))
+        print('Exiting program.')
+        sys.exit()
+    if cli.merge_factor < 2:
+        print("--merge-factor must be at least 2.")
+        sys.exit()
+    if cli.min_docs < 1:
+        print("--min-docs must be at least 1.")
+        sys.exit()
+
+if __name__ == '__main__':
+    cli = parser.parse_args()
+    validate_args(cli)
+    while True:
+        merges = run_merges(cli.index_wd, cli.merge_factor, cli.min_docs)
+        print("{} merges done".format(merges))
+        if cli.interval is None:
+            break
+        time.sleep(cli.interval)
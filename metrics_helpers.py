@@ -0,0 +1,107 @@
+"""
+Evaluation measures of every topic of a run at once.
+
+A run is held as a topics x ranks matrix (see pad_rows): row i holds the
+relevance of the results of the i-th topic in rank order, padded with 0s,
+lengths[i] being the number of results of the topic.  Each measure is a few
+array passes over the matrix, per rank sums being cumulative sums instead of
+loops, and gives the values of the per topic functions of eval_helpers:
+- precision_at_k : divides by k even if the topic has fewer results.
+- avg_precision_k : R is the number of relevant docs of each topic.
+- ndcg_k : the ideal ranking is the run's own top k sorted by relevance, 0
+  for a topic without results and nan if none of its top k is relevant.
+- tbg_k : time-biased gain (Smucker and Clarke, 2012), the gain of the last
+  result isn't counted and the time to reach rank i sums the reading time
+  of ranks 2 to i.
+
+Contains:
+
+Methods:
+- pad_rows(vects, k)
+- row_sums(matrix)
+- precision_at_k(rels, k)
+- avg_precision_k(rels, R, k)
+- ndcg_k(rels, lengths, k)
+- tbg_k(rels, doc_lens, lengths, k)
+"""
+import numpy as np
+
+# TBG user model:
+TBG_HALF_LIFE = 224 # seconds
+TBG_CLICK_REL = 0.64 # P(click | relevant summary)
+TBG_CLICK_NONREL = 0.39
+TBG_SAVE_REL = 0.77 # P(judged relevant | clicked relevant doc)
+TBG_SUMMARY_SECS = 4.4
+TBG_SECS_PER_WORD = 0.018
+TBG_DOC_SECS = 7.8
+
+
+def pad_rows(vects, k=None, dtype=np.float64):
+    """Stacks the first k values of each of vects (lists or arrays of
+    varying lengths) into a matrix padded with 0s.
+    Returns: (matrix, lengths) with lengths the int64 array of the number of
+    values kept from each vect
+    """
+    vects = [np.asarray(vect, dtype=dtype)[:k] for vect in vects]
+    lengths = np.array([len(vect) for vect in vects], dtype=np.int64)
+    matrix = np.zeros((len(vects), lengths.max(initial=0)), dtype=dtype)
+    if len(vects):
+        matrix[np.arange(matrix.shape[1]) < lengths[:, None]] = \
+            np.concatenate(vects)
+    return matrix, lengths
+
+def row_sums(matrix):
+    """Sums each row of matrix in column order, rounding as a loop adding
+    them one by one does (np.sum adds in pairs).
+    """
+    if matrix.shape[1] == 0:
+        return np.zeros(len(matrix))
+    return np.cumsum(matrix, axis=1)[:, -1]
+
+def precision_at_k(rels, k=10):
+    """Returns the precision at k of each topic"""
+    return row_sums(rels[:, :k])/k
+
+def avg_precision_k(rels, R, k=1000):
+    """Returns the average precision of the top k of each topic, R being
+    the number of relevant docs of each topic.
+    """
+    rels = rels[:, :k]
+    ranks = np.arange(1, rels.shape[1] + 1)
+    precisions = rels*np.cumsum(rels, axis=1)/ranks
+    return (1/np.asarray(R, dtype=np.float64))*row_sums(precisions)
+
+def ndcg_k(rels, lengths, k=10):
+    """Returns the nDCG at k of each topic"""
+    rels = rels[:, :k]
+    discounts = np.log2(np.arange(2, rels.shape[1] + 2))
+    dcg = row_sums(rels/discounts)
+    idcg = row_sums(-np.sort(-rels, axis=1)/discounts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(np.asarray(lengths) == 0, 0, dcg/idcg)
+
+def tbg_k(rels, doc_lens, lengths, k=1000):
+    """Returns the time-biased gain of the top k of each topic, doc_lens
+    being the matrix of the lengths (in words) of the docs of rels.
+    """
+    rels = rels[:, :k]
+    doc_lens = np.asarray(doc_lens, dtype=np.float64)[:, :k]
+    lengths = np.minimum(lengths, k)
+    p_click = np.where(rels == 1, TBG_CLICK_REL, TBG_CLICK_NONREL)
+    secs = TBG_SUMMARY_SECS + (TBG_SECS_PER_WORD*doc_lens +
+                               TBG_DOC_SECS)*p_click
+    # time to reach the i-th result (from 0), the sum of secs[1:i+1]:
+    times = np.zeros(rels.shape)
+    np.cumsum(secs[:, 1:], axis=1, out=times[:, 1:])
+    decays = np.exp(-times*(np.log(2)/TBG_HALF_LIFE))
+    gains = rels*TBG_CLICK_REL*TBG_SAVE_REL
+    counted = np.arange(rels.shape[1]) < (lengths - 1)[:, None]
+    return row_sums(np.where(counted, gains*decays, 0))
+
+
+_rels, _lengths = pad_rows([[1,1,0,1,0,0,0], [1,1,0,1,0], [0,1,0,0,1,1,1],
+                            [0,1,0,0,1,1,1,0,0,0,0,0,0,0,0], []])
+assert(ndcg_k(_rels, _lengths, 5)[0] < 1)
+assert(ndcg_k(_rels, _lengths, 5)[4] == 0)
+assert(precision_at_k(_rels, 5)[1] == 3/5)
+assert((avg_precision_k(_rels, 5, 10)[2:4] == 69/175).all())
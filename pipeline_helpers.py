@@ -0,0 +1,178 @@
+"""
+Multi-process document parsing pipeline used by IndexEngine.py --workers.
+
+    reader process --in_queue--> N parser processes --out_queue--> caller
+
+The reader decompresses the collection and splits it with doc_gen into
+numbered batches of raw docs.  Each parser process applies parse to the docs
+of a batch.  The caller (the writer stage, assigning docids and writing the
+metastore and postings) gets the parsed docs back in collection order, the
+batches finishing out of order are held until their turn.  Both queues are
+bounded and the reader takes a slot of a semaphore, given back once the
+batch is yielded, for every batch it reads, so no more than 2*queue_size +
+workers batches are in flight (queued, being parsed or held) whatever the
+parsing time of a batch.
+
+Errors of a stage are put on out_queue with their traceback (the reader
+always stops the parsers, even if it fails) and raised by the caller, which
+also checks that the stages are alive while it waits.
+
+Contains:
+
+Methods:
+- read_stage(data_path, in_queue, out_queue, slots, workers, batch_size,
+             fast, shard)
+- parse_stage(parse, in_queue, out_queue, finish)
+- parallel_parse(data_path, parse, workers, batch_size, queue_size, fast,
+                 finish, finished, shard)
+"""
+import sys
+import gzip
+import queue
+import itertools
+import traceback
+import multiprocessing as mp
+from index_helpers import doc_gen
+
+READ_SEQ = -1 # seq of the errors of the reader on out_queue
+POLL_SECS = 1.0 # the caller checks the stages are alive this often
+
+
+def read_stage(data_path, in_queue, out_queue, slots, workers, batch_size,
+               fast=False, shard=None):
+    """Puts (seq, docs) batches of the collection on in_queue, each taking
+    a slot of the slots semaphore, followed by one None per parser to stop
+    them (also if reading fails, the error going to out_queue).  fast is
+    passed on to doc_gen, with shard (i, n) only every n-th doc from the
+    i-th is read.
+    """
+    try:
+        fstream = gzip.open(data_path, 'rt', encoding='utf-8')
+        seq = 0
+        batch = []
+        docs = doc_gen(fstream, fast=fast)
+        if shard is not None:
+            docs = itertools.islice(docs, shard[0], None, shard[1])
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) == batch_size:
+                slots.acquire()
+                in_queue.put((seq, batch))
+                seq += 1
+                batch = []
+        if batch:
+            slots.acquire()
+            in_queue.put((seq, batch))
+        fstream.close()
+    except Exception:
+        out_queue.put((READ_SEQ, None, traceback.format_exc()))
+        sys.exit(1)
+    finally:
+        for _ in range(workers):
+            in_queue.put(None)
+
+def parse_stage(parse, in_queue, out_queue, finish=None):
+    """Parses batches until stopped, putting (seq, parsed docs, error) on
+    out_queue then (None, finish()) once done.
+    """
+    while True:
+        item = in_queue.get()
+        if item is None:
+            out_queue.put((None, finish() if finish is not None else None))
+            break
+        seq, batch = item
+        try:
+            out_queue.put((seq, [parse(doc) for doc in batch], None))
+        except Exception:
+            out_queue.put((seq, None, traceback.format_exc()))
+
+def parallel_parse(data_path, parse, workers, batch_size=64, queue_size=None,
+                   fast=False, finish=None, finished=None, shard=None):
+    """Yields parse(doc) for every doc of the collection at data_path, in
+    collection order, parsing with workers processes.
+
+    Parameters
+    ----------
+    data_path : str
+        path to latimes.gz
+    parse : callable
+        raw doc -> parsed doc, must be picklable (a module level function or
+        a functools.partial of one)
+    workers : int
+        number of parser processes
+    batch_size : int
+        docs sent to a parser at a time
+    queue_size : int, optional
+        max batches waiting in each queue, defaults to 2*workers
+    fast : bool
+        split the collection with the fast mode of doc_gen
+    finish : callable, optional
+        called by each parser process once it's done, e.g. to return state
+        built while parsing
+    finished : list, optional
+        gets the result of finish of every parser process
+    shard : (int, int), optional
+        (i, n) to only parse every n-th doc from the i-th (0 based)
+    """
+    if queue_size is None:
+        queue_size = 2*workers
+    in_queue = mp.Queue(queue_size)
+    out_queue = mp.Queue(queue_size)
+    # batches read but not yet yielded:
+    slots = mp.Semaphore(2*queue_size + workers)
+    procs = [mp.Process(target=read_stage,
+                        args=(data_path, in_queue, out_queue, slots, workers,
+                              batch_size, fast, shard))]
+    for _ in range(workers):
+        procs.append(mp.Process(target=parse_stage,
+                                args=(parse, in_queue, out_queue, finish)))
+    for proc in procs:
+        proc.daemon = True
+        proc.start()
+
+    pending = {} # seq: parsed docs of the batches received early
+    next_seq = 0
+    done = 0
+    try:
+        while done < workers:
+            try:
+                item = out_queue.get(timeout=POLL_SECS)
+            except queue.Empty:
+                for proc in procs:
+                    if proc.exitcode not in (None, 0):
+                        raise RuntimeError("A parsing pipeline stage ({}) "
+                            "died with exit code {}.".format(proc.name,
+                                                             proc.exitcode))
+                continue
+            if item[0] is None:
+                done += 1
+                if finished is not None:
+                    finished.append(item[1])
+                continue
+            seq, parsed, error = item
+            if seq == READ_SEQ:
+                raise RuntimeError("Reading {} failed:\n{}".format(data_path,
+                                                                   error))
+            if error is not None:
+                raise RuntimeError("Parsing batch {} failed:\n{}".format(seq,
+                                                                        error))
+            pending[seq] = parsed
+            while next_seq in pending:
+                for doc in pending.pop(next_seq):
+                    yield doc
+                next_seq += 1
+                slots.release()
+        # the reader's error may come after the parsers are done:
+        procs[0].join()
+        if procs[0].exitcode != 0:
+            try:
+                error = out_queue.get(timeout=POLL_SECS)[2]
+            except queue.Empty:
+                error = "exit code {}".format(procs[0].exitcode)
+            raise RuntimeError("Reading {} failed:\n{}".format(data_path,
+                                                               error))
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+            proc.join()
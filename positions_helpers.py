@@ -0,0 +1,213 @@
+"""
+Positional index: the positions of the terms in the docs, stored apart from
+the postings so queries that don't need them never read them.
+
+Files written to the index dir (IndexEngine.py --positions):
+- positions.bin/_offsets.npy : a RecordWriter store keyed by termid.  The
+                 record of a termid holds, for each doc of its postings list
+                 (in docid order), the positions of the term in the doc (its
+                 offsets in DocParser.tokens), the first as is and the
+                 others as the gap to the previous one, variable-byte
+                 encoded.  The number of positions of a doc is the count of
+                 its posting so records are decoded with the postings list.
+
+The operators work on keys, candidate << 32 | position, of the positions of
+each query term in the candidate docs (those holding every term, see
+boolean_helpers).  Keys of a term are sorted so terms are intersected with
+np.isin/np.searchsorted:
+- phrase_match : the terms at consecutive positions, in query order.
+- window_match : every term within a window of window positions, any order.
+- proximity_scores : the BM25TP term proximity score (Buttcher, Clarke and
+  Lushman, 2006), Query.search(proximity=True) adds it to the BM25 score of
+  the top docs and reranks them.
+
+Contains:
+
+Methods:
+- decode_positions(record, counts)
+- candidate_keys(positions, bounds, inx)
+- phrase_match(keys_ls, n_cand)
+- window_match(keys_ls, window, n_cand)
+- proximity_scores(keys_ls, weights, K, k1)
+
+Classes:
+- PositionsWriter
+- PositionsReader
+- SegmentedPositionsReader
+"""
+import numpy as np
+from postings_helpers import vbyte_encode, vbyte_decode
+from record_helpers import RecordWriter, RecordReader
+
+POSITIONS_STORE = 'positions'
+CAND_SHIFT = 32 # keys are candidate << CAND_SHIFT | position
+
+
+def decode_positions(record, counts):
+    """Decodes the positions record of a term given the counts of its
+    postings.
+    Returns: (positions, bounds) int64 arrays, the positions of the i-th
+    posting being positions[bounds[i]:bounds[i+1]]
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+    gaps = vbyte_decode(record).astype(np.int64)
+    sums = np.cumsum(gaps)
+    # sum of the gaps before the first position of each doc:
+    before = sums[bounds[:-1]] - gaps[bounds[:-1]]
+    return sums - np.repeat(before, counts), bounds
+
+def candidate_keys(positions, bounds, inx):
+    """Returns the sorted keys of the positions of the postings at inx, one
+    per candidate doc (-1 for a candidate not in the postings).
+    """
+    inx = np.asarray(inx, dtype=np.int64)
+    present = inx >= 0
+    inx = np.maximum(inx, 0)
+    lengths = np.where(present, bounds[inx + 1] - bounds[inx], 0)
+    total = int(lengths.sum())
+    offsets = (np.repeat(bounds[inx] - (np.cumsum(lengths) - lengths), lengths)
+               + np.arange(total))
+    cands = np.repeat(np.arange(len(inx), dtype=np.int64), lengths)
+    return (cands << CAND_SHIFT) | positions[offsets]
+
+def phrase_match(keys_ls, n_cand):
+    """Returns the number of times the terms of keys_ls (keys of each query
+    term, in query order) occur as a phrase in each candidate.
+    """
+    # phrase starts, from the term with the fewest positions:
+    first = min(range(len(keys_ls)), key=lambda i: len(keys_ls[i]))
+    starts = keys_ls[first] - first
+    for i, keys in enumerate(keys_ls):
+        if i != first and len(starts):
+            starts = starts[np.isin(starts + i, keys, assume_unique=True)]
+    return np.bincount(starts >> CAND_SHIFT, minlength=n_cand)
+
+def window_match(keys_ls, window, n_cand):
+    """Returns, per candidate, the number of positions starting a window of
+    window positions holding every term of keys_ls (keys of each distinct
+    query term).
+    """
+    starts = np.unique(np.concatenate(keys_ls))
+    ok = np.ones(len(starts), dtype=bool)
+    for keys in keys_ls:
+        if len(keys) == 0:
+            return np.zeros(n_cand, dtype=np.int64)
+        inx = np.searchsorted(keys, starts)
+        nxt = keys[np.minimum(inx, len(keys) - 1)]
+        # keys of another doc are at least 2**CAND_SHIFT - position apart:
+        ok &= (inx < len(keys)) & (nxt - starts < window)
+    return np.bincount(starts[ok] >> CAND_SHIFT, minlength=n_cand)
+
+def proximity_scores(keys_ls, weights, K, k1=1.2):
+    """BM25TP proximity score of each candidate: every pair of adjacent
+    occurrences of distinct query terms, d positions apart, adds the
+    weight of each term over d**2 to the accumulator of the other, the
+    accumulators then being saturated like BM25 tfs.
+
+    Parameters
+    ----------
+    keys_ls : list of np.ndarray
+        keys of each distinct query term
+    weights : np.ndarray
+        weight (min(1, idf), at least 0) of each term
+    K : np.ndarray
+        BM25 doc length normalization of each candidate
+    k1 : float
+
+    Returns
+    -------
+    np.ndarray of the score of each candidate
+    """
+    n_cand, n_terms = len(K), len(keys_ls)
+    keys = np.concatenate(keys_ls)
+    terms = np.repeat(np.arange(n_terms), [len(k) for k in keys_ls])
+    order = np.argsort(keys, kind='stable')
+    keys, terms = keys[order], terms[order]
+    cands = keys >> CAND_SHIFT
+    pairs = np.flatnonzero((cands[1:] == cands[:-1]) &
+                           (terms[1:] != terms[:-1]))
+    dist2 = ((keys[pairs + 1] - keys[pairs])**2).astype(np.float64)
+    acc = np.zeros((n_cand, n_terms), dtype=np.float64)
+    np.add.at(acc, (cands[pairs], terms[pairs]),
+              weights[terms[pairs + 1]]/dist2)
+    np.add.at(acc, (cands[pairs], terms[pairs + 1]),
+              weights[terms[pairs]]/dist2)
+    K = np.asarray(K, dtype=np.float64)[:, None]
+    return (weights[None, :]*acc*(k1 + 1)/(acc + K)).sum(axis=1)
+
+
+class PositionsWriter(object):
+    """Collects the termids of the tokens of every doc, then writes the
+    positions store with one sort of all the tokens.
+    """
+    def __init__(self, index_wd):
+        self.index_wd = index_wd
+        self.termids = []
+        self.docids = []
+
+    def add_doc(self, docid, termids):
+        """Adds the termids of the tokens of docid, in token order"""
+        self.termids.append(np.asarray(termids, dtype=np.uint32))
+        self.docids.append(np.full(len(termids), docid, dtype=np.uint32))
+
+    def close(self):
+        """Writes the positions of every term, in termid order"""
+        writer = RecordWriter(self.index_wd, POSITIONS_STORE)
+        lens = np.array([len(termids) for termids in self.termids])
+        if lens.sum() > 0:
+            termids = np.concatenate(self.termids)
+            docids = np.concatenate(self.docids)
+            positions = (np.arange(len(termids), dtype=np.int64) -
+                         np.repeat(np.cumsum(lens) - lens, lens))
+            # stable, so positions stay increasing within a doc:
+            order = np.lexsort((docids, termids))
+            termids, docids = termids[order], docids[order]
+            positions = positions[order]
+            new_doc = np.ones(len(termids), dtype=bool)
+            new_doc[1:] = ((termids[1:] != termids[:-1]) |
+                           (docids[1:] != docids[:-1]))
+            gaps = positions.copy()
+            gaps[1:] -= positions[:-1]
+            gaps[new_doc] = positions[new_doc]
+            ends = np.append(np.flatnonzero(termids[1:] != termids[:-1]) + 1,
+                             len(termids))
+            starts = np.concatenate(([0], ends[:-1]))
+            for termid, start, end in zip(termids[starts].tolist(),
+                                          starts.tolist(), ends.tolist()):
+                writer.add(termid, vbyte_encode(gaps[start:end]))
+        writer.close()
+        self.termids, self.docids = [], []
+
+
+class PositionsReader(object):
+    """Memory-mapped access to the positions store of an index"""
+    def __init__(self, index_wd):
+        self.store = RecordReader(index_wd, POSITIONS_STORE)
+
+    @staticmethod
+    def exists(index_wd):
+        """True if the index was built with positions"""
+        return RecordReader.exists(index_wd, POSITIONS_STORE)
+
+    def record(self, termid):
+        """Returns the encoded positions of termid"""
+        return self.store.get(termid)
+
+    def get(self, termid, counts):
+        """Returns (positions, bounds) of termid (see decode_positions),
+        counts being those of its postings list.
+        """
+        return decode_positions(self.record(termid), counts)
+
+
+class SegmentedPositionsReader(PositionsReader):
+    """PositionsReader over the base index and its segments (see
+    segment_helpers), in the order their postings are concatenated.
+    """
+    def __init__(self, readers):
+        self.readers = readers
+
+    def record(self, termid):
+        return b''.join(bytes(reader.record(termid)) for reader in self.readers
+                        if termid in reader.store)
@@ -0,0 +1,411 @@
+"""
+Binary on-disk postings format.
+
+Files written to the index dir:
+- postings.bin : per term, the docid gaps followed by the counts, both
+                 variable-byte encoded.
+- postings_terms.npy : term offset table, one record per termid sorted by
+                 termid (see TERMS_DTYPE).
+- postings_blocks.npy : block table, postings lists are cut in blocks of
+                 BLOCK_SIZE postings and each block gets a record (see
+                 BLOCKS_DTYPE), a term's being consecutive from its
+                 first_block.
+
+When the writer is given the doc lengths, the table also holds the smallest
+and largest BM25 tf component ((k1+1)*tf/(K+tf)) of each postings list, for
+the k1 and b the index was built with.  Multiplied by a query's qf and idf
+components these bound the contribution of the term to any doc's score.
+
+A block record holds the last docid of the block, where its gaps and counts
+start in postings.bin, its largest tf and the smallest length of its docs.
+A block can thus be skipped or decoded on its own (its first gap follows the
+last docid of the previous block) and the tf and doc length bound the BM25
+score of its postings for any k1, b and avg_dl (see PostingsBlocks).
+
+The table is memory-mapped and searched with np.searchsorted (with the dense
+termids of the Lexicon the row of a termid is the termid itself, which is
+checked first), postings.bin is memory-mapped and only the postings lists a
+query touches are decoded.
+
+Variable-byte encoding stores 7 bits per byte, least significant group first,
+and sets the high bit on the last byte of each value.
+
+Contains:
+
+Methods:
+- vbyte_encode(values)
+- vbyte_decode(buf)
+- value_starts(buf)
+- concat_ranges(starts, lengths)
+
+Classes:
+- PostingsWriter
+- PostingsReader
+- PostingsBlocks
+"""
+import os
+import mmap
+import numpy as np
+
+POSTINGS_FILE = 'postings.bin'
+TERMS_FILE = 'postings_terms.npy'
+BLOCKS_FILE = 'postings_blocks.npy'
+BLOCK_SIZE = 128 # postings per block
+
+TERMS_DTYPE = np.dtype([
+    ('termid', np.int64),
+    ('offset', np.uint64), # start of the term's block in postings.bin
+    ('docid_bytes', np.uint32), # size of the encoded docid gaps
+    ('nbytes', np.uint32), # size of the whole block (gaps + counts)
+    ('df', np.uint32),
+    ('min_tf_score', np.float64), # BM25 tf component bounds (nan if unknown)
+    ('max_tf_score', np.float64),
+    ('first_block', np.uint64), # row of the term's first block record
+])
+
+BLOCKS_DTYPE = np.dtype([
+    ('last_docid', np.uint32),
+    ('docid_offset', np.uint64), # start of the block's gaps in postings.bin
+    ('count_offset', np.uint64), # start of the block's counts
+    ('max_tf', np.uint32),
+    ('min_dl', np.uint32), # smallest doc length (0 if unknown)
+])
+
+
+def vbyte_encode(values):
+    """Variable-byte encodes an array of non-negative ints and returns bytes"""
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return b''
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        n_bytes += values >= (1 << shift)
+    ends = np.cumsum(n_bytes)
+    starts = ends - n_bytes
+    value_inx = np.repeat(np.arange(len(values)), n_bytes)
+    byte_inx = np.arange(ends[-1]) - starts[value_inx]
+    out = (values[value_inx] >> (7*byte_inx).astype(np.uint64)) & 0x7f
+    out[ends - 1] |= 0x80 # stop bit
+    return out.astype(np.uint8).tobytes()
+
+def vbyte_decode(buf):
+    """Decodes a buffer (bytes, mmap slice or uint8 array) of variable-byte
+    encoded values and returns them as a uint64 array.
+    """
+    buf = np.frombuffer(buf, dtype=np.uint8)
+    if len(buf) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    stops = np.flatnonzero(buf & 0x80)
+    starts = np.concatenate(([0], stops[:-1] + 1))
+    value_inx = np.repeat(np.arange(len(stops)), stops - starts + 1)
+    byte_inx = np.arange(len(buf)) - starts[value_inx]
+    groups = (buf & 0x7f).astype(np.uint64) << (7*byte_inx).astype(np.uint64)
+    # groups of a value never overlap so a sum is the same as an or:
+    return np.add.reduceat(groups, starts)
+
+def value_starts(buf):
+    """Returns the offsets of the values of a variable-byte encoded buffer"""
+    stops = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) & 0x80)
+    return np.concatenate(([0], stops[:-1] + 1)).astype(np.int64)
+
+def concat_ranges(starts, lengths):
+    """Returns the concatenation of the ranges start:start+length as one
+    int64 array (to gather the postings or bytes of several blocks).
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    return (np.repeat(np.asarray(starts, dtype=np.int64) - (ends - lengths),
+                      lengths) + np.arange(ends[-1] if len(ends) else 0))
+
+
+class PostingsWriter(object):
+    """Streams postings lists to postings.bin, in any termid order, and writes
+    the term offset and block tables on close.  Pass K, the docid indexed
+    BM25 length normalization k1*((1-b)+b*(dl/avg_dl)), to also store tf
+    score bounds and the docid indexed doc_lens for the block doc lengths.
+    """
+    def __init__(self, index_wd, K=None, k1=None, doc_lens=None):
+        self.index_wd = index_wd
+        self.K = K
+        self.k1 = k1
+        self.doc_lens = doc_lens
+        if not os.path.exists(index_wd):
+            os.makedirs(index_wd)
+        self.postings_path = os.path.join(index_wd, POSTINGS_FILE)
+        self.terms_path = os.path.join(index_wd, TERMS_FILE)
+        self.blocks_path = os.path.join(index_wd, BLOCKS_FILE)
+        self.file = open(self.postings_path, 'wb')
+        self.offset = 0
+        self.terms = [] # list of TERMS_DTYPE tuples
+        self.blocks = [] # BLOCKS_DTYPE arrays, in writing order
+        self.n_blocks = 0
+
+    def add(self, termid, docids, counts):
+        """Encodes and appends the (docid sorted) postings list of termid"""
+        docids = np.asarray(docids, dtype=np.int64)
+        gaps = np.diff(docids, prepend=0)
+        enc_docids = vbyte_encode(gaps)
+        enc_counts = vbyte_encode(counts)
+        self.file.write(enc_docids)
+        self.file.write(enc_counts)
+        nbytes = len(enc_docids) + len(enc_counts)
+        min_tf_score, max_tf_score = np.nan, np.nan
+        if self.K is not None and len(docids) > 0:
+            tf = np.asarray(counts, dtype=np.float64)
+            tf_scores = ( (self.k1+1)*tf) / (self.K[docids]+tf)
+            min_tf_score, max_tf_score = tf_scores.min(), tf_scores.max()
+        self.terms.append((termid, self.offset, len(enc_docids), nbytes,
+                           len(docids), min_tf_score, max_tf_score,
+                           self.n_blocks))
+        self.add_blocks(docids, counts, enc_docids, enc_counts)
+        self.offset += nbytes
+
+    def add_blocks(self, docids, counts, enc_docids, enc_counts):
+        """Appends the block records of a postings list written at
+        self.offset.
+        """
+        if len(docids) == 0:
+            return
+        firsts = np.arange(0, len(docids), BLOCK_SIZE)
+        blocks = np.zeros(len(firsts), dtype=BLOCKS_DTYPE)
+        blocks['last_docid'] = docids[np.append(firsts[1:], len(docids)) - 1]
+        blocks['docid_offset'] = self.offset + value_starts(enc_docids)[firsts]
+        blocks['count_offset'] = (self.offset + len(enc_docids) +
+                                  value_starts(enc_counts)[firsts])
+        blocks['max_tf'] = np.maximum.reduceat(np.asarray(counts), firsts)
+        if self.doc_lens is not None:
+            doc_lens = np.asarray(self.doc_lens)[docids]
+            blocks['min_dl'] = np.minimum.reduceat(doc_lens, firsts)
+        self.blocks.append(blocks)
+        self.n_blocks += len(blocks)
+
+    def close(self):
+        """Flushes postings.bin and writes the termid sorted offset table"""
+        self.file.close()
+        terms = np.array(self.terms, dtype=TERMS_DTYPE)
+        terms.sort(order='termid')
+        np.save(self.terms_path, terms)
+        blocks = np.zeros(0, dtype=BLOCKS_DTYPE)
+        if self.blocks:
+            blocks = np.concatenate(self.blocks)
+        np.save(self.blocks_path, blocks)
+
+
+class PostingsReader(object):
+    """Lazy, memory-mapped access to the postings written by PostingsWriter"""
+    def __init__(self, index_wd):
+        self.postings_path = os.path.join(index_wd, POSTINGS_FILE)
+        self.terms_path = os.path.join(index_wd, TERMS_FILE)
+        self.blocks_path = os.path.join(index_wd, BLOCKS_FILE)
+        self.terms = np.load(self.terms_path, mmap_mode='r')
+        self.termids = self.terms['termid']
+        self.blocks = None # block table, None for indexes written without
+        if ('first_block' in self.terms.dtype.names and
+                os.path.isfile(self.blocks_path)):
+            # held as one array per field, typed as they're computed with,
+            # so the blocks of a list are sliced without copies:
+            table = np.load(self.blocks_path)
+            self.blocks = {
+                'last_docid': table['last_docid'].astype(np.int64),
+                'docid_offset': table['docid_offset'].astype(np.int64),
+                'count_offset': table['count_offset'].astype(np.int64),
+                'max_tf': table['max_tf'].astype(np.float64),
+                'min_dl': table['min_dl'].astype(np.float64)}
+        self.buffer = b''
+        if os.path.getsize(self.postings_path) > 0:
+            with open(self.postings_path, 'rb') as f:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = np.frombuffer(self.buffer, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.termids)
+
+    def __contains__(self, termid):
+        return self._find(termid) is not None
+
+    def _find(self, termid):
+        """Returns the table position of termid or None if not found"""
+        if 0 <= termid < len(self.termids) and self.termids[termid] == termid:
+            return int(termid)
+        i = int(np.searchsorted(self.termids, termid))
+        if i < len(self.termids) and self.termids[i] == termid:
+            return i
+        return None
+
+    def df(self, termid):
+        """Returns the document frequency of termid (0 if not found)"""
+        i = self._find(termid)
+        if i is None:
+            return 0
+        return int(self.terms['df'][i])
+
+    def tf_score_bounds(self, termid):
+        """Returns the (min, max) BM25 tf component of termid's postings, or
+        None if they weren't stored.
+        """
+        i = self._find(termid)
+        if i is None or 'max_tf_score' not in self.terms.dtype.names:
+            return None
+        record = self.terms[i]
+        if np.isnan(record['max_tf_score']):
+            return None
+        return float(record['min_tf_score']), float(record['max_tf_score'])
+
+    def get(self, termid):
+        """Decodes and returns the postings list of termid as a pair of uint32
+        arrays (docids, counts).
+        """
+        i = self._find(termid)
+        if i is None:
+            raise KeyError("Termid {} not found.".format(str(termid)))
+        record = self.terms[i]
+        start = int(record['offset'])
+        split = start + int(record['docid_bytes'])
+        end = start + int(record['nbytes'])
+        buf = memoryview(self.buffer)
+        docids = np.cumsum(vbyte_decode(buf[start:split])).astype(np.uint32)
+        counts = vbyte_decode(buf[split:end]).astype(np.uint32)
+        return docids, counts
+
+    def get_blocks(self, termid, base=0):
+        """Returns the PostingsBlocks of termid, its docids offset by base, or
+        None if the index has no block table.
+        """
+        i = self._find(termid)
+        if i is None:
+            raise KeyError("Termid {} not found.".format(str(termid)))
+        if self.blocks is None:
+            return None
+        record = self.terms[i]
+        first = int(record['first_block'])
+        n_blocks = -(-int(record['df']) // BLOCK_SIZE)
+        start = int(record['offset'])
+        table = {name: column[first:first + n_blocks]
+                 for name, column in self.blocks.items()}
+        return PostingsBlocks(self.data, table,
+                              int(record['df']),
+                              start + int(record['docid_bytes']),
+                              start + int(record['nbytes']), base)
+
+    def items(self):
+        """Yields (termid, (docids, counts)) for every term, in termid order"""
+        for termid in self.termids.tolist():
+            yield termid, self.get(termid)
+
+
+class PostingsBlocks(object):
+    """The block records of a postings list (see BLOCKS_DTYPE) as arrays, one
+    value per block:
+        - last_docids : last docid of the block
+        - max_tfs, min_dls : largest tf and smallest doc length of the block
+        - starts : position of the first posting of the block in the list
+          (with the list's length appended)
+    and decode(blocks) decoding the postings of only the given blocks.  The
+    blocks of the postings lists of several segments are chained with
+    PostingsBlocks.concat, docids being made global.  When postings is set
+    to the decoded list (eg. from a PostingsCache) blocks are sliced from it
+    instead.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        uint8 view of postings.bin
+    table : dict
+        the fields of the BLOCKS_DTYPE records of the list, an array each
+    df : int
+        number of postings of the list
+    docid_end, count_end : int
+        end of the list's gaps and of its counts in postings.bin
+    base : int
+        offset added to the docids
+    """
+    def __init__(self, data, table, df, docid_end, count_end, base=0):
+        self.last_docids = table['last_docid']
+        if base:
+            self.last_docids = self.last_docids + base
+        self.max_tfs = table['max_tf']
+        self.min_dls = table['min_dl']
+        n_blocks = len(self.last_docids)
+        self.starts = np.minimum(BLOCK_SIZE*np.arange(n_blocks + 1), df)
+        # docid before each block, its first gap is relative to it:
+        self.prev_docids = np.concatenate(([base], self.last_docids[:-1]))
+        self.datas = [data]
+        self.parts = np.zeros(n_blocks, dtype=np.int64) # index in datas
+        self.docid_starts = table['docid_offset']
+        self.docid_ends = np.append(self.docid_starts[1:], docid_end)
+        self.count_starts = table['count_offset']
+        self.count_ends = np.append(self.count_starts[1:], count_end)
+        self.postings = None
+
+    def __len__(self):
+        return len(self.last_docids)
+
+    @property
+    def df(self):
+        """Number of postings of the list"""
+        return int(self.starts[-1])
+
+    @classmethod
+    def concat(cls, blocks_ls):
+        """Chains the PostingsBlocks of consecutive docid ranges"""
+        if len(blocks_ls) == 1:
+            return blocks_ls[0]
+        blocks = cls.__new__(cls)
+        for name in ['last_docids', 'max_tfs', 'min_dls', 'prev_docids',
+                     'docid_starts', 'docid_ends', 'count_starts',
+                     'count_ends']:
+            setattr(blocks, name, np.concatenate([getattr(part, name)
+                                                  for part in blocks_ls]))
+        blocks.starts = np.concatenate(([0], np.cumsum(np.concatenate(
+            [np.diff(part.starts) for part in blocks_ls]))))
+        blocks.datas = [data for part in blocks_ls for data in part.datas]
+        blocks.parts = np.concatenate([np.full(len(part), i, dtype=np.int64)
+                                       for i, part in enumerate(blocks_ls)])
+        blocks.postings = None
+        return blocks
+
+    def decode(self, blocks):
+        """Decodes the postings of the (increasing) block indexes blocks.
+        Returns: (docids int64 array, counts uint32 array)
+        """
+        blocks = np.asarray(blocks, dtype=np.int64)
+        if len(blocks) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint32)
+        sizes = self.starts[blocks + 1] - self.starts[blocks]
+        first, last = blocks[0], blocks[-1]
+        consecutive = last - first + 1 == len(blocks)
+        if self.postings is not None:
+            docids, counts = self.postings
+            if consecutive:
+                inx = slice(self.starts[first], self.starts[last + 1])
+            else:
+                inx = concat_ranges(self.starts[blocks], sizes)
+            return docids[inx].astype(np.int64), counts[inx]
+        if consecutive and self.parts[first] == self.parts[last]:
+            # consecutive blocks of one postings list, their gaps follow
+            # each other:
+            data = self.datas[self.parts[first]]
+            gaps = vbyte_decode(data[self.docid_starts[first]:
+                                     self.docid_ends[last]])
+            counts = vbyte_decode(data[self.count_starts[first]:
+                                       self.count_ends[last]])
+            return (self.prev_docids[first] + np.cumsum(gaps).astype(np.int64),
+                    counts.astype(np.uint32))
+        gaps_ls, counts_ls = [], []
+        for part in np.unique(self.parts[blocks]).tolist():
+            part_blocks = blocks[self.parts[blocks] == part]
+            data = self.datas[part]
+            gaps_ls.append(vbyte_decode(data[concat_ranges(
+                self.docid_starts[part_blocks],
+                self.docid_ends[part_blocks] - self.docid_starts[part_blocks])]))
+            counts_ls.append(vbyte_decode(data[concat_ranges(
+                self.count_starts[part_blocks],
+                self.count_ends[part_blocks] - self.count_starts[part_blocks])]))
+        gaps = np.concatenate(gaps_ls).astype(np.int64)
+        counts = np.concatenate(counts_ls).astype(np.uint32)
+        # the gaps summed up, restarting from the docid before each block:
+        sums = np.cumsum(gaps)
+        firsts = np.cumsum(sizes) - sizes
+        before = np.where(firsts > 0, sums[firsts - 1], 0)
+        return sums + np.repeat(self.prev_docids[blocks] - before, sizes), \
+            counts
@@ -0,0 +1,96 @@
+"""
+Append-only store of variable length binary records keyed by a dense int
+(e.g. the docid).
+
+Files written to the index dir for a store called <name>:
+- <name>.bin : the records, concatenated in key order.
+- <name>_offsets.npy : uint64 offsets, record key spans
+                       [offsets[key], offsets[key+1]) of <name>.bin.  Keys
+                       that were never added are empty records.
+
+Both files are memory-mapped by the reader so fetching a record is two array
+reads and a slice, with no per record file to open.
+
+Contains:
+
+Classes:
+- RecordWriter
+- RecordReader
+"""
+import os
+import mmap
+from array import array
+import numpy as np
+
+
+def record_paths(index_wd, name):
+    """Returns the (data, offsets) paths of the store name in index_wd"""
+    return (os.path.join(index_wd, '{}.bin'.format(name)),
+            os.path.join(index_wd, '{}_offsets.npy'.format(name)))
+
+
+class RecordWriter(object):
+    """Appends records, by increasing key, and writes the offsets on close."""
+    def __init__(self, index_wd, name):
+        if not os.path.exists(index_wd):
+            os.makedirs(index_wd)
+        self.data_path, self.offsets_path = record_paths(index_wd, name)
+        self.file = open(self.data_path, 'wb')
+        self.offset = 0
+        self.offsets = array('Q', [0])
+
+    def add(self, key, data):
+        """Appends data (bytes) as the record of key"""
+        if key < len(self.offsets) - 1:
+            raise ValueError("Record keys must be added in increasing order, "
+                             "got {} after {}.".format(key, len(self.offsets) - 2))
+        # skipped keys get empty records:
+        while len(self.offsets) < key + 1:
+            self.offsets.append(self.offset)
+        self.file.write(data)
+        self.offset += len(data)
+        self.offsets.append(self.offset)
+
+    def close(self):
+        """Flushes the data file and writes the offsets"""
+        self.file.close()
+        np.save(self.offsets_path, np.frombuffer(self.offsets, dtype=np.uint64))
+
+
+class RecordReader(object):
+    """Memory-mapped random access to the records written by RecordWriter"""
+    def __init__(self, index_wd, name):
+        self.data_path, self.offsets_path = record_paths(index_wd, name)
+        self.offsets = np.load(self.offsets_path, mmap_mode='r')
+        self.buffer = b''
+        if os.path.getsize(self.data_path) > 0:
+            with open(self.data_path, 'rb') as f:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def exists(index_wd, name):
+        """True if the store name was written to index_wd"""
+        return all(os.path.isfile(path) for path in record_paths(index_wd, name))
+
+    def __len__(self):
+        """Number of keys, empty records included"""
+        return len(self.offsets) - 1
+
+    def __contains__(self, key):
+        return 0 <= key < len(self) and self.nbytes(key) > 0
+
+    def nbytes(self, key):
+        """Size of the record of key"""
+        return int(self.offsets[key + 1]) - int(self.offsets[key])
+
+    def get(self, key, start=0, stop=None):
+        """Returns the record of key, or its [start:stop] bytes, as a
+        memoryview of the mapped data file.
+        """
+        if key not in self:
+            raise KeyError("Record {} not found.".format(str(key)))
+        begin = int(self.offsets[key])
+        end = int(self.offsets[key + 1])
+        if stop is not None:
+            end = min(end, begin + stop)
+        return memoryview(self.buffer)[begin + start:end]
@@ -0,0 +1,257 @@
+"""Long-lived local HTTP/JSON search service.
+
+The index is loaded once (a Query) and requests are served concurrently by
+an asyncio server.  Scoring, Boolean AND and doc fetches run in a pool of
+worker processes forked after the index is loaded, so they share it read
+only and the event loop never blocks on them (BM25Scorer accumulators are
+per process).  Where processes are spawned instead (macOS), each worker
+loads the index itself, with the same postings cache budget and warm up.
+Every request has a timeout.
+
+Endpoints (GET, JSON responses):
+- /health : status, index size and uptime
+- /search?q=<query>&k=<k> : BM25 ranking
+- /and?q=<query> : Boolean AND retrieval
+- /doc?docno=<docno> or /doc?docid=<docid> : metadata and raw doc
+
+Example
+-------
+literal blocks::
+    $ python search_service.py <index_wd> [--host 127.0.0.1] [--port 8080]
+        [--workers N] [--timeout 10] [--postings-cache-mb MB]
+        [--warm-log query_log]
+
+    $ python search_service.py /Users/nikhilarora/data/latimes/index_dir_baseline --workers 4
+    $ curl 'http://127.0.0.1:8080/search?q=uv+damage+eyes&k=10'
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import concurrent.futures
+from urllib.parse import urlsplit, parse_qs
+from index_helpers import Query
+
+parser = argparse.ArgumentParser(description='Serves search, Boolean AND and \
+    doc fetch requests over HTTP/JSON from an index loaded once.')
+parser.add_argument('index_wd', help='Path to the index')
+parser.add_argument('--host', default='127.0.0.1', help='Address to bind')
+parser.add_argument('--port', type=int, default=8080, help='Port to bind')
+parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+    help='Number of query processes')
+parser.add_argument('--timeout', type=float, default=10.0,
+    help='Seconds before a request is answered with 504')
+parser.add_argument('--postings-cache-mb', type=float, default=256,
+    help='Budget (MB) of the decoded postings cache of each process, 0 \
+    disables it')
+parser.add_argument('--warm-log', default=None,
+    help='Query log (one query per line) warming up the postings cache at \
+    startup, before the workers are forked')
+
+MAX_K = 10000
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 408: 'Request Timeout',
+           500: 'Internal Server Error', 504: 'Gateway Timeout'}
+
+# Query of the current process, set before the pool forks (else by
+# init_worker):
+QUERY = None
+
+
+class HTTPError(Exception):
+    """Error answered with status and a JSON {"error": message} body"""
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+def init_worker(index_wd, postings_cache_bytes, warm_query_log=None):
+    """Pool initializer, loads the index unless inherited from the parent"""
+    global QUERY
+    if QUERY is None or QUERY.index_wd != index_wd:
+        QUERY = Query(index_wd, postings_cache_bytes=postings_cache_bytes,
+                      warm_query_log=warm_query_log)
+
+#-------------------------------------------------------------------------------
+# Tasks run in the worker processes:
+
+def search_task(query_str, k):
+    """BM25 ranking of query_str, returns the result dicts"""
+    ranked = QUERY.search(query_str, k=k, k1=1.2, b=0.75, k2=7)
+    return [{'rank': rank, 'docid': docid,
+             'docno': QUERY.docid_to_docno[docid].strip(), 'score': score}
+            for rank, (docid, score) in enumerate(ranked, start=1)]
+
+def and_task(query_str):
+    """Boolean AND of the query terms, returns the result dicts"""
+    termids = QUERY.conv_tokens_to_ids(QUERY.tokenize(query_str))
+    docids, _ = QUERY.BooleanAND(termids)
+    return [{'docid': docid, 'docno': QUERY.docid_to_docno[docid].strip()}
+            for docid in docids.tolist()]
+
+def doc_task(docid=None, docno=None):
+    """Metadata of a doc, or None if not found"""
+    try:
+        if docid is None:
+            metadata = QUERY.docno_to_metadata(docno)
+        else:
+            metadata = QUERY.docid_to_metadata(docid)
+    except KeyError:
+        return None
+    return {'docid': metadata.docid, 'docno': metadata.docno,
+            'date': metadata.date, 'headline': metadata.hl,
+            'doc_len': int(metadata.doc_len), 'raw_doc': metadata.raw_doc}
+
+#-------------------------------------------------------------------------------
+# Server:
+
+class SearchService(object):
+    """asyncio HTTP server dispatching requests to the worker pool"""
+    def __init__(self, index_wd, workers=1, timeout=10.0,
+                 postings_cache_mb=256, warm_log=None):
+        global QUERY
+        self.index_wd = index_wd
+        self.timeout = timeout
+        postings_cache_bytes = int(postings_cache_mb*1024*1024)
+        QUERY = Query(index_wd, postings_cache_bytes=postings_cache_bytes,
+                      warm_query_log=warm_log)
+        self.executor = concurrent.futures.ProcessPoolExecutor(workers,
+            initializer=init_worker,
+            initargs=(index_wd, postings_cache_bytes, warm_log))
+        self.started = time.time()
+        self.routes = {
+            '/health': self.health,
+            '/search': self.search,
+            '/and': self.boolean_and,
+            '/doc': self.doc,
+        }
+
+    async def run_task(self, f, *args):
+        """Runs f in the pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, f, *args)
+
+    async def health(self, params):
+        return {'status': 'ok', 'index_wd': self.index_wd,
+                'docs': QUERY.invIndex.coll_len,
+                'uptime': round(time.time() - self.started, 3)}
+
+    async def search(self, params):
+        query_str = get_param(params, 'q')
+        k = get_param(params, 'k', '10')
+        if not k.isdecimal() or not 0 < int(k) <= MAX_K:
+            raise HTTPError(400, "k must be an int between 1 and {}".format(MAX_K))
+        results = await self.run_task(search_task, query_str, int(k))
+        return {'query': query_str, 'results': results}
+
+    async def boolean_and(self, params):
+        query_str = get_param(params, 'q')
+        results = await self.run_task(and_task, query_str)
+        return {'query': query_str, 'count': len(results), 'results': results}
+
+    async def doc(self, params):
+        if 'docid' in params:
+            docid = get_param(params, 'docid')
+            if not docid.isdecimal():
+                raise HTTPError(400, "docid must be an int")
+            doc = await self.run_task(doc_task, int(docid))
+        else:
+            doc = await self.run_task(doc_task, None, get_param(params, 'docno'))
+        if doc is None:
+            raise HTTPError(404, "doc not found")
+        return doc
+
+    async def handle(self, reader, writer):
+        """Answers one request per connection"""
+        time1 = time.perf_counter()
+        try:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                              self.timeout)
+            except asyncio.TimeoutError:
+                raise HTTPError(408, "request not received in time")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                raise HTTPError(400, "malformed request")
+            request_line = head.split(b'\r\n', 1)[0].decode('latin-1')
+            parts = request_line.split()
+            if len(parts) != 3:
+                raise HTTPError(400, "malformed request line")
+            method, target, _ = parts
+            if method != 'GET':
+                raise HTTPError(405, "only GET is supported")
+            url = urlsplit(target)
+            if url.path not in self.routes:
+                raise HTTPError(404, "unknown path {}".format(url.path))
+            params = parse_qs(url.query)
+            try:
+                body = await asyncio.wait_for(self.routes[url.path](params),
+                                              self.timeout)
+            except asyncio.TimeoutError:
+                raise HTTPError(504, "request timed out")
+            status = 200
+        except HTTPError as e:
+            status, body = e.status, {'error': e.message}
+        except Exception as e:
+            status, body = 500, {'error': repr(e)}
+        body['took_ms'] = round((time.perf_counter() - time1)*1000, 3)
+        await respond(writer, status, body)
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print("Serving {} on http://{}:{}".format(self.index_wd, host, port))
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_param(params, name, default=None):
+    """Returns the first value of a query string param"""
+    if name in params and params[name][0].strip():
+        return params[name][0]
+    if default is None:
+        raise HTTPError(400, "missing param {}".format(name))
+    return default
+
+async def respond(writer, status, body):
+    """Writes a JSON response and closes the connection"""
+    data = json.dumps(body).encode('utf-8')
+    head = ("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n"
+            "Content-Length: {}\r\nConnection: close\r\n\r\n").format(
+            status, REASONS[status], len(data))
+    try:
+        writer.write(head.encode('latin-1') + data)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+def validate_args(cli):
+    if not os.path.isdir(cli.index_wd):
+        print("Index dir: {} does not exist.".format(cli.index_wd))
+        sys.exit()
+    if cli.workers < 1:
+        print("--workers must be at least 1.")
+        sys.exit()
+    if cli.warm_log is not None and not os.path.isfile(cli.warm_log):
+        print("Query log: {} does not exist.".format(cli.warm_log))
+        sys.exit()
+
+if __name__ == '__main__':
+    cli = parser.parse_args()
+    validate_args(cli)
+    service = SearchService(cli.index_wd, workers=cli.workers,
+                            timeout=cli.timeout,
+                            postings_cache_mb=cli.postings_cache_mb,
+                            warm_log=cli.warm_log)
+    try:
+        asyncio.run(service.serve(cli.host, cli.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
@@ -0,0 +1,292 @@
+"""
+Segments: batches of docs added to an existing index without rebuilding it.
+
+IndexEngine.py --append indexes a new collection into its own immutable
+segment, a full index dir under <index_wd>/segments/ (lexicon, postings, doc
+stats, metastore and sentences) whose:
+- docids are local, 1 to n_docs.  The docs of a segment follow those of the
+  base index (the one in index_wd) and of the segments before it, its
+  global docids are base + local docid with base the number of docs before.
+- lexicon is a delta: terms already in the index keep their termid, only the
+  new terms are stored, with termids following all the existing ones.  So
+  postings and sentence termids of every segment share one termid space.
+
+The segments and their order are listed in <index_wd>/segments.p (see
+SegmentManifest), rewritten atomically under a file lock whenever a segment
+is added or merged.  Query searches the base index and the segments as one
+index, the collection stats (coll_len, coll_token_sum, df) being summed over
+them.
+
+Merging adjacent segments keeps the global docids and termids, so a merged
+segment is a drop in replacement for its inputs.  The tiered policy
+(find_merge) merges merge_factor adjacent segments of the same size tier,
+tier t holding segments of min_docs*merge_factor**t to
+min_docs*merge_factor**(t+1) docs, which keeps the number of segments
+logarithmic in the number of docs added.  merge_segments.py applies it, in
+the background after every IndexEngine.py --append.  The base index is
+never merged, rebuild it to fold the segments in.
+
+Contains:
+
+Methods:
+- segment_tier(n_docs, merge_factor, min_docs)
+- find_merge(sizes, merge_factor, min_docs)
+
+Classes:
+- SegmentManifest
+- SegmentedLexicon
+- SegmentedPostingsReader
+- SegmentedStore
+- SegmentedMetaStore
+"""
+import os
+import math
+import fcntl
+import pickle
+import bisect
+import contextlib
+from collections import Counter
+import numpy as np
+from postings_helpers import PostingsBlocks
+
+SEGMENTS_DIR = 'segments'
+MANIFEST_FILE = 'segments.p'
+LOCK_FILE = 'segments.lock'
+MERGE_LOCK_FILE = 'segments_merge.lock' # held by the running merger
+MERGE_FACTOR = 4
+MIN_SEGMENT_DOCS = 1000
+
+
+def segment_tier(n_docs, merge_factor=MERGE_FACTOR, min_docs=MIN_SEGMENT_DOCS):
+    """Returns the size tier of a segment of n_docs docs"""
+    return int(math.log(max(n_docs, min_docs)/min_docs, merge_factor))
+
+def find_merge(sizes, merge_factor=MERGE_FACTOR, min_docs=MIN_SEGMENT_DOCS):
+    """Returns (start, end) of the first run of merge_factor adjacent
+    segments of the same tier, sizes being the n_docs of the segments in
+    order, or None if there's none.
+    """
+    tiers = [segment_tier(n_docs, merge_factor, min_docs) for n_docs in sizes]
+    start = 0
+    for i, tier in enumerate(tiers):
+        if tier != tiers[start]:
+            start = i
+        if i - start + 1 == merge_factor:
+            return start, i + 1
+    return None
+
+
+class SegmentManifest(object):
+    """The list of the segments of an index, a dict pickled to segments.p:
+        - version : incremented on every change
+        - next_termid : termid of the next new term
+        - next_segment : number of the next segment dir name
+        - segments : list of {'name', 'n_docs', 'coll_token_sum'} in docid
+          order
+    """
+    def __init__(self, index_wd):
+        self.index_wd = index_wd
+        self.manifest_path = os.path.join(index_wd, MANIFEST_FILE)
+        self.segments_dir = os.path.join(index_wd, SEGMENTS_DIR)
+
+    def exists(self):
+        """True if segments were added to the index"""
+        return os.path.isfile(self.manifest_path)
+
+    def load(self, next_termid=0):
+        """Returns the manifest, an empty one (new terms from next_termid
+        on) if no segment was added yet.
+        """
+        if not self.exists():
+            return {'version': 0, 'next_termid': next_termid,
+                    'next_segment': 1, 'segments': []}
+        with open(self.manifest_path, 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, manifest):
+        """Bumps the version and replaces the manifest atomically"""
+        manifest['version'] += 1
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(manifest, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.manifest_path)
+
+    def version(self):
+        """Version of the manifest on disk, 0 if no segment was added"""
+        return self.load()['version'] if self.exists() else 0
+
+    def stamp(self):
+        """(inode, mtime) of the manifest file, None if there's none.  save
+        replaces the file, so the stamp changes with the version and can be
+        checked without reading the manifest.
+        """
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    @contextlib.contextmanager
+    def lock(self, name=LOCK_FILE, blocking=True):
+        """Exclusive file lock, LOCK_FILE is held while reading then
+        changing the manifest.  Yields whether it was acquired (always
+        unless not blocking).
+        """
+        with open(os.path.join(self.index_wd, name), 'w') as f:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX|fcntl.LOCK_NB
+            try:
+                fcntl.flock(f, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def segment_dir(self, name):
+        """Index dir of segment name"""
+        return os.path.join(self.segments_dir, name)
+
+    def new_segment_dir(self, manifest):
+        """Takes the next segment name of manifest, returns (name, dir)"""
+        name = 'seg_{:06d}'.format(manifest['next_segment'])
+        manifest['next_segment'] += 1
+        return name, self.segment_dir(name)
+
+
+class SegmentedLexicon(object):
+    """The lexicons of the base index and of the segments as one, lexicons
+    being ordered by termid (their termids don't overlap).  Empty deltas are
+    left out.
+    """
+    def __init__(self, lexicons):
+        self.lexicons = [lexicon for lexicon in lexicons if len(lexicon)]
+        self.first_termids = [lexicon.first_termid
+                              for lexicon in self.lexicons]
+
+    def __len__(self):
+        return sum(len(lexicon) for lexicon in self.lexicons)
+
+    def __contains__(self, term):
+        return self.get_termid(term) is not None
+
+    def get_termid(self, term):
+        """Returns the termid of term or None if not in any lexicon"""
+        for lexicon in self.lexicons:
+            termid = lexicon.get_termid(term)
+            if termid is not None:
+                return termid
+        return None
+
+    def _lexicon(self, termid):
+        return self.lexicons[max(bisect.bisect_right(self.first_termids,
+                                                     termid) - 1, 0)]
+
+    def term(self, termid):
+        """Returns the term of termid"""
+        return self._lexicon(termid).term(termid)
+
+    def conv_tokens_vect(self, doc_tokens):
+        """Converts a vector of terms to their termid's
+        Returns: dict with termid:count
+        """
+        if type(doc_tokens) != list:
+            raise TypeError("doc_tokens parameter needs to be a list")
+        return Counter(termid for termid in map(self.get_termid, doc_tokens)
+                       if termid is not None)
+
+
+class SegmentedPostingsReader(object):
+    """PostingsReader over the postings of the base index and the segments,
+    postings lists are concatenated with the docids made global.  No score
+    bounds: those stored were computed with the stats of one segment, the
+    block tables hold no BM25 parameter and are chained.
+    """
+    def __init__(self, readers, bases):
+        self.readers = readers
+        self.bases = bases
+
+    def __len__(self):
+        return len(self.termids())
+
+    def __contains__(self, termid):
+        return any(termid in reader for reader in self.readers)
+
+    def termids(self):
+        """Returns the sorted termids found in any segment"""
+        return np.unique(np.concatenate([reader.termids
+                                         for reader in self.readers]))
+
+    def df(self, termid):
+        """Returns the document frequency of termid (0 if not found)"""
+        return sum(reader.df(termid) for reader in self.readers)
+
+    def tf_score_bounds(self, termid):
+        return None
+
+    def get_blocks(self, termid):
+        """Returns the chained PostingsBlocks of termid, or None if a segment
+        holding it has no block table.
+        """
+        blocks_ls = []
+        for reader, base in zip(self.readers, self.bases):
+            if termid in reader:
+                blocks = reader.get_blocks(termid, base)
+                if blocks is None:
+                    return None
+                blocks_ls.append(blocks)
+        if not blocks_ls:
+            raise KeyError("Termid {} not found.".format(str(termid)))
+        return PostingsBlocks.concat(blocks_ls)
+
+    def get(self, termid):
+        """Decodes and returns the postings list of termid as a pair of uint32
+        arrays (docids, counts).
+        """
+        docids_ls, counts_ls = [], []
+        for reader, base in zip(self.readers, self.bases):
+            if termid in reader:
+                docids, counts = reader.get(termid)
+                docids_ls.append(docids + np.uint32(base))
+                counts_ls.append(counts)
+        if not docids_ls:
+            raise KeyError("Termid {} not found.".format(str(termid)))
+        if len(docids_ls) == 1:
+            return docids_ls[0], counts_ls[0]
+        return np.concatenate(docids_ls), np.concatenate(counts_ls)
+
+    def items(self):
+        """Yields (termid, (docids, counts)) for every term, in termid order"""
+        for termid in self.termids().tolist():
+            yield termid, self.get(termid)
+
+
+class SegmentedStore(object):
+    """Docid keyed store (MetaStore, SnippetStore) over the stores of the
+    base index and the segments, bases being the docid offset of each.
+    """
+    def __init__(self, stores, bases):
+        self.stores = stores
+        self.bases = bases
+
+    def locate(self, docid):
+        """Returns (store, local docid) of a global docid"""
+        i = max(bisect.bisect_left(self.bases, docid) - 1, 0)
+        return self.stores[i], docid - self.bases[i]
+
+    def __contains__(self, docid):
+        store, local_docid = self.locate(docid)
+        return local_docid in store
+
+    def get(self, docid, *args):
+        store, local_docid = self.locate(docid)
+        return store.get(local_docid, *args)
+
+
+class SegmentedMetaStore(SegmentedStore):
+    """SegmentedStore of MetaStores, MetaData get their global docid"""
+    def get(self, docid, *args):
+        metadata = super(SegmentedMetaStore, self).get(docid, *args)
+        metadata.docid = docid
+        return metadata
@@ -0,0 +1,296 @@
+"""
+Document-partitioned (sharded) index and scatter-gather BM25 ranking.
+
+IndexEngine.py --shards N deals the docs of a collection round robin to N
+shards, each a full index dir <index_wd>/shard_000, shard_001...: doc i of
+the collection (from 1) is local docid (i-1)//N + 1 of shard (i-1) % N, so
+the global docids (see global_docid) are those of a single index of the
+collection.  <index_wd>/shards.p lists the shards and <shard_wd>/shard.p
+holds the number of the shard and of shards.
+
+A ShardWorker answers requests for one shard, served by shard_service.py
+over a socket, locally (start_local_shards) or on another host.  The
+ShardCoordinator runs a query in two rounds, each request being sent to
+every shard before any answer is read so the shards work in parallel:
+1. df: the df of the query tokens in each shard, summed.
+2. search: each shard ranks its docs with BM25 using the N and avg_dl of
+   the collection (from the coll_len and coll_token_sum of all shards,
+   gathered once) and the summed dfs, and returns its k best.
+Merged by decreasing score then increasing docid, the k best of the shard
+lists are those of a single index run of the collection, same scores.
+
+Protocol: requests and responses are JSON objects, one per line, on a
+connection kept open.  A request {"op": <op>, ...} gets {"ok": true, ...}
+or {"ok": false, "error": <message>}:
+- {"op": "stats"} -> coll_len, coll_token_sum, shard, n_shards
+- {"op": "df", "q"} -> dfs (query token: df in the shard)
+- {"op": "search", "q", "k", "k1", "b", "k2", "coll_len", "coll_token_sum",
+  "dfs"} -> results, [docid, score, docno] lists with global docids
+
+Contains:
+
+Methods:
+- shard_name(shard)
+- global_docid(local_docid, shard, n_shards)
+- save_shards(index_wd, n_shards)
+- load_shards(index_wd)
+- send_message(wfile, message)
+- read_message(rfile)
+- serve_shard(shard_wd, host, port, ready)
+- start_local_shards(index_wd, host)
+
+Classes:
+- ShardWorker
+- ShardClient
+- ShardCoordinator
+"""
+import os
+import json
+import pickle
+import socket
+import asyncio
+import functools
+import multiprocessing as mp
+from collections import Counter
+from index_helpers import Query
+from bm25_helpers import BM25Scorer
+
+SHARDS_FILE = 'shards.p'
+SHARD_FILE = 'shard.p'
+
+
+def shard_name(shard):
+    """Name of the index dir of shard number shard"""
+    return 'shard_{:03d}'.format(shard)
+
+def global_docid(local_docid, shard, n_shards):
+    """Docid in the collection of local_docid of shard"""
+    return (local_docid - 1)*n_shards + shard + 1
+
+def save_shards(index_wd, n_shards):
+    """Writes shards.p and the shard.p of every shard"""
+    names = [shard_name(shard) for shard in range(n_shards)]
+    for shard, name in enumerate(names):
+        with open(os.path.join(index_wd, name, SHARD_FILE), 'wb') as f:
+            pickle.dump({'shard': shard, 'n_shards': n_shards}, f)
+    with open(os.path.join(index_wd, SHARDS_FILE), 'wb') as f:
+        pickle.dump({'n_shards': n_shards, 'shards': names}, f)
+
+def load_shards(index_wd):
+    """Returns the index dirs of the shards of index_wd, in shard order"""
+    with open(os.path.join(index_wd, SHARDS_FILE), 'rb') as f:
+        shards = pickle.load(f)
+    return [os.path.join(index_wd, name) for name in shards['shards']]
+
+def send_message(wfile, message):
+    """Writes message (a dict) as a JSON line"""
+    wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+    wfile.flush()
+
+def read_message(rfile):
+    """Reads a JSON line, raises ConnectionError once the peer is gone"""
+    line = rfile.readline()
+    if not line:
+        raise ConnectionError("Connection closed by the shard.")
+    return json.loads(line)
+
+
+class ShardWorker(object):
+    """Answers the requests of the coordinator for the shard at shard_wd,
+    query_kwargs are passed to its Query.
+    """
+    def __init__(self, shard_wd, **query_kwargs):
+        with open(os.path.join(shard_wd, SHARD_FILE), 'rb') as f:
+            info = pickle.load(f)
+        self.shard = info['shard']
+        self.n_shards = info['n_shards']
+        self.query = Query(shard_wd, **query_kwargs)
+        # (k1, b, k2, coll_len, coll_token_sum): BM25Scorer
+        self.scorers = {}
+
+    def stats(self):
+        invIndex = self.query.invIndex
+        return {'coll_len': invIndex.coll_len,
+                'coll_token_sum': invIndex.coll_token_sum,
+                'shard': self.shard, 'n_shards': self.n_shards}
+
+    def dfs(self, query_str):
+        """Returns the df in the shard of the query tokens found in it"""
+        dfs = {}
+        for token in self.query.tokenize(query_str):
+            termid = self.query.lexicon.get_termid(token)
+            if termid is not None:
+                dfs[token] = self.query.invIndex.df(termid)
+        return dfs
+
+    def search(self, query_str, dfs, coll_len, coll_token_sum, k=10, k1=1.2,
+               b=0.75, k2=7):
+        """BM25 ranking of the shard's docs with the collection stats.
+        Returns: list of the k best (global docid, score, docno)
+        """
+        tokens = self.query.tokenize(query_str)
+        termid_dfs = {}
+        for token in tokens:
+            termid = self.query.lexicon.get_termid(token)
+            if termid is not None:
+                termid_dfs[termid] = dfs[token]
+        key = (k1, b, k2, coll_len, coll_token_sum)
+        if key not in self.scorers:
+            self.scorers[key] = BM25Scorer(self.query.invIndex,
+                self.query.norm_lens, k1=k1, b=b, k2=k2,
+                coll_stats=(coll_len, coll_token_sum),
+                quantized=self.query.quantized_norms)
+        ranked = self.scorers[key].rank(
+            self.query.lexicon.conv_tokens_vect(tokens), k, dfs=termid_dfs)
+        docid_to_docno = self.query.docid_to_docno
+        return [(global_docid(docid, self.shard, self.n_shards), score,
+                 docid_to_docno[docid].strip()) for docid, score in ranked]
+
+    def handle(self, request):
+        """Returns the response (without ok) to a request"""
+        op = request.get('op')
+        if op == 'stats':
+            return self.stats()
+        if op == 'df':
+            return {'dfs': self.dfs(request['q'])}
+        if op == 'search':
+            return {'results': self.search(request['q'], request['dfs'],
+                request['coll_len'], request['coll_token_sum'],
+                k=request['k'], k1=request['k1'], b=request['b'],
+                k2=request['k2'])}
+        raise ValueError("Unknown op: {}".format(op))
+
+
+async def serve_connection(worker, reader, writer):
+    """Answers the requests of one connection until it's closed, one at a
+    time (the scorers are per worker).
+    """
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                response = worker.handle(json.loads(line))
+                response['ok'] = True
+            except Exception as e:
+                response = {'ok': False, 'error': repr(e)}
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+def serve_shard(shard_wd, host='127.0.0.1', port=0, ready=None):
+    """Loads a ShardWorker and serves it forever on host:port (port 0 picks
+    a free one), the bound port is sent to ready (a Connection) if given.
+    """
+    worker = ShardWorker(shard_wd)
+
+    async def serve():
+        server = await asyncio.start_server(
+            functools.partial(serve_connection, worker), host, port)
+        bound = server.sockets[0].getsockname()[1]
+        if ready is not None:
+            ready.send(bound)
+            ready.close()
+        else:
+            print("Serving shard {} of {} ({}) on {}:{}".format(worker.shard,
+                  worker.n_shards, shard_wd, host, bound))
+        async with server:
+            await server.serve_forever()
+    asyncio.run(serve())
+
+def start_local_shards(index_wd, host='127.0.0.1'):
+    """Starts a worker process per shard of index_wd, loading in parallel.
+    Returns: (processes, (host, port) addresses) in shard order
+    """
+    procs, conns = [], []
+    for shard_wd in load_shards(index_wd):
+        conn, child_conn = mp.Pipe(duplex=False)
+        proc = mp.Process(target=serve_shard,
+                          args=(shard_wd, host, 0, child_conn))
+        proc.daemon = True
+        proc.start()
+        child_conn.close()
+        procs.append(proc)
+        conns.append(conn)
+    addresses = []
+    for shard_wd, conn in zip(load_shards(index_wd), conns):
+        try:
+            addresses.append((host, conn.recv()))
+        except EOFError:
+            for proc in procs:
+                proc.terminate()
+            raise RuntimeError("Shard worker of {} failed to start."
+                               .format(shard_wd))
+    return procs, addresses
+
+
+class ShardClient(object):
+    """Connection to a shard worker at address (host, port)"""
+    def __init__(self, address, timeout=10.0):
+        self.address = address
+        self.sock = socket.create_connection(address, timeout=timeout)
+        self.rfile = self.sock.makefile('rb')
+        self.wfile = self.sock.makefile('wb')
+
+    def send(self, request):
+        send_message(self.wfile, request)
+
+    def receive(self):
+        """Returns the response to the oldest request not yet received"""
+        response = read_message(self.rfile)
+        if not response.pop('ok'):
+            raise RuntimeError("Shard {}:{} failed: {}".format(*self.address,
+                               response['error']))
+        return response
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+
+class ShardCoordinator(object):
+    """Scatter-gather BM25 over the shard workers at addresses, any order.
+    Checks every shard of the collection is there, once.
+    """
+    def __init__(self, addresses, timeout=10.0):
+        self.clients = [ShardClient(address, timeout) for address in addresses]
+        stats = self.gather({'op': 'stats'})
+        self.n_shards = stats[0]['n_shards']
+        if sorted(shard['shard'] for shard in stats) != list(range(
+                self.n_shards)):
+            self.close()
+            raise ValueError("Expected one worker for each of the {} shards, "
+                             "got shards {}.".format(self.n_shards,
+                             [shard['shard'] for shard in stats]))
+        self.coll_len = sum(shard['coll_len'] for shard in stats)
+        self.coll_token_sum = sum(shard['coll_token_sum'] for shard in stats)
+
+    def gather(self, request):
+        """Sends request to every shard, then returns their responses"""
+        for client in self.clients:
+            client.send(request)
+        return [client.receive() for client in self.clients]
+
+    def search(self, query_str, k=10, k1=1.2, b=0.75, k2=7):
+        """Runs a BM25 ranked query against every shard.
+        Returns: list of the k best (docid, score, docno)
+        """
+        dfs = Counter()
+        for response in self.gather({'op': 'df', 'q': query_str}):
+            dfs.update(response['dfs'])
+        responses = self.gather({'op': 'search', 'q': query_str, 'k': k,
+            'k1': k1, 'b': b, 'k2': k2, 'coll_len': self.coll_len,
+            'coll_token_sum': self.coll_token_sum, 'dfs': dfs})
+        results = [tuple(result) for response in responses
+                   for result in response['results']]
+        results.sort(key=lambda result: (-result[1], result[0]))
+        return results[:k]
+
+    def close(self):
+        for client in self.clients:
+            client.close()
@@ -0,0 +1,36 @@
+"""Shard worker of a document-partitioned index.
+
+Serves one shard built by IndexEngine.py --shards to a ShardCoordinator over
+the JSON lines socket protocol of shard_helpers.  Run one per shard, on the
+hosts holding them; sharded_retrieval.py starts them as local processes
+when no hosts are given.
+
+Example
+-------
+literal blocks::
+    $ python shard_service.py <shard_wd> [--host 127.0.0.1] [--port 9000]
+
+    $ python shard_service.py /Users/nikhilarora/data/latimes/index_dir_shards/shard_000 --host 0.0.0.0 --port 9000
+"""
+import os
+import sys
+import argparse
+from shard_helpers import serve_shard, SHARD_FILE
+
+parser = argparse.ArgumentParser(description='Serves one shard of a sharded \
+    index to a coordinator.')
+parser.add_argument('shard_wd', help='Path to the shard index')
+parser.add_argument('--host', default='127.0.0.1', help='Address to bind')
+parser.add_argument('--port', type=int, default=9000, help='Port to bind')
+
+
+if __name__ == '__main__':
+    cli = parser.parse_args()
+    if not os.path.isfile(os.path.join(cli.shard_wd, SHARD_FILE)):
+        print('Current dir: {} does not hold a shard.'.format(cli.shard_wd))
+        print('Exiting program.')
+        sys.exit()
+    try:
+        serve_shard(cli.shard_wd, cli.host, cli.port)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,130 @@
+"""Runs every topic of a queries file against a sharded index and writes a
+TREC run.
+
+Queries are ranked by a ShardCoordinator (see shard_helpers) fanning them out
+to the shard workers, given with --hosts (shard_service.py) or else started
+as local processes, one per shard of index_wd.  Scores use the collection
+wide df, N and avg_dl so the run is the same as batch_retrieval.py's on a
+single index of the collection.
+
+Example
+-------
+literal blocks::
+    $ python sharded_retrieval.py <index_wd> <queries_file> <output_file>
+        [-k 1000] [--hosts host:port,host:port...] [--run-tag TAG]
+
+    $ python sharded_retrieval.py /Users/nikhilarora/data/latimes/index_dir_shards /Users/nikhilarora/data/latimes/queries.txt /Users/nikhilarora/data/latimes/n5arora-hw4-bm25-shards.txt
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from index_helpers import timing, read_queries
+from shard_helpers import ShardCoordinator, start_local_shards, SHARDS_FILE
+
+parser = argparse.ArgumentParser(description='Runs a queries file against a \
+    sharded index and writes the TREC run.')
+parser.add_argument('index_wd', help='Path to the sharded index')
+parser.add_argument('queries_file', help='Path to the queries file')
+parser.add_argument('output_file', help='Path of the TREC run written')
+parser.add_argument('-k', type=int, default=1000,
+    help='Number of BM25 results per topic')
+parser.add_argument('--hosts', default=None,
+    help='Comma separated host:port of the shard workers, local worker \
+    processes are started if not given')
+parser.add_argument('--timeout', type=float, default=10.0,
+    help='Seconds to wait for a shard')
+parser.add_argument('--run-tag', default='n5aroraBM25STEM', help='Run tag')
+
+res_doc_str = "{topid} q0 {docno} {rank} {score} {run_tag}\n"
+
+
+@timing
+def sharded_retrieval(index_wd, queries_file, output_file, k=1000,
+                      hosts=None, timeout=10.0, run_tag='n5aroraBM25STEM'):
+    """Runs every topic of queries_file against the shards and writes the
+    TREC run.
+
+    Parameters
+    ----------
+    index_wd : str
+        path to the sharded index, its shards are served locally unless
+        hosts are given
+    queries_file : str
+        file of alternating topic id and query lines
+    output_file : str
+        path of the run written, topics in queries file order
+    k : int
+        BM25 results per topic
+    hosts : list, optional
+        (host, port) of the shard workers
+    timeout : float
+    run_tag : str
+
+    Returns
+    -------
+    list of the per topic latencies (seconds)
+    """
+    queries = read_queries(queries_file)
+    procs = []
+    if hosts is None:
+        procs, hosts = start_local_shards(index_wd)
+        print("Started {} local shard workers".format(len(procs)))
+    coordinator = ShardCoordinator(hosts, timeout=timeout)
+    latencies = []
+    try:
+        with open(output_file, 'w', buffering=1024*1024) as wfile:
+            for topid, query_str in queries.items():
+                time1 = time.perf_counter()
+                ranked = coordinator.search(query_str, k=k, k1=1.2, b=0.75,
+                                            k2=7)
+                latencies.append(time.perf_counter() - time1)
+                wfile.write(''.join(res_doc_str.format(topid=topid,
+                    docno=docno, rank=rank, score=score, run_tag=run_tag)
+                    for rank, (_, score, docno) in enumerate(ranked, start=1)))
+    finally:
+        coordinator.close()
+        for proc in procs:
+            proc.terminate()
+            proc.join()
+
+    ms = np.array(latencies)*1000
+    if len(ms):
+        print("{} topics over {} shards: mean {:.3f} ms  p50 {:.3f} ms  p95 "
+              "{:.3f} ms  max {:.3f} ms".format(len(ms), coordinator.n_shards,
+              ms.mean(), np.percentile(ms, 50), np.percentile(ms, 95),
+              ms.max()))
+    return latencies
+
+def parse_hosts(hosts):
+    """'host:port,host:port' -> [(host, port), ...]"""
+    addresses = []
+    for address in hosts.split(','):
+        host, _, port = address.strip().rpartition(':')
+        addresses.append((host, int(port)))
+    return addresses
+
+def validate_args(cli):
+    if cli.hosts is None and not os.path.isfile(os.path.join(cli.index_wd,
+                                                             SHARDS_FILE)):
+        print("Index dir: {} does not hold a sharded index.".format(
+              cli.index_wd))
+        sys.exit()
+    if not os.path.isfile(cli.queries_file):
+        print("Queries file: {} does not exist.".format(cli.queries_file))
+        sys.exit()
+    if cli.hosts is not None:
+        try:
+            parse_hosts(cli.hosts)
+        except ValueError:
+            print("--hosts must be comma separated host:port.")
+            sys.exit()
+
+if __name__ == '__main__':
+    cli = parser.parse_args()
+    validate_args(cli)
+    hosts = None if cli.hosts is None else parse_hosts(cli.hosts)
+    sharded_retrieval(cli.index_wd, cli.queries_file, cli.output_file,
+                      k=cli.k, hosts=hosts, timeout=cli.timeout,
+                      run_tag=cli.run_tag)
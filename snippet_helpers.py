@@ -0,0 +1,224 @@
+"""
+Query-biased snippets built from sentence boundaries stored at index time.
+
+IndexEngine.py splits the TEXT of every doc into sentences while parsing and
+SnippetStore keeps, per docid:
+- sentences.bin/_offsets.npy : the byte offset where each sentence ends
+                 followed by the utf-8 TEXT (see encode_sentences).
+- sentence_termids.bin/_offsets.npy : where the termids of each sentence end
+                 followed by the termids (see encode_termids), written once
+                 the Lexicon is built.
+
+Sentences end at the whitespace following ., ! or ? (and any closing quotes
+or brackets), so tokenizing them one by one gives the TEXT tokens of the doc.
+
+A snippet is made of the max_sentences sentences with the largest sum of the
+weights of the distinct query termids they hold (ties: more query term
+occurrences, then earlier sentences).  Sentences without query terms are
+left out, unless none has any and the lead sentences are shown.  They are
+shown in doc order, long ones from just before their first query term, with
+the query terms highlighted.  Only the chosen sentences are tokenized again
+and no xml is parsed.
+
+Contains:
+
+Methods:
+- split_sentences(text)
+- encode_sentences(text)
+- decode_sentences(record)
+- encode_termids(sentence_termids)
+- decode_termids(record)
+- best_sentences(sentence_termids, weights, max_sentences)
+- excerpt(sentence, terms, tokenize, width, marks)
+- make_snippet(sentences, sentence_termids, weights, terms, tokenize,
+               max_sentences, max_chars, marks)
+
+Classes:
+- SnippetStore
+"""
+import re
+import heapq
+import struct
+import numpy as np
+from record_helpers import RecordWriter, RecordReader
+
+SENTENCE_END_RE = re.compile(r'[.!?]+[\'")\]]*\s+')
+COUNT = struct.Struct('<I')
+MARKS = ('**', '**')
+LEAD_WORDS = 3 # words shown before the first query term of a long sentence
+
+
+def split_sentences(text):
+    """Returns the (char) offsets where the sentences of text end"""
+    if not text.strip():
+        return []
+    ends = [match.end() for match in SENTENCE_END_RE.finditer(text)]
+    if not ends or ends[-1] < len(text):
+        ends.append(len(text))
+    return ends
+
+def _pack(ends, data):
+    """COUNT, the uint32 ends then data"""
+    return b''.join([COUNT.pack(len(ends)),
+                     np.asarray(ends, dtype=np.uint32).tobytes(), data])
+
+def _unpack(record):
+    """Inverse of _pack, returns (ends list, data memoryview)"""
+    record = memoryview(record)
+    n = COUNT.unpack_from(record)[0]
+    ends = np.frombuffer(record, dtype=np.uint32, count=n,
+                         offset=COUNT.size).tolist()
+    return ends, record[COUNT.size + 4*n:]
+
+def encode_sentences(text):
+    """Packs text and its sentence boundaries into a SnippetStore record"""
+    char_ends = split_sentences(text)
+    parts = [text[start:end].encode('utf-8') for start, end in
+             zip([0] + char_ends[:-1], char_ends)]
+    return _pack(np.cumsum([len(part) for part in parts]), b''.join(parts))
+
+def decode_sentences(record):
+    """Returns the list of sentences of a record of encode_sentences"""
+    ends, data = _unpack(record)
+    data = bytes(data)
+    return [data[start:end].decode('utf-8') for start, end in
+            zip([0] + ends[:-1], ends)]
+
+def encode_termids(sentence_termids):
+    """Packs the termid lists of the sentences of a doc"""
+    return _pack(np.cumsum([len(termids) for termids in sentence_termids]),
+                 np.array([termid for termids in sentence_termids
+                           for termid in termids], dtype=np.uint32).tobytes())
+
+def decode_termids(record):
+    """Returns the termid lists of the sentences of a record of
+    encode_termids
+    """
+    ends, data = _unpack(record)
+    termids = np.frombuffer(data, dtype=np.uint32).tolist()
+    return [termids[start:end] for start, end in zip([0] + ends[:-1], ends)]
+
+def best_sentences(sentence_termids, weights, max_sentences=2):
+    """Returns the positions, in doc order, of the max_sentences best
+    sentences for the query termids of weights (termid: weight), only those
+    holding a query termid if any does.
+    """
+    def score(pos):
+        termids = sentence_termids[pos]
+        hits = [termid for termid in termids if termid in weights]
+        return (sum(weights[termid] for termid in set(hits)), len(hits), -pos)
+    best = heapq.nlargest(max_sentences, range(len(sentence_termids)),
+                          key=score)
+    matched = [pos for pos in best if score(pos)[1] > 0]
+    return sorted(matched or best)
+
+def excerpt(sentence, terms, tokenize, width, marks=MARKS):
+    """Returns about width chars of sentence, from LEAD_WORDS words before
+    its first word whose token is in terms, such words being surrounded with
+    marks.
+    """
+    words = sentence.split()
+    tokens = tokenize(sentence)
+    if len(tokens) != len(words):
+        # some words are only punctuation and have no token:
+        tokens = [''.join(tokenize(word)) for word in words]
+    hits = [i for i, token in enumerate(tokens) if token in terms]
+    start = max(hits[0] - LEAD_WORDS, 0) if hits else 0
+    end = start
+    n_chars = 0
+    while end < len(words) and (end == start or
+                                n_chars + len(words[end]) <= width):
+        n_chars += len(words[end]) + 1
+        end += 1
+    hits = set(hits)
+    text = ' '.join(marks[0] + words[i] + marks[1] if i in hits else words[i]
+                    for i in range(start, end))
+    if start > 0:
+        text = '...' + text
+    if end < len(words):
+        text += '...'
+    return text
+
+def make_snippet(sentences, sentence_termids, weights, terms, tokenize,
+                 max_sentences=2, max_chars=200, marks=MARKS):
+    """Returns the query-biased snippet of a doc.
+
+    Parameters
+    ----------
+    sentences : list of str
+    sentence_termids : list of list of int
+        the termids of each sentence
+    weights : dict
+        termid: weight of the query termids
+    terms : set
+        query tokens, words tokenized to one of them are highlighted
+    tokenize : callable
+        str -> tokens, as the index was tokenized
+    max_sentences : int
+    max_chars : int
+        length of the snippet without the marks (about)
+    marks : (str, str)
+        put before and after the highlighted words
+    """
+    positions = best_sentences(sentence_termids, weights, max_sentences)
+    if not positions:
+        return ''
+    width = max_chars//len(positions)
+    return ' '.join(excerpt(sentences[pos], terms, tokenize, width, marks)
+                    for pos in positions)
+
+
+class SnippetStore(object):
+    """Docid keyed sentences of the TEXT of the docs and their termids"""
+    def __init__(self, save_path):
+        self.save_path = save_path
+        self.writer = None
+        self.sentences = None # RecordReader of the sentences
+        self.termids = None # RecordReader of the sentence termids
+
+    def exists(self):
+        """True if both stores were written to save_path"""
+        return (RecordReader.exists(self.save_path, 'sentences') and
+                RecordReader.exists(self.save_path, 'sentence_termids'))
+
+    def open_writer(self):
+        """Starts a new store, records are then added in docid order"""
+        self.writer = RecordWriter(self.save_path, 'sentences')
+
+    def add(self, docid, record):
+        """Appends the encode_sentences record of docid"""
+        self.writer.add(docid, record)
+
+    def close(self):
+        """Writes the offsets of the added records"""
+        self.writer.close()
+        self.writer = None
+
+    def write_termids(self, get_termid, tokenize):
+        """Writes the termids of every stored sentence.
+
+        Parameters
+        ----------
+        get_termid : callable
+            term -> termid, of the Lexicon of the index
+        tokenize : callable
+            str -> tokens, as the docs were tokenized
+        """
+        sentences = RecordReader(self.save_path, 'sentences')
+        writer = RecordWriter(self.save_path, 'sentence_termids')
+        for docid in range(len(sentences)):
+            if docid in sentences:
+                writer.add(docid, encode_termids(
+                    [list(map(get_termid, tokenize(sentence))) for sentence
+                     in decode_sentences(sentences.get(docid))]))
+        writer.close()
+
+    def load(self):
+        """Memory-maps the stores"""
+        self.sentences = RecordReader(self.save_path, 'sentences')
+        self.termids = RecordReader(self.save_path, 'sentence_termids')
+
+    def get(self, docid):
+        """Returns (sentences, sentence termids) of docid"""
+        return (decode_sentences(self.sentences.get(docid)),
+                decode_termids(self.termids.get(docid)))
@@ -0,0 +1,161 @@
+"""
+Single-pass in-memory indexing (SPIMI) helpers used to build the inverted
+index within a fixed memory budget.
+
+Postings are accumulated per term (keyed by the term string, so no lexicon is
+needed up front) until the estimated size of the in-memory block reaches the
+budget.  The block is then sorted by term and flushed to disk as a run.  The
+collection frequency of every term is kept across runs so that, once all
+documents are processed, the Lexicon's termids can be assigned before the
+runs are k-way merged into the final Lexicon/InvIndex.
+
+Contains:
+
+Methods:
+- write_run(run_path, block)
+- read_run(run_path)
+- merge_runs(runs)
+
+Classes:
+- SpimiBlock
+- SpimiIndexer
+"""
+import os
+import heapq
+import pickle
+import shutil
+import itertools
+from array import array
+from collections import Counter
+from operator import itemgetter
+
+# rough per item costs used to estimate the size of an in-memory block:
+TERM_OVERHEAD = 200 # dict slot, str obj and the two array objs of a new term
+POSTING_SIZE = 8 # one docid and one count stored as 4 byte unsigned ints
+
+
+def write_run(run_path, block):
+    """Writes a block of postings, sorted by term, to run_path as a stream of
+    pickled (term, docids, counts) records.
+    """
+    with open(run_path, 'wb') as f:
+        pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+        for term in sorted(block):
+            docids, counts = block[term]
+            pickler.dump((term, docids, counts))
+            # records are independent, don't let the memo grow with the run:
+            pickler.clear_memo()
+
+def read_run(run_path):
+    """Yields the (term, docids, counts) records of a run written by
+    write_run, in term order.
+    """
+    with open(run_path, 'rb') as f:
+        unpickler = pickle.Unpickler(f)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                break
+
+def merge_runs(runs):
+    """k-way merges runs (iterables of (term, docids, counts) sorted by term)
+    and yields one (term, docids, counts) record per distinct term.
+
+    Notes
+    -----
+    Runs must be passed in docid order: heapq.merge breaks ties on the term
+    using the position of the run, so the concatenated postings stay sorted
+    by docid.
+    """
+    merged = heapq.merge(*runs, key=itemgetter(0))
+    for term, records in itertools.groupby(merged, key=itemgetter(0)):
+        docids = array('I')
+        counts = array('I')
+        for _, r_docids, r_counts in records:
+            docids.extend(r_docids)
+            counts.extend(r_counts)
+        yield term, docids, counts
+
+
+class SpimiBlock(object):
+    """In-memory block of postings keyed by term string."""
+    def __init__(self):
+        self.postings = {} # term: (docids array, counts array)
+        self.est_bytes = 0
+
+    def __len__(self):
+        return len(self.postings)
+
+    def add_doc(self, docid, term_counts):
+        """Appends the postings of a single document to the block."""
+        for term, count in term_counts.items():
+            if term not in self.postings:
+                self.postings[term] = (array('I'), array('I'))
+                self.est_bytes += TERM_OVERHEAD + len(term)
+            docids, counts = self.postings[term]
+            docids.append(docid)
+            counts.append(count)
+        self.est_bytes += POSTING_SIZE * len(term_counts)
+
+
+class SpimiIndexer(object):
+    """Builds the postings of a collection within mem_budget bytes by
+    flushing sorted runs to <index_wd>/spimi_runs and merging them at the end.
+    """
+    def __init__(self, index_wd, mem_budget):
+        self.runs_dir = os.path.join(index_wd, 'spimi_runs')
+        self.mem_budget = mem_budget
+        self.block = SpimiBlock()
+        self.run_paths = []
+        self.term_cfs = Counter() # term: collection frequency
+
+    def add_doc(self, docid, tokens):
+        """Adds a parsed document, docids must be passed in increasing order."""
+        term_counts = Counter(tokens)
+        self.term_cfs.update(term_counts)
+        self.block.add_doc(docid, term_counts)
+        if self.block.est_bytes >= self.mem_budget:
+            self.flush()
+
+    def flush(self):
+        """Writes the current block out as a run and starts a new one."""
+        if len(self.block) == 0:
+            return
+        if not os.path.exists(self.runs_dir):
+            os.makedirs(self.runs_dir)
+        run_path = os.path.join(self.runs_dir,
+            'run_{:05d}'.format(len(self.run_paths)))
+        print("Flushing SPIMI run: {} ({} terms)".format(run_path,
+            len(self.block)))
+        write_run(run_path, self.block.postings)
+        self.run_paths.append(run_path)
+        self.block = SpimiBlock()
+
+    def merged_postings(self):
+        """Yields (term, docids, counts) for every term of the collection in
+        term order, merging the flushed runs with the block still in memory.
+        """
+        block = self.block.postings
+        last_run = ((term,) + block[term] for term in sorted(block))
+        runs = [read_run(run_path) for run_path in self.run_paths]
+        runs.append(last_run)
+        for record in merge_runs(runs):
+            yield record
+        self.block = SpimiBlock()
+
+    def merge_into(self, lexicon, invIndex):
+        """Merges all postings into lexicon and invIndex then removes the runs."""
+        print("Merging {} SPIMI runs".format(len(self.run_paths)))
+        lexicon.assign_termids(self.term_cfs)
+        for term, docids, counts in self.merged_postings():
+            termid = lexicon.term_2_termid[term]
+            lexicon.set_df(termid, len(docids))
+            invIndex.add_postings_list(termid, docids, counts)
+        self.cleanup()
+
+    def cleanup(self):
+        """Removes any runs written to disk."""
+        if os.path.isdir(self.runs_dir):
+            shutil.rmtree(self.runs_dir)
+        self.run_paths = []
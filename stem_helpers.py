@@ -0,0 +1,93 @@
+"""
+Word level Porter stemming with a memo table.
+
+Tokens are stemmed as wholes: a token is looked up in the table and only
+stemmed (once) when it's new, so the stemmer runs once per distinct word
+instead of once per occurrence.  Within a token every run of letters is
+stemmed and the other chars are kept, as the original char by char
+_stem_string did.
+
+The table is bounded by max_size entries, once full new words are still
+stemmed but no longer stored.  IndexEngine.py --stem saves the table built
+while indexing to <index_wd>/stem_table.p, which also marks the index as
+stemmed: Query then loads it and stems the query tokens with it.
+
+Contains:
+
+Classes:
+- StemTable
+- Stemmer
+"""
+import os
+import pickle
+import itertools
+from porterstem import PorterStemmer
+
+MAX_STEMS = 2**20
+
+
+class StemTable(dict):
+    """token: stemmed token dict, a missing token is stemmed with stem (and
+    stored while the table has less than max_size entries).
+    """
+    def __init__(self, stem, max_size):
+        super(StemTable, self).__init__()
+        self.stem = stem
+        self.max_size = max_size
+
+    def __missing__(self, token):
+        stem = self.stem(token)
+        if len(self) < self.max_size:
+            self[token] = stem
+        return stem
+
+
+class Stemmer(object):
+    """Memoized Porter stemmer, save_path is the index dir of the table."""
+    def __init__(self, save_path=None, max_size=MAX_STEMS):
+        self.table_path = None
+        if save_path is not None:
+            self.table_path = os.path.join(save_path, 'stem_table.p')
+        self.porter = PorterStemmer()
+        self.table = StemTable(self.stem_letters, max_size)
+
+    def exists(self):
+        """True if a stem table was saved to save_path"""
+        return self.table_path is not None and os.path.isfile(self.table_path)
+
+    def save(self):
+        """Writes the stem table (as a plain dict)"""
+        with open(self.table_path, 'wb') as f:
+            pickle.dump(dict(self.table), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self):
+        """Loads a saved stem table"""
+        with open(self.table_path, 'rb') as f:
+            self.update(pickle.load(f))
+
+    def update(self, table):
+        """Adds the entries of another table, within max_size"""
+        for token, stem in table.items():
+            if len(self.table) >= self.table.max_size:
+                break
+            self.table.setdefault(token, stem)
+
+    def stem_word(self, word):
+        """Stems a word made only of letters"""
+        return self.porter.stem(word, 0, len(word) - 1)
+
+    def stem_letters(self, token):
+        """Stems every run of letters of token, without the table"""
+        if token.isalpha():
+            return self.stem_word(token)
+        return ''.join(self.stem_word(''.join(chars)) if is_alpha
+                       else ''.join(chars) for is_alpha, chars in
+                       itertools.groupby(token, str.isalpha))
+
+    def stem_token(self, token):
+        """Stems token through the table"""
+        return self.table[token]
+
+    def stem_tokens(self, tokens):
+        """Returns the list of stemmed tokens"""
+        return list(map(self.table.__getitem__, tokens))